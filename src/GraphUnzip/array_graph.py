@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File dedicated to a columnar representation of the assembly graph, as an alternative to lists of Segment objects.
+
+Nodes are the equivalent of segments: each node is a run of subcontigs, stored contiguously in the subcontig arrays.
+Links are stored once, as an edge list (node0, end0, node1, end1, CIGAR), from which a CSR adjacency is rebuilt when needed.
+Contig names and CIGARs are stored once in tables and referred to by their index.
+Deleted nodes and edges are only flagged (tombstones) until compact() is called.
+"""
+
+import numpy as np
+
+from segment import Segment
+
+#an array that grows by doubling its capacity, to append rows without copying the whole column each time
+class Column :
+
+    def __init__(self, dtype, capacity = 16) :
+        self._data = np.zeros(capacity, dtype = dtype)
+        self.size = 0
+
+    def extend(self, values) :
+        values = np.asarray(values, dtype = self._data.dtype)
+        if self.size + len(values) > len(self._data) :
+            newData = np.zeros(max(2*len(self._data), self.size + len(values)), dtype = self._data.dtype)
+            newData[:self.size] = self._data[:self.size]
+            self._data = newData
+        self._data[self.size:self.size+len(values)] = values
+        self.size += len(values)
+
+    def reset(self, values) :
+        self._data = np.array(values, dtype = self._data.dtype)
+        self.size = len(values)
+
+    @property
+    def array(self) :
+        return self._data[:self.size]
+
+class ArrayGraph :
+
+    def __init__(self) :
+
+        self.contig_names = [] #name of each contig, as in the GFA
+        self.contig_index = {} #associates a contig name with its index in contig_names
+        self.cigars = [] #CIGAR strings, stored once
+        self.cigar_index = {}
+
+        #subcontigs: node n is made of the subcontigs node_start[n] to node_start[n]+node_size[n]-1
+        self.sub_contig = Column(np.int32)
+        self.sub_orientation = Column(np.int8) #1 being '+' orientation, 0 the '-' orientation
+        self.sub_length = Column(np.int64)
+        self.sub_depth = Column(np.float64)
+        self.sub_insideCIGAR = Column(np.int32) #CIGAR between this subcontig and the next one in the node, -1 for the last subcontig of a node
+
+        #nodes
+        self.node_start = Column(np.int64)
+        self.node_size = Column(np.int32)
+        self.node_HiCcoverage = Column(np.float64)
+        self.node_alive = Column(np.bool_)
+
+        #edges, linking end0 of node0 with end1 of node1 (end 0 being the left end, 1 the right end)
+        self.edge_node0 = Column(np.int32)
+        self.edge_end0 = Column(np.int8)
+        self.edge_node1 = Column(np.int32)
+        self.edge_end1 = Column(np.int8)
+        self.edge_cigar = Column(np.int32)
+        self.edge_alive = Column(np.bool_)
+
+        self._adjacency = None #CSR adjacency, rebuilt lazily after each modification of the edges
+
+    @property
+    def number_of_nodes(self) :
+        return self.node_start.size
+
+    def id_of_cigar(self, CIGAR) :
+        if CIGAR not in self.cigar_index :
+            self.cigar_index[CIGAR] = len(self.cigars)
+            self.cigars.append(CIGAR)
+        return self.cigar_index[CIGAR]
+
+    def id_of_contig(self, name) :
+        if name not in self.contig_index :
+            self.contig_index[name] = len(self.contig_names)
+            self.contig_names.append(name)
+        return self.contig_index[name]
+
+    #input : the subcontigs of the new node, as in the constructor of Segment
+    #output : the index of the new node
+    def add_node(self, names, orientations, lengths, depths = None, insideCIGARs = None, HiCcoverage = 0) :
+
+        if depths is None :
+            depths = [1 for i in names]
+        if insideCIGARs is None :
+            insideCIGARs = ['*' for i in range(len(names)-1)]
+
+        node = self.node_start.size
+        self.node_start.extend([self.sub_contig.size])
+        self.node_size.extend([len(names)])
+        self.node_HiCcoverage.extend([HiCcoverage])
+        self.node_alive.extend([True])
+
+        self.sub_contig.extend([self.id_of_contig(name) for name in names])
+        self.sub_orientation.extend(orientations)
+        self.sub_length.extend(lengths)
+        self.sub_depth.extend(depths)
+        self.sub_insideCIGAR.extend([self.id_of_cigar(c) for c in insideCIGARs] + [-1])
+
+        return node
+
+    #input : the edges to add, as arrays (or lists) of the same length. CIGARs are strings
+    def add_edges(self, nodes0, ends0, nodes1, ends1, CIGARs) :
+
+        self.edge_node0.extend(nodes0)
+        self.edge_end0.extend(ends0)
+        self.edge_node1.extend(nodes1)
+        self.edge_end1.extend(ends1)
+        self.edge_cigar.extend([self.id_of_cigar(c) for c in CIGARs])
+        self.edge_alive.extend(np.ones(len(CIGARs), dtype = np.bool_))
+        self._adjacency = None
+
+    def delete_edges(self, edges) :
+
+        self.edge_alive.array[edges] = False
+        self._adjacency = None
+
+    #delete the nodes and all the edges touching them
+    def delete_nodes(self, nodes) :
+
+        self.node_alive.array[nodes] = False
+        alive = self.node_alive.array
+        touching = ~alive[self.edge_node0.array] | ~alive[self.edge_node1.array]
+        self.delete_edges(np.nonzero(touching & self.edge_alive.array)[0])
+
+    #output : the CSR adjacency of the graph : (offsets, neighbors, ends of neighbors, edges)
+    #         the links of end e of node n are at offsets[2n+e]:offsets[2n+e+1] of the three other arrays, sorted by neighbor then end of neighbor, like the links of a Segment.
+    #         A link from one end of a node to the same end of the same node is listed twice, as add_link does on Segments
+    def adjacency(self) :
+
+        if self._adjacency is not None :
+            return self._adjacency
+
+        alive = np.nonzero(self.edge_alive.array)[0]
+        node0 = self.edge_node0.array[alive].astype(np.int64)
+        end0 = self.edge_end0.array[alive].astype(np.int64)
+        node1 = self.edge_node1.array[alive].astype(np.int64)
+        end1 = self.edge_end1.array[alive].astype(np.int64)
+
+        sources = np.concatenate((2*node0+end0, 2*node1+end1))
+        targets = np.concatenate((node1, node0))
+        target_ends = np.concatenate((end1, end0))
+        edges = np.concatenate((alive, alive))
+
+        order = np.lexsort((target_ends, targets, sources))
+        offsets = np.zeros(2*self.number_of_nodes+1, dtype = np.int64)
+        np.cumsum(np.bincount(sources, minlength = 2*self.number_of_nodes), out = offsets[1:])
+
+        self._adjacency = (offsets, targets[order], target_ends[order], edges[order])
+        return self._adjacency
+
+    #output : array of shape (number of nodes, 2) with the number of links at each end of each node
+    def degrees(self) :
+        offsets = self.adjacency()[0]
+        return np.diff(offsets).reshape(-1, 2)
+
+    #input : nodes to duplicate (a node can appear several times to create several copies) and optionally the fraction of the depth that goes to each copy
+    #output : the indices of the copies. Each copy has the same links as its original, a link of the original with itself becoming a link of the copy with itself
+    def duplicate_nodes(self, nodes, depth_fractions = None) :
+
+        nodes = np.asarray(nodes, dtype = np.int64)
+        if depth_fractions is None :
+            depth_fractions = np.ones(len(nodes))
+        depth_fractions = np.asarray(depth_fractions, dtype = np.float64)
+        if len(nodes) == 0 :
+            return nodes
+
+        offsets, targets, target_ends, edges = self.adjacency()
+
+        #copy the subcontigs
+        starts = self.node_start.array[nodes]
+        sizes = self.node_size.array[nodes].astype(np.int64)
+        rows = ranges(starts, sizes)
+        copies = np.arange(self.number_of_nodes, self.number_of_nodes + len(nodes))
+        self.node_start.extend(self.sub_contig.size + np.concatenate(([0], np.cumsum(sizes)[:-1])))
+        self.node_size.extend(sizes)
+        self.node_HiCcoverage.extend(self.node_HiCcoverage.array[nodes])
+        self.node_alive.extend(np.ones(len(nodes), dtype = np.bool_))
+
+        self.sub_contig.extend(self.sub_contig.array[rows])
+        self.sub_orientation.extend(self.sub_orientation.array[rows])
+        self.sub_length.extend(self.sub_length.array[rows])
+        self.sub_depth.extend(self.sub_depth.array[rows] * np.repeat(depth_fractions, sizes))
+        self.sub_insideCIGAR.extend(self.sub_insideCIGAR.array[rows])
+
+        #copy the edges: take all the links of each original, each edge only once per copy
+        numberOfLinks = offsets[2*nodes+2] - offsets[2*nodes]
+        halfEdges = ranges(offsets[2*nodes], numberOfLinks)
+        copyOfHalfEdge = np.repeat(np.arange(len(nodes)), numberOfLinks)
+        pairs = np.unique(copyOfHalfEdge * len(self.edge_alive.array) + edges[halfEdges])
+        copyOfEdge = pairs // len(self.edge_alive.array)
+        edgesToCopy = pairs % len(self.edge_alive.array)
+
+        originals = nodes[copyOfEdge]
+        newNodes = copies[copyOfEdge]
+        node0 = self.edge_node0.array[edgesToCopy]
+        node1 = self.edge_node1.array[edgesToCopy]
+        self.edge_node0.extend(np.where(node0 == originals, newNodes, node0))
+        self.edge_end0.extend(self.edge_end0.array[edgesToCopy])
+        self.edge_node1.extend(np.where(node1 == originals, newNodes, node1))
+        self.edge_end1.extend(self.edge_end1.array[edgesToCopy])
+        self.edge_cigar.extend(self.edge_cigar.array[edgesToCopy])
+        self.edge_alive.extend(np.ones(len(edgesToCopy), dtype = np.bool_))
+        self._adjacency = None
+
+        return copies
+
+    #merge all the chains of nodes linked one to one into single nodes, like merge_adjacent_contigs does on a list of segments.
+    #One difference: if the two free ends of a chain are linked together (circular chain), the link is kept as a link of the new node with itself,
+    #while merge_adjacent_contigs loses it (and may then merge the new segment further through the end that had this link)
+    #output : the indices of the new nodes
+    def compact_unitigs(self) :
+
+        offsets, targets, target_ends, edges = self.adjacency()
+        degrees = np.diff(offsets)
+
+        #an end can be merged with its neighbor if both have exactly one link and the neighbor is another node
+        single = degrees == 1
+        neighborOfEnd = -np.ones(len(degrees), dtype = np.int64)
+        neighborOfEnd[single] = targets[offsets[:-1][single]]
+        neighborEndOfEnd = -np.ones(len(degrees), dtype = np.int64)
+        neighborEndOfEnd[single] = target_ends[offsets[:-1][single]]
+        edgeOfEnd = -np.ones(len(degrees), dtype = np.int64)
+        edgeOfEnd[single] = edges[offsets[:-1][single]]
+        mergeable = single & (neighborOfEnd != np.arange(len(degrees)) // 2)
+        mergeable[mergeable] &= single[2*neighborOfEnd[mergeable] + neighborEndOfEnd[mergeable]]
+
+        #walk along the chains with plain lists, much faster than numpy for element per element access
+        mergeable = mergeable.tolist()
+        neighborOfEnd = neighborOfEnd.tolist()
+        neighborEndOfEnd = neighborEndOfEnd.tolist()
+        edgeOfEnd = edgeOfEnd.tolist()
+        visited = (~self.node_alive.array).tolist()
+        chains = [] #each chain is a list of [node, traversed in reverse, edge leading to the next node of the chain]
+        for loops in range(2) :
+            for start in range(self.number_of_nodes) :
+                #first start the chains at the nodes that cannot be merged at one end, then at the nodes in loops
+                if visited[start] or (loops == 0 and mergeable[2*start] and mergeable[2*start+1]) :
+                    continue
+                endNow = 0 if (loops == 0 and not mergeable[2*start+1]) else 1 #end through which the chain is extended
+                chain = [[start, endNow == 0, -1]]
+                visited[start] = True
+                while mergeable[2*chain[-1][0]+endNow] and not visited[neighborOfEnd[2*chain[-1][0]+endNow]] :
+                    here = 2*chain[-1][0]+endNow
+                    chain[-1][2] = edgeOfEnd[here]
+                    endNow = 1 - neighborEndOfEnd[here]
+                    chain.append([neighborOfEnd[here], endNow == 0, -1])
+                    visited[neighborOfEnd[here]] = True
+                chains.append(chain)
+
+        chains = [c for c in chains if len(c) > 1]
+        if len(chains) == 0 :
+            return np.zeros(0, dtype = np.int64)
+
+        #build all the new nodes at once: gather the subcontigs of the chains, reversing the nodes traversed in reverse
+        chainNodes = np.array([c[0] for chain in chains for c in chain], dtype = np.int64)
+        reversedNodes = np.array([c[1] for chain in chains for c in chain], dtype = np.bool_)
+        nextEdges = np.array([c[2] for chain in chains for c in chain], dtype = np.int64)
+        chainLengths = np.array([len(chain) for chain in chains], dtype = np.int64)
+
+        starts = self.node_start.array[chainNodes]
+        sizes = self.node_size.array[chainNodes].astype(np.int64)
+        local = ranges(np.zeros(len(sizes), dtype = np.int64), sizes)
+        isReversed = np.repeat(reversedNodes, sizes)
+        rows = np.repeat(starts, sizes) + np.where(isReversed, np.repeat(sizes, sizes)-1-local, local)
+
+        orientations = self.sub_orientation.array[rows]
+        orientations = np.where(isReversed, 1-orientations, orientations)
+        #CIGAR between each subcontig and the next one: inside a node, the inside CIGAR (read from the other side if reversed), between nodes the CIGAR of the edge, -1 at the end of a chain
+        insideCIGARs = np.where(isReversed, self.sub_insideCIGAR.array[np.maximum(rows-1, 0)], self.sub_insideCIGAR.array[rows])
+        lastOfNode = np.cumsum(sizes) - 1
+        insideCIGARs[lastOfNode] = np.where(nextEdges >= 0, self.edge_cigar.array[np.maximum(nextEdges, 0)], -1)
+
+        subcontigsPerChain = np.add.reduceat(sizes, np.concatenate(([0], np.cumsum(chainLengths)[:-1])))
+        newNodes = np.arange(self.number_of_nodes, self.number_of_nodes + len(chains))
+        self.node_start.extend(self.sub_contig.size + np.concatenate(([0], np.cumsum(subcontigsPerChain)[:-1])))
+        self.node_size.extend(subcontigsPerChain)
+        self.node_HiCcoverage.extend(np.add.reduceat(self.node_HiCcoverage.array[chainNodes], np.concatenate(([0], np.cumsum(chainLengths)[:-1]))))
+        self.node_alive.extend(np.ones(len(chains), dtype = np.bool_))
+
+        self.sub_contig.extend(self.sub_contig.array[rows])
+        self.sub_orientation.extend(orientations)
+        self.sub_length.extend(self.sub_length.array[rows])
+        self.sub_depth.extend(self.sub_depth.array[rows])
+        self.sub_insideCIGAR.extend(insideCIGARs)
+
+        #rewire the edges: the free end of the first node of a chain becomes end 0 of the new node, the free end of the last node end 1
+        endMapping = np.arange(2*self.number_of_nodes, dtype = np.int64) #maps 2*node+end to 2*newNode+newEnd
+        firstOfChain = np.concatenate(([0], np.cumsum(chainLengths)[:-1]))
+        lastOfChain = np.cumsum(chainLengths) - 1
+        endMapping[2*chainNodes[firstOfChain] + reversedNodes[firstOfChain]] = 2*newNodes
+        endMapping[2*chainNodes[lastOfChain] + 1 - reversedNodes[lastOfChain]] = 2*newNodes + 1
+
+        self.node_alive.array[chainNodes] = False
+        self.edge_alive.array[nextEdges[nextEdges >= 0]] = False
+        end0 = endMapping[2*self.edge_node0.array.astype(np.int64) + self.edge_end0.array]
+        end1 = endMapping[2*self.edge_node1.array.astype(np.int64) + self.edge_end1.array]
+        self.edge_node0.array[:] = end0 // 2
+        self.edge_end0.array[:] = end0 % 2
+        self.edge_node1.array[:] = end1 // 2
+        self.edge_end1.array[:] = end1 % 2
+        self._adjacency = None
+
+        return newNodes
+
+    #remove the tombstones of deleted nodes and edges
+    #output : an array giving the new index of each old node (-1 for deleted nodes)
+    def compact(self) :
+
+        aliveNodes = np.nonzero(self.node_alive.array)[0]
+        newIndex = -np.ones(self.number_of_nodes, dtype = np.int64)
+        newIndex[aliveNodes] = np.arange(len(aliveNodes))
+
+        sizes = self.node_size.array[aliveNodes].astype(np.int64)
+        rows = ranges(self.node_start.array[aliveNodes], sizes)
+        for column in (self.sub_contig, self.sub_orientation, self.sub_length, self.sub_depth, self.sub_insideCIGAR) :
+            column.reset(column.array[rows])
+        self.node_start.reset(np.concatenate(([0], np.cumsum(sizes)[:-1])) if len(sizes) > 0 else [])
+        self.node_size.reset(sizes)
+        self.node_HiCcoverage.reset(self.node_HiCcoverage.array[aliveNodes])
+        self.node_alive.reset(np.ones(len(aliveNodes), dtype = np.bool_))
+
+        aliveEdges = np.nonzero(self.edge_alive.array)[0]
+        self.edge_node0.reset(newIndex[self.edge_node0.array[aliveEdges]])
+        self.edge_end0.reset(self.edge_end0.array[aliveEdges])
+        self.edge_node1.reset(newIndex[self.edge_node1.array[aliveEdges]])
+        self.edge_end1.reset(self.edge_end1.array[aliveEdges])
+        self.edge_cigar.reset(self.edge_cigar.array[aliveEdges])
+        self.edge_alive.reset(np.ones(len(aliveEdges), dtype = np.bool_))
+        self._adjacency = None
+
+        return newIndex
+
+    #output : a Segment-like read-only view of each node still alive, so that algorithms written for segments can read the graph
+    def views(self) :
+        return [SegmentView(self, n) for n in np.nonzero(self.node_alive.array)[0]]
+
+    #input : a list of segments
+    #output : the same graph as an ArrayGraph, nodes being in the order of the list
+    @staticmethod
+    def from_segments(listOfSegments) :
+
+        graph = ArrayGraph()
+        index = {}
+        for s, segment in enumerate(listOfSegments) :
+            index[segment.ID] = s
+            graph.add_node(segment.names, segment.orientations, segment.lengths, segment.depths, segment.insideCIGARs, segment.HiCcoverage)
+
+        nodes0, ends0, nodes1, ends1, CIGARs = [], [], [], [], []
+        linksToItself = set()
+        for s, segment in enumerate(listOfSegments) :
+            for end in range(2) :
+                for n, neighbor in enumerate(segment.links[end]) :
+                    otherEnd = segment.otherEndOfLinks[end][n]
+                    #each link is seen from both sides: keep it once. A link from one end to the same end is seen twice from the same end
+                    if (s, end) == (index[neighbor.ID], otherEnd) :
+                        if (s, end, segment.CIGARs[end][n]) in linksToItself :
+                            continue
+                        linksToItself.add((s, end, segment.CIGARs[end][n]))
+                    if (s, end) <= (index[neighbor.ID], otherEnd) :
+                        nodes0.append(s)
+                        ends0.append(end)
+                        nodes1.append(index[neighbor.ID])
+                        ends1.append(otherEnd)
+                        CIGARs.append(segment.CIGARs[end][n])
+        graph.add_edges(nodes0, ends0, nodes1, ends1, CIGARs)
+
+        return graph
+
+    #output : the graph as a list of Segment, in the order of the nodes still alive
+    def to_segments(self) :
+
+        offsets, targets, target_ends, edges = self.adjacency()
+        segments = {}
+        for n in np.nonzero(self.node_alive.array)[0] :
+            view = SegmentView(self, n)
+            segments[n] = Segment(view.names, view.orientations, view.lengths, view.insideCIGARs, HiCcoverage = float(self.node_HiCcoverage.array[n]), readCoverage = view.depths)
+
+        for n, segment in segments.items() :
+            for end in range(2) :
+                for i in range(offsets[2*n+end], offsets[2*n+end+1]) :
+                    segment.add_end_of_link(end, segments[targets[i]], int(target_ends[i]), self.cigars[self.edge_cigar.array[edges[i]]])
+
+        return list(segments.values())
+
+#input : starts and sizes of ranges
+#output : concatenation of all the ranges [start, start+size)
+def ranges(starts, sizes) :
+
+    sizes = np.asarray(sizes, dtype = np.int64)
+    if len(sizes) == 0 or sizes.sum() == 0 :
+        return np.zeros(0, dtype = np.int64)
+    beginnings = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return np.repeat(np.asarray(starts, dtype = np.int64) - beginnings, sizes) + np.arange(sizes.sum())
+
+#read-only view of a node of an ArrayGraph offering the same properties as a Segment
+class SegmentView :
+
+    __slots__ = ('_graph', '_node')
+
+    def __init__(self, graph, node) :
+        self._graph = graph
+        self._node = int(node)
+
+    def _rows(self) :
+        start = self._graph.node_start.array[self._node]
+        return slice(start, start + self._graph.node_size.array[self._node])
+
+    def get_id(self) :
+        return self._node
+
+    def get_namesOfContigs(self) :
+        return [self._graph.contig_names[c] for c in self._graph.sub_contig.array[self._rows()]]
+
+    def get_orientations(self) :
+        return self._graph.sub_orientation.array[self._rows()].tolist()
+
+    def get_lengths(self) :
+        return self._graph.sub_length.array[self._rows()].tolist()
+
+    def get_depths(self) :
+        return self._graph.sub_depth.array[self._rows()].tolist()
+
+    def get_insideCIGARs(self) :
+        return [self._graph.cigars[c] for c in self._graph.sub_insideCIGAR.array[self._rows()][:-1]]
+
+    def get_length(self) :
+        return int(self._graph.sub_length.array[self._rows()].sum())
+
+    def get_depth(self) :
+        lengths = self._graph.sub_length.array[self._rows()]
+        return float(np.dot(self._graph.sub_depth.array[self._rows()], lengths) / (1 + lengths.sum()))
+
+    def get_coverage(self) :
+        return self._graph.node_HiCcoverage.array[self._node]
+
+    def _links_of_end(self, end) :
+        offsets, targets, target_ends, edges = self._graph.adjacency()
+        return slice(offsets[2*self._node+end], offsets[2*self._node+end+1])
+
+    def get_links(self) :
+        targets = self._graph.adjacency()[1]
+        return [[SegmentView(self._graph, t) for t in targets[self._links_of_end(end)]] for end in range(2)]
+
+    def get_otherEndOfLinks(self) :
+        target_ends = self._graph.adjacency()[2]
+        return [target_ends[self._links_of_end(end)].tolist() for end in range(2)]
+
+    def get_CIGARs(self) :
+        edges = self._graph.adjacency()[3]
+        return [[self._graph.cigars[c] for c in self._graph.edge_cigar.array[edges[self._links_of_end(end)]]] for end in range(2)]
+
+    def __eq__(self, other) :
+        return isinstance(other, SegmentView) and other._graph is self._graph and other._node == self._node
+
+    def __hash__(self) :
+        return hash((id(self._graph), self._node))
+
+    ID = property(get_id)
+    HiCcoverage = property(get_coverage)
+    depths = property(get_depths)
+    depth = property(get_depth)
+    length = property(get_length)
+
+    names = property(get_namesOfContigs)
+    orientations = property(get_orientations)
+    lengths = property(get_lengths)
+    insideCIGARs = property(get_insideCIGARs)
+
+    links = property(get_links)
+    otherEndOfLinks = property(get_otherEndOfLinks)
+    CIGARs = property(get_CIGARs)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File dedicated to opening plain, gzip and BGZF files transparently.
+
+BGZF (the blocked gzip produced by bgzip/samtools) is decompressed and compressed in parallel, block per block,
+and supports random access through virtual offsets: (offset of the block in the file << 16) | offset in the block.
+On BGZF files, tell() returns such a virtual offset and seek() accepts it, so the code storing tell() positions works unchanged.
+"""
+
+import gzip
+import io
+import struct
+import sys
+import zlib
+import concurrent.futures #for multithreaded (de)compression
+from collections import deque
+
+BGZF_MAX_BLOCK_DATA = 65280 #same as htslib, so that a compressed block always fits in 64kB
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+#input : a file
+#output : 'bgzf', 'gzip' or None if the file is not compressed
+def compression_of(file):
+
+    with open(file, 'rb') as f :
+        header = f.read(18)
+
+    if len(header) < 2 or header[:2] != b'\x1f\x8b' :
+        return None
+    if len(header) >= 18 and header[3] & 4 and header[12:14] == b'BC' :
+        return 'bgzf'
+    return 'gzip'
+
+#input : a file, a mode ('r', 'rb', 'w' or 'wb') and the number of threads to use to (de)compress
+#output : a file object. Files are read whatever their compression, and written in BGZF if their name ends with .gz or .bgz.
+#         Text modes read and write str, binary modes bytes. For random access (seek/tell), use a binary mode
+def open_file(file, mode = 'r', threads = 1):
+
+    if 'w' in mode :
+        if file.endswith('.gz') or file.endswith('.bgz') :
+            writer = BgzfWriter(file, threads)
+            if 'b' in mode :
+                return writer
+            return io.TextIOWrapper(writer)
+        if 'b' in mode :
+            return open(file, 'wb', buffering = 1024*1024)
+        return open(file, 'w', buffering = 1024*1024)
+
+    compression = compression_of(file)
+    if compression == 'bgzf' :
+        reader = BgzfReader(file, threads)
+    elif compression == 'gzip' :
+        reader = gzip.open(file, 'rb')
+    else :
+        reader = open(file, 'rb')
+
+    if 'b' in mode :
+        return reader
+    return io.TextIOWrapper(io.BufferedReader(reader, 1024*1024))
+
+#input : a file and the name of the step that needs to jump in it
+#output : exits if the file cannot be read at random positions (gzip that is not BGZF)
+def check_random_access(file, step):
+
+    if compression_of(file) == 'gzip' :
+        print("ERROR: ", step, " needs to read ", file, " at random positions, which is not possible on gzip files. Please compress it with bgzip instead of gzip (or decompress it)")
+        sys.exit(1)
+
+def decompress_block(block):
+
+    xlen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12+xlen:-8], -15)
+    if zlib.crc32(data) != struct.unpack('<I', block[-8:-4])[0] :
+        raise IOError("corrupted BGZF block (wrong CRC)")
+    return data
+
+def compress_block(data, level = 6):
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + struct.pack('<H', len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+class BgzfReader(io.RawIOBase) :
+
+    def __init__(self, file, threads = 1) :
+
+        self._file = open(file, 'rb')
+        self._threads = max(1, threads)
+        self._executor = None
+        if self._threads > 1 :
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self._threads)
+        self._pending = deque() #blocks being decompressed ahead of the reading position: (offset of the block, future)
+        self._next_block = 0 #offset in the file of the next block to read
+        self._block_offset = 0 #offset in the file of the current block
+        self._data = b''
+        self._pos = 0 #position in the current (decompressed) block
+
+    def _read_raw_block(self) :
+
+        offset = self._file.tell()
+        header = self._file.read(18)
+        if len(header) == 0 :
+            return offset, None
+        if len(header) < 18 or header[:2] != b'\x1f\x8b' :
+            raise IOError("not a BGZF block at offset " + str(offset))
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = header[12:] + self._file.read(xlen - 6)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra) :
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == b'BC' :
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0]
+            i += 4 + slen
+        if bsize is None :
+            raise IOError("not a BGZF block at offset " + str(offset))
+        return offset, header[:12] + extra + self._file.read(bsize + 1 - 12 - xlen)
+
+    def _fill_pipeline(self) :
+
+        self._file.seek(self._next_block)
+        while len(self._pending) < 2*self._threads :
+            offset, block = self._read_raw_block()
+            if block is None :
+                break
+            if self._executor is not None :
+                self._pending.append((offset, self._executor.submit(decompress_block, block)))
+            else :
+                self._pending.append((offset, block))
+        self._next_block = self._file.tell()
+
+    def _load_next_block(self) : #returns False at the end of the file
+
+        while True :
+            if len(self._pending) == 0 :
+                self._fill_pipeline()
+                if len(self._pending) == 0 :
+                    return False
+            offset, result = self._pending.popleft()
+            if self._executor is not None :
+                data = result.result()
+            else :
+                data = decompress_block(result)
+            if len(self._pending) < self._threads :
+                self._fill_pipeline()
+            self._block_offset = offset
+            self._data = data
+            self._pos = 0
+            if len(data) > 0 : #skip empty blocks, such as the EOF marker
+                return True
+
+    def readable(self) :
+        return True
+
+    def seekable(self) :
+        return True
+
+    def tell(self) :
+        return (self._block_offset << 16) | self._pos
+
+    def seek(self, virtual_offset, whence = io.SEEK_SET) :
+
+        if whence != io.SEEK_SET :
+            raise io.UnsupportedOperation("BGZF files can only be sought to virtual offsets")
+        self._pending.clear()
+        self._next_block = virtual_offset >> 16
+        self._data = b''
+        self._pos = 0
+        self._block_offset = self._next_block
+        if virtual_offset & 0xFFFF != 0 :
+            self._load_next_block()
+            self._pos = virtual_offset & 0xFFFF
+        return virtual_offset
+
+    def readinto(self, buffer) :
+
+        if self._pos >= len(self._data) and not self._load_next_block() :
+            return 0
+        n = min(len(buffer), len(self._data) - self._pos)
+        buffer[:n] = self._data[self._pos:self._pos+n]
+        self._pos += n
+        return n
+
+    def readline(self, size = -1) :
+
+        chunks = []
+        while True :
+            if self._pos >= len(self._data) and not self._load_next_block() :
+                break
+            end = self._data.find(b'\n', self._pos)
+            if end == -1 :
+                chunks.append(self._data[self._pos:])
+                self._pos = len(self._data)
+            else :
+                chunks.append(self._data[self._pos:end+1])
+                self._pos = end+1
+                break
+        return b''.join(chunks)
+
+    def close(self) :
+
+        if not self.closed :
+            self._pending.clear()
+            if self._executor is not None :
+                self._executor.shutdown(wait = True)
+            self._file.close()
+        super().close()
+
+class BgzfWriter(io.RawIOBase) :
+
+    def __init__(self, file, threads = 1, level = 6) :
+
+        self._file = open(file, 'wb')
+        self._threads = max(1, threads)
+        self._level = level
+        self._executor = None
+        if self._threads > 1 :
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self._threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def writable(self) :
+        return True
+
+    def _flush_pending(self, keep) :
+
+        while len(self._pending) > keep :
+            self._file.write(self._pending.popleft().result())
+
+    def _compress(self, data) :
+
+        if self._executor is not None :
+            self._pending.append(self._executor.submit(compress_block, data, self._level))
+            self._flush_pending(2*self._threads)
+        else :
+            self._file.write(compress_block(data, self._level))
+
+    def write(self, data) :
+
+        self._buffer += data
+        while len(self._buffer) >= BGZF_MAX_BLOCK_DATA :
+            self._compress(bytes(self._buffer[:BGZF_MAX_BLOCK_DATA]))
+            del self._buffer[:BGZF_MAX_BLOCK_DATA]
+        return len(data)
+
+    def close(self) :
+
+        if not self.closed :
+            if len(self._buffer) > 0 :
+                self._compress(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._flush_pending(0)
+            self._file.write(BGZF_EOF)
+            if self._executor is not None :
+                self._executor.shutdown(wait = True)
+            self._file.close()
+        super().close()
@@ -20,6 +20,8 @@ from transform_gfa import check_segments
 import segment as s
 from segment import add_link
 from segment import Segment
+from segment import compact_segments
+from compressed_io import open_file, check_random_access
 
 def reverse_complement(seq):
     return seq.translate(str.maketrans("ACGTacgt", "TGCAtgca"))[::-1]
@@ -127,9 +129,10 @@ def merge_simply_two_adjacent_contig(segment, endOfSegment, listOfSegments):
     
     return listOfSegments
 
-# input : one supercontig to be joined with a list of neighbors at one end (if they can be merged simply, i.e. if they have only one neighbor at the other end)
+# input : one supercontig to be joined with a list of neighbors at one end (if they can be merged simply, i.e. if they have only one neighbor at the other end),
+#         and optionally the set of the IDs of deleted segments, for the caller to remove them from listOfSegments all at once
 # output : actualized listOfSegments with the contigs merged
-def merge_simply_all_contigs_on_one_side_of_this_one(segment, endOfSegment, listOfSegments): 
+def merge_simply_all_contigs_on_one_side_of_this_one(segment, endOfSegment, listOfSegments, deleted = None): 
 
     if len(segment.links[endOfSegment]) == 0:
         return listOfSegments
@@ -190,9 +193,14 @@ def merge_simply_all_contigs_on_one_side_of_this_one(segment, endOfSegment, list
 
 
     #delete all the segments that have been merged
+    compactNow = deleted is None
+    if compactNow :
+        deleted = set()
     for s in list_of_segments_to_merge:
         s.cut_all_links()
-        listOfSegments.remove(s)
+        deleted.add(s.ID)
+    if compactNow :
+        compact_segments(listOfSegments, deleted)
 
     return listOfSegments
 
@@ -202,8 +210,11 @@ def merge_adjacent_contigs(listOfSegments):
     goOn = True
     while goOn:
         goOn = False
+        deleted = set() #IDs of the segments merged during this pass, removed from listOfSegments at the end of the pass
         for segment in listOfSegments:
 
+            if segment.ID in deleted :
+                continue
             alreadyDidThisOne = False # if the segment is deleted when looking at its first end, you don't want it to look at its other end, since it does not exist anymore
             for endOfSegment in range(2):
                 
@@ -212,8 +223,9 @@ def merge_adjacent_contigs(listOfSegments):
                         alreadyDidThisOne = True
                         if segment.ID != segment.links[endOfSegment][0].ID:
                             goOn = True
-                            listOfSegments = merge_simply_all_contigs_on_one_side_of_this_one(segment, endOfSegment, listOfSegments)
+                            merge_simply_all_contigs_on_one_side_of_this_one(segment, endOfSegment, listOfSegments, deleted)
 
+        compact_segments(listOfSegments, deleted)
 
 
     return listOfSegments
@@ -227,7 +239,7 @@ def duplicate_contigs(segments):
     continueDuplication = True
     while continueDuplication:
         continueDuplication = False
-        toDelete = []
+        toDelete = set() #IDs of the duplicated contigs
         alreadyDuplicated = set()
         originalLength = len(segments)
         for se in range (originalLength) :
@@ -246,7 +258,7 @@ def duplicate_contigs(segments):
                         #then duplicate the segment !
                         alreadyDuplicated.add(contig.ID)
                         numberofcopies = len(contig.links[end])
-                        toDelete += [se]
+                        toDelete.add(contig.ID)
                         totalNeighborCoverage = np.sum([contig.links[end][i].depth for i in range(len(contig.links[end]))])
                         if totalNeighborCoverage == 0:
                             totalNeighborCoverage = 1
@@ -258,10 +270,11 @@ def duplicate_contigs(segments):
                             for on, otherneighbor in enumerate(contig.links[1-end]) :
                                 add_link(newSegment, 1-end, otherneighbor, contig.otherEndOfLinks[1-end][on], "0M")
 
-        for s in sorted(toDelete, reverse=True):
-            continueDuplication = True
-            segments[s].cut_all_links()
-            del segments[s]
+        for contig in segments :
+            if contig.ID in toDelete :
+                continueDuplication = True
+                contig.cut_all_links()
+        compact_segments(segments, toDelete)
 
         # segments = merge_adjacent_contigs(segments)
 
@@ -356,15 +369,16 @@ def merge_adjacent_contigs_GFA(gfa_in, gfa_out):
     links = {} #associates a segment with two lists of tuples ([(neighbor, end, CIGAR), ...], [(neighbor, end, CIGAR), ...])
     location_of_segments_in_GFA_file = {} #associates a segment with its location in the GFA file (to recover the sequence quickly)
 
-    with open(gfa_in, 'r') as f:
+    check_random_access(gfa_in, "Merging the contigs of the GFA")
+    with open_file(gfa_in, 'rb') as f:
 
-        line = f.readline()
+        position = f.tell()
+        line = f.readline().decode()
         while line :
 
             if line[0] == 'S' :
-                length_line = len(line)
                 line = line.strip().split('\t')
-                location_of_segments_in_GFA_file[line[1]] = f.tell()-length_line
+                location_of_segments_in_GFA_file[line[1]] = position
                 segments.append(line[1])
                 if line[1] not in links :
                     links[line[1]] = [[], []]
@@ -394,7 +408,8 @@ def merge_adjacent_contigs_GFA(gfa_in, gfa_out):
                 if line[3] != line[1] or side1 != side2 : #to add only one link if it is a self link
                     links[line[3]][side2].append((line[1], side1, line[5].strip()))
 
-            line = f.readline()
+            position = f.tell()
+            line = f.readline().decode()
 
     #merge the contigs
     old_segments_to_new_segments = {} #associates the old segment name with (the new segment name, endOfTheNewSegment) #if it is not at an end put -1 we dont care there will be no link
@@ -468,8 +483,8 @@ def merge_adjacent_contigs_GFA(gfa_in, gfa_out):
 
     #write the new GFA
     # print("outputting gfa")
-    gfa = open(gfa_in, 'r')
-    with open(gfa_out, 'w') as f:
+    gfa = open_file(gfa_in, 'rb')
+    with open_file(gfa_out, 'w') as f:
 
         L_lines = []
         number_out = 0
@@ -492,7 +507,7 @@ def merge_adjacent_contigs_GFA(gfa_in, gfa_out):
 
                 line_subsegment = ""
                 gfa.seek(location_of_segments_in_GFA_file[seg[0]])
-                line_subsegment = gfa.readline()
+                line_subsegment = gfa.readline().decode()
                 line_subsegment = line_subsegment.strip().split('\t')
                 if len(line_subsegment) < 3 :
                     seq_subsegment = ""
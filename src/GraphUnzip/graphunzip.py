@@ -14,7 +14,6 @@ from transform_gfa import gfa_to_fasta
 from finish_untangling import merge_adjacent_contigs
 from finish_untangling import duplicate_contigs
 from finish_untangling import trim_overlaps
-from finish_untangling import merge_adjacent_contigs_GFA
 from solve_with_long_reads import bridge_with_long_reads
 #from solve_with_long_reads2 import bridge_with_long_reads2
 #from solve_with_HiC import solve_with_HiC
@@ -25,9 +24,12 @@ import contig_DBG
 from contig_DBG import DBG_long_reads
 from simple_unzip import simple_unzip
 from simple_unzip import simple_unzip2
+from simple_unzip import UNZIP_ORDERS
+from simple_unzip import CHECKPOINT_INTERVAL
 
 from repolish import repolish_contigs
 import segment as sg
+import profile_graph
 #from segment import check_if_all_links_are_sorted
 
 from scipy import sparse
@@ -35,14 +37,24 @@ import numpy as np
 import argparse
 import os.path
 import sys
-import pickle  # reading and writing files
 import time
+import json
 
 
+PHASES = ["loaded", "long_reads", "HiC", "repolished", "duplicated"] #phases of unzip, in order, after which a snapshot can be written
+
+#input : the prefix given with --snapshot ("" if no snapshot is wanted), the graph and the phase just done
+#output : the snapshot written in <prefix>.<phase>.npz
+def write_snapshot(prefix, segments, names, phase) :
+
+    if prefix != "" :
+        print("Writing a snapshot of the graph in ", prefix + "." + phase + ".npz")
+        io.export_snapshot(segments, names, phase, prefix + "." + phase + ".npz")
+
 def parse_args_command() :
     
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", help="Either unzip, HiC-IM (to prepare Hi-C data) or linked-reads-IM (to prepare linked reads data)")
+    parser.add_argument("command", help="Either unzip, HiC-IM (to prepare Hi-C data), linked-reads-IM (to prepare linked reads data) or profile (to see how hard a graph will be to unzip)")
     
     return parser.parse_args(sys.argv[1:2])
 
@@ -59,7 +71,7 @@ def parse_args_unzip() :
     groupOther = parser.add_argument_group("Other options")
     
     
-    groupInput.add_argument("-g", "--gfa", required = True, help="""GFA file to phase""")
+    groupInput.add_argument("-g", "--gfa", required = True, help="""GFA file to phase (plain or compressed with bgzip)""")
     groupInput.add_argument(
         "-r", "--fastq", required = False, default="",help="""Fastq file of the reads if you want GraphUnzip to repolish contigs [recommended]"""
     )
@@ -86,7 +98,7 @@ def parse_args_unzip() :
         "--output",
         required=False,
         default="output.gfa",
-        help="""Output GFA [default: output.gfa]""",
+        help="""Output GFA, compressed if it ends with .gz [default: output.gfa]""",
     )
     groupOutput.add_argument(
         "-f",
@@ -103,6 +115,19 @@ def parse_args_unzip() :
         default=1,
         help= "Number of threads to use"
     )
+    groupOther.add_argument(
+        "--repolish_threads",
+        required=False,
+        default=1,
+        type=int,
+        help="""(with --fastq) Number of threads of each minimap2 and racon job when repolishing the contigs. The -t threads are shared between jobs running side by side [default: 1]""",
+    )
+    groupOther.add_argument(
+        "--repolish_batch",
+        required=False,
+        action="store_true",
+        help="""(with --fastq) Repolish all the contigs with one racon instead of one per contig, the copies of a contig sharing their minimap2, which is much faster when there are many small contigs to repolish""",
+    )
     
     groupOther.add_argument(
         "-v",
@@ -123,6 +148,25 @@ def parse_args_unzip() :
     #     default = '',
     #     help="""Activate the debug mode. Parameter: directory to put the logs and the intermediary GFAs.""",
     # )
+    groupOther.add_argument(
+        "--snapshot",
+        required=False,
+        default="",
+        help="""Write a binary snapshot of the graph after each phase of the untangling, as PREFIX.<phase>.npz (phases: """ + ", ".join(PHASES) + """), and regular checkpoints during the untangling with long reads, as PREFIX.untangling.npz. Parameter: PREFIX""",
+    )
+    groupOther.add_argument(
+        "--checkpoint_interval",
+        required=False,
+        default=CHECKPOINT_INTERVAL,
+        type=float,
+        help="""(with --snapshot) Minimum number of seconds between two checkpoints of the untangling with long reads, written at the end of a round [default: """ + str(CHECKPOINT_INTERVAL) + """]""",
+    )
+    groupOther.add_argument(
+        "--resume",
+        required=False,
+        default="",
+        help="""Resume the untangling from a snapshot or a checkpoint written with --snapshot, skipping the phases (or rounds) already done. The other inputs must be the same as in the first run""",
+    )
     groupOther.add_argument(
         "--dont_merge",
         required=False,
@@ -157,6 +201,13 @@ def parse_args_unzip() :
         action="store_true",
         help="""(long reads only) All links not found in the .gaf will be removed""",
     )
+    groupBehavior.add_argument(
+        "--unzip_order",
+        required=False,
+        default="graph",
+        choices=UNZIP_ORDERS,
+        help="""(long reads only) Order in which the contigs are looked at in each round of the untangling: in the order of the graph, or from the contig the most supported by the reads to the least [default: graph]""",
+    )
     groupBehavior.add_argument(
         "-D",
         "--duplicate",
@@ -173,6 +224,26 @@ def parse_args_unzip() :
     
     return parser.parse_args(sys.argv[2:])
 
+def parse_args_profile():
+    """ 
+	Gets the arguments from the command line.
+	"""
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-g", "--gfa", required=True,  help="""GFA file that will be untangled (required)""")
+    parser.add_argument("-l", "--longreads", required=True, help="""Long reads mapped to the GFA with GraphAligner (GAF format) (required)""")
+    parser.add_argument("-j", "--json", required=False, default="", help="""Optional output of the statistics and estimates in JSON""")
+    parser.add_argument(
+        "-t",
+        "--num_threads",
+        required=False,
+        default=1,
+        help= "Number of threads to use [default: 1]"
+    )
+
+    return parser.parse_args(sys.argv[2:])
+
 def parse_args_linked():
     """ 
 	Gets the arguments from the command line.
@@ -189,6 +260,10 @@ def parse_args_linked():
     parser.add_argument(
         "-b",
         "--barcoded_SAM", required=True, help = """SAM file of the barcoded reads aligned to the assembly. Barcodes must still be there (use option -C if aligning with BWA) (required)""")
+
+    parser.add_argument(
+        "-t",
+        "--num_threads", required=False, default=1, help = """Number of threads to use [default: 1]""")
     
     return parser.parse_args(sys.argv[2:])
 
@@ -259,8 +334,7 @@ def main():
             # exporting it as to never have to do it again
 
             print("Exporting Hi-C interaction matrix as ", outputIMH)
-            with open(outputIMH, "wb") as o:
-                pickle.dump(interactionMatrix, o)
+            io.export_interactionMatrix(interactionMatrix, names, outputIMH)
 
         else:
             print("Error: could not find fragments file {0}.".format(fragmentsFile), " or matrix file {0}".format(matrixFile))
@@ -287,11 +361,10 @@ def main():
             print('Error: could not find the SAM file.')
             sys.exit(1)
         
-        tagInteractionMatrix = io.linkedReads_interactionMatrix(barcodedSAM, names)
+        tagInteractionMatrix = io.linkedReads_interactionMatrix(barcodedSAM, names, int(args.num_threads))
         
         print("Exporting barcoded interaction matrix as ", outputIMT)
-        with open(outputIMT, "wb") as o:
-            pickle.dump(tagInteractionMatrix, o)
+        io.export_interactionMatrix(tagInteractionMatrix, names, outputIMT)
 
     elif command == 'unzip' :
         
@@ -322,9 +395,27 @@ def main():
         
         #clean = args.clean
         
+        # the sequences are fetched at random positions in the GFA (and the reads in the fastq), check it is possible before doing all the work
+        io.check_random_access(gfaFile, "GraphUnzip")
+        if fastqFile != "" :
+            io.check_random_access(fastqFile, "Repolishing")
+
         # Loading the data
-        print("Loading the GFA file")
-        segments, names = io.load_GFA_parallel(gfaFile, num_threads)
+        phaseDone = -1 #index in PHASES of the last phase done
+        unzipState = None #state of the untangling with long reads, if resuming from one of its checkpoints
+        if args.resume != "" :
+            if not os.path.exists(args.resume) :
+                print("ERROR: could not access ", args.resume)
+                sys.exit(1)
+            print("Resuming from the snapshot ", args.resume)
+            segments, names, phase = io.load_snapshot(args.resume)
+            unzipState = io.load_snapshot_state(args.resume)
+            phaseDone = PHASES.index(phase)
+            gfa_offsets = None #the GFA will be indexed again when its sequences are needed
+        else :
+            print("Loading the GFA file")
+            gfa_offsets = {} #offsets of the contigs in the GFA, to fetch their sequences only when needed
+            segments, names = io.load_GFA_parallel(gfaFile, num_threads, line_offset=gfa_offsets)
         
         # segments, names = io.load_gfa(
         #     gfaFile
@@ -366,8 +457,9 @@ def main():
                 print("ERROR: could not access ", interactionFileH)
                 sys.exit(1)
             
-            print("Loading the Hi-C interaction matrix")
-            interactionMatrix = io.load_interactionMatrix(interactionFileH, segments, names, HiC = True)
+            if phaseDone < PHASES.index("HiC") :
+                print("Loading the Hi-C interaction matrix")
+                interactionMatrix = io.load_interactionMatrix(interactionFileH, segments, names, HiC = (phaseDone < PHASES.index("loaded"))) #the Hi-C coverage is in the snapshots
             useHiC = True
 
         if lrFile != "Empty" :
@@ -383,8 +475,9 @@ def main():
                 print("ERROR: could not access ", interactionFileT)
                 sys.exit(1)
             
-            print("Loading the linked-reads interaction matrix")
-            tagInteractionMatrix = io.load_interactionMatrix(interactionFileT, segments, names, HiC = False)
+            if phaseDone < PHASES.index("HiC") :
+                print("Loading the linked-reads interaction matrix")
+                tagInteractionMatrix = io.load_interactionMatrix(interactionFileT, segments, names, HiC = False)
             useTag = True
             
         if not( useHiC or uselr or useTag) :
@@ -392,6 +485,9 @@ def main():
             print("ERROR: You should provide to unzip long reads mapped in GAF format and/or interaction matrices, using either --HiCinteractions (-i) or --linkedReadsInteractions (-k). If you do not have them, you can create them using the HiC-IM or linked-reads-IM commands")
             sys.exit()
 
+        if phaseDone < PHASES.index("loaded") :
+            write_snapshot(args.snapshot, segments, names, "loaded")
+
         print("================\n\nEverything loaded, moving on to untangling the graph\n\n================")
         
         #creating copiesnuber (cn), a dictionnary inventoring how many times 
@@ -407,7 +503,7 @@ def main():
         #     refHaploidy, multiplicities = determine_multiplicity(segments, names, supported_links2, reliableCoverage) #multiplicities can be seen as a mininimum multiplicity of each contig regarding the topology of the graph
 
         #As a first step, use only the long reads, if available
-        if uselr :
+        if uselr and phaseDone < PHASES.index("long_reads") :
             print("\n*Untangling the graph using long reads*\n")
             # rename = True
             # if multiploid :
@@ -417,7 +513,9 @@ def main():
 
             # multiplicities = determine_multiplicity_based_on_gaf(lrFile)
 
-            segments = simple_unzip2(segments, names, lrFile, num_threads, exhaustive)
+            checkpoint = args.snapshot + ".untangling.npz" if args.snapshot != "" else ""
+            segments = simple_unzip2(segments, names, lrFile, num_threads, exhaustive, args.unzip_order, \
+                                     checkpoint = checkpoint, checkpoint_interval = args.checkpoint_interval, resume_state = unzipState)
 
             # if merge :
             #     print("Merging contigs that can be merged...")
@@ -427,17 +525,22 @@ def main():
             
             # segments = trim_overlaps(segments)
             print("\n*Done untangling the graph using long reads*\n")
+            write_snapshot(args.snapshot, segments, names, "long_reads")
         
         #As a second step, use Hi-C and/or linked reads 
-        if interactionMatrix.count_nonzero() > 0 :
+        if phaseDone >= PHASES.index("HiC") :
+            pass
+        elif interactionMatrix.count_nonzero() > 0 :
             print("\n*Untangling the graph using Hi-C*\n")
             segments = solve_with_HiC(segments, interactionMatrix, names, confidentCoverage=reliableCoverage, verbose = verbose)
             print("Merging contigs that can be merged...")
             segments = merge_adjacent_contigs(segments)
             
             print("\n*Done untangling the graph using Hi-C*\n")  
+            write_snapshot(args.snapshot, segments, names, "HiC")
         elif tagInteractionMatrix.count_nonzero() > 0 :
             segments = solve_with_HiC(segments, tagInteractionMatrix, names, confidentCoverage=reliableCoverage, verbose = verbose)
+            write_snapshot(args.snapshot, segments, names, "HiC")
             # print("Merging contigs that can be merged...")
             # merge_adjacent_contigs(segments)
         elif not uselr :
@@ -447,41 +550,60 @@ def main():
         #compute the copiesnumber
         print(" Repolishing the contigs we can repolish")
         copies = sg.compute_copiesNumber(segments)
-        if fastqFile != "" : 
+        if fastqFile != "" and phaseDone < PHASES.index("repolished") : 
             merge_adjacent_contigs(segments)
-            segments = repolish_contigs(segments, gfaFile, lrFile, fastqFile, copies, threads=1)
+            segments = repolish_contigs(segments, gfaFile, lrFile, fastqFile, copies, threads=num_threads, contigs_position=gfa_offsets, threads_per_job=args.repolish_threads, batch=args.repolish_batch)
+            write_snapshot(args.snapshot, segments, names, "repolished")
             # print("OUTPUTTING WILDLY")
             # copies = sg.compute_copiesNumber(segments)
             # io.export_to_GFA(segments, copies, gfaFile, exportFile=outFile, merge_adjacent_contigs=merge, rename_contigs=False)
             # sys.exit()
 
-        if args.duplicate :
+        if args.duplicate and phaseDone < PHASES.index("duplicated") :
             print("Duplicating reads that can be duplicated...")
             segments = duplicate_contigs(segments)
+            write_snapshot(args.snapshot, segments, names, "duplicated")
 
 
         # now exporting the output  
         print("Now exporting the result")
         copies = sg.compute_copiesNumber(segments)
+        sort_strategy = "length"
+        if amplicon:
+            sort_strategy = "coverage"
         if merge:
             print("Merging contigs that can be merged...")
-            tmp_non_merged_gfa_file = outFile + ".tmp"
-            sort_strategy = "length"
-            if amplicon:
-                sort_strategy = "coverage"
-            io.export_to_GFA(segments, copies, gfaFile, exportFile=tmp_non_merged_gfa_file, merge_adjacent_contigs=False, rename_contigs=rename, sort_strategy=sort_strategy)
-            merge_adjacent_contigs_GFA(tmp_non_merged_gfa_file, outFile)
-            os.remove(tmp_non_merged_gfa_file)
-        else:
-            io.export_to_GFA(segments, copies, gfaFile, exportFile=outFile, merge_adjacent_contigs=merge, rename_contigs=rename)
-    
-        if fastaFile != "None":
-            io.export_to_fasta(segments, gfaFile, fastaFile, rename_contigs=rename)
+        io.export_graph(segments, gfaFile, outFile, fastaFile=fastaFile, merge_adjacent_contigs=merge, rename_contigs=rename, sort_strategy=sort_strategy, line_offset=gfa_offsets)
     
         print("Finished in ", time.time() - t, " seconds")
         
+    elif command == 'profile' :
+
+        args = parse_args_profile()
+        num_threads = int(args.num_threads)
+
+        print("Loading the GFA file")
+        segments, names = io.load_GFA_parallel(args.gfa, num_threads)
+        if len(segments) == 0 :
+            print("ERROR: could not read the GFA")
+            sys.exit()
+        if not os.path.exists(args.longreads) :
+            print("ERROR: could not access ", args.longreads)
+            sys.exit(1)
+        print("Reading the gaf file...")
+        lines = io.read_GAF_parallel(args.longreads, 0, 0, [], num_threads)
+
+        stats = profile_graph.profile_graph(segments, names, lines)
+        estimates = profile_graph.estimate_resources(stats, num_threads)
+        profile_graph.print_profile(stats, estimates)
+        if args.json != "" :
+            with open(args.json, 'w') as f :
+                json.dump({'statistics' : stats, 'estimates' : estimates}, f, indent = 1)
+
+        print("Finished in ", time.time() - t, " seconds")
+
     else :
-        print("Unrecognized command ", command, "\". Use either unzip, HiC-IM (to prepare Hi-C data) or linked-reads-IM (to prepare linked reads data)")
+        print("Unrecognized command ", command, "\". Use either unzip, HiC-IM (to prepare Hi-C data), linked-reads-IM (to prepare linked reads data) or profile")
 
 
 if __name__ == "__main__":
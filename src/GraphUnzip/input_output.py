@@ -12,15 +12,19 @@ import os.path #to check the existence of files
 import pickle #for writing files and reading them
 import re #to find all numbers in a mixed number/letters string (such as 31M1D4M), to split on several characters (<> in longReads_interactionMatrix)
 import shutil #to remove directories
+import zipfile #to memory-map the arrays of .npz interaction matrices
+import mmap #to scan the GFA without reading the sequences
 import sys #to exit when there is an error and to set recursion limit
 
 
 from segment import Segment
 from segment import compute_copiesNumber
 from segment import delete_links_present_twice
+from segment import add_links_in_bulk
+from compressed_io import open_file, compression_of, check_random_access
+from array_graph import ArrayGraph
 
 import concurrent.futures #for multithreading
-import threading #for multithreading
 
 # Read fragments list file
 # Input :
@@ -114,42 +118,55 @@ def interactionMatrix(hiccontactsfile, fragmentList, names, segments, header=Tru
     
     return interactionMatrix
 
-def read_GAF_chunk(lines, gafFile, position_begin, position_end, lock, similarity_threshold, whole_mapping_threshold):
+#input : a line of a GAF file and parameters telling which line are deemed informative
+#output : (read, path) if the line is informative, else None
+def informative_GAF_line(line, similarity_threshold, whole_mapping_threshold):
+
+    ls = line.split('\t')
+    if len(ls) > 5 :
+
+        if ls[5].count('>') + ls[5].count('<') > 1 :
+                        
+            if (not 'id:f' in ls[-2]) or (float(ls[-2].split(':')[-1]) > similarity_threshold) or similarity_threshold == 0 :
+                
+                if (float(ls[3])-float(ls[2]))/float(ls[1]) > whole_mapping_threshold or whole_mapping_threshold == 0 :
+
+                    return (ls[0],ls[5])
+    return None
+
+#input : GAF file and a chunk of it, given by byte offsets
+#output : the useful lines beginning in this chunk
+def read_GAF_chunk(gafFile, position_begin, position_end, similarity_threshold, whole_mapping_threshold):
     
     local_lines = []
-    gaf = open(gafFile, 'r')
-    gaf.seek(position_begin)
+    gaf = open(gafFile, 'rb')
     pos_now = position_begin
+    if position_begin != 0 : #the line overlapping the beginning of the chunk was in the previous chunk
+        gaf.seek(position_begin-1)
+        pos_now = position_begin-1 + len(gaf.readline())
     for line in gaf:
-        if position_begin != 0 and pos_now==position_begin : #this line was in the previous chunk
-            pos_now += len(line)
-            continue
         if pos_now >= position_end :
             break
-        ls = line.split('\t')
-        if len(ls) > 5 :
-            path = ls[5]
-
-            if ls[5].count('>') + ls[5].count('<') > 1 :
-                            
-                if (not 'id:f' in ls[-2]) or (float(ls[-2].split(':')[-1]) > similarity_threshold) or similarity_threshold == 0 :
-                    
-                    if (float(ls[3])-float(ls[2]))/float(ls[1]) > whole_mapping_threshold or whole_mapping_threshold == 0 :
-
-                        local_lines.append((ls[0],ls[5]))
+        informative = informative_GAF_line(line.decode(), similarity_threshold, whole_mapping_threshold)
+        if informative is not None :
+            local_lines.append(informative)
         pos_now += len(line)
+    gaf.close()
 
-    with lock:
-        lines.extend(local_lines)
-        # print("extending with ", len(local_lines), " lines")
-        # print("first and last lines: ", position_begin, " ", position_end, " ", local_lines[0], " ", local_lines[-1])
+    return local_lines
 
 def read_GAF_parallel(gafFile, similarity_threshold, whole_mapping_threshold, lines, n_threads):
     # Create a global lines list
     lines = []
 
-    # Create a lock object
-    lock = threading.Lock()
+    #a compressed file cannot be cut in chunks by byte offsets: read it in one go, the threads decompressing the blocks ahead of the parsing
+    if compression_of(gafFile) is not None :
+        with open_file(gafFile, 'r', threads = n_threads) as gaf :
+            for line in gaf :
+                informative = informative_GAF_line(line, similarity_threshold, whole_mapping_threshold)
+                if informative is not None :
+                    lines.append(informative)
+        return lines
 
     file_size = os.path.getsize(gafFile)
     # Split the file into chunks
@@ -161,8 +178,8 @@ def read_GAF_parallel(gafFile, similarity_threshold, whole_mapping_threshold, li
     
     with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads) as executor:
         # Use the executor to map your function over the data
-        # We're using list() to ensure that all the futures are resolved before we move on
-        results = list(executor.map(read_GAF_chunk, [lines]*n_threads, [gafFile]*n_threads, chunks, chunks_end, [lock] * n_threads, [similarity_threshold] * n_threads, [whole_mapping_threshold] * n_threads))
+        for lines_of_chunk in executor.map(read_GAF_chunk, [gafFile]*len(chunks), chunks, chunks_end, [similarity_threshold] * len(chunks), [whole_mapping_threshold] * len(chunks)) :
+            lines.extend(lines_of_chunk) #in the order of the file, whatever the number of threads
 
     return lines
 
@@ -220,81 +237,285 @@ def read_TSV(tsv_file, names, lines):
                 lines += [alignment]
         
     
-def linkedReads_interactionMatrix(sam, names):
-    
-    interactionMatrix = sparse.dok_matrix((len(names), len(names)))
-    
-    contigsInTag = []
-    tags = {}
-    numbertag = 0
-    
-    f = open(sam)
-    l = 0
-        
-    for line in f :
-        
-        if '@' not in line[0] : #we check that the line is not a part of a header but actual alignment
-        
+#input : a chunk of the SAM file (between two byte offsets)
+#output : the barcode and the contig index of each alignment of the chunk, plus the lines on which no barcode could be found
+def read_SAM_chunk(sam, position_begin, position_end, names):
+
+    tags = []
+    contigs = []
+    lines_without_barcode = []
+    number_of_lines_without_barcode = 0
+
+    with open(sam, 'rb') as f :
+        if position_begin > 0 : #go to the first line that begins in this chunk
+            f.seek(position_begin-1)
+            f.readline()
+
+        while f.tell() < position_end :
+            line = f.readline()
+            if not line :
+                break
+            line = line.decode()
+
+            if line[0] == '@' : #we check that the line is not a part of a header but actual alignment
+                continue
+
             ls = line.split('\t')
-            if ls[2] in names : #that means it matched to a contig in the graph
+            if len(ls) > 2 and ls[2] in names : #that means it matched to a contig in the graph
                 contig = names[ls[2]]
-                
+
                 ls = line.strip('\n').split('BX:Z:')
                 if len(ls) == 1 :
                     ls = line.strip('\n').split('BC:Z:')
                 if len(ls) > 1 :
-                    tag = ls[1].split('\t')[0]
-                    
-                    if tag in tags :
-                        contigsInTag[tags[tag]].append(contig)
-                        
-                    else :
-                        tags[tag] = numbertag
-                        contigsInTag += [[contig]]
-                        
-                        numbertag += 1
-                    
-                else:
-                    if l < 10 :
-                        print("Barcode could not be extracted from line ", line, ", ignoring the line, are you sure the BX:Z: tags are there ?")
-                        l += 1 #just print 10 such lines, the user has understood
-                    if l==9 :
-                        print("Other such lines with unextratable barcodes are present, but I will stop displaying them, I think you get the idea")
-    
-    #now convert contigsInTag into an interaction Matrix
-    print(contigsInTag)
-    for t in contigsInTag :
-        for i in range(len(t)) :
-            
-            for j in range(len(t)) :
-                
-                interactionMatrix[t[i],t[j]] += 1
-
-    # for i in range (len(names)) :
-    #     
-    #     for j in range(len(names)) :
-    #         
-    #         print(interactionMatrix[i,j])
-    #     print()
-    
+                    tags.append(ls[1].split('\t')[0])
+                    contigs.append(contig)
+                else :
+                    if len(lines_without_barcode) < 10 :
+                        lines_without_barcode.append(line)
+                    number_of_lines_without_barcode += 1
+
+    return tags, contigs, lines_without_barcode, number_of_lines_without_barcode
+
+#input : SAM file of the barcoded reads aligned on the contigs, and names of the contigs
+#output : interaction matrix counting, for each pair of contigs, the pairs of alignments sharing a barcode
+def linkedReads_interactionMatrix(sam, names, num_threads = 1):
+
+    file_size = os.path.getsize(sam)
+    # Split the file into chunks, several per thread to balance the load
+    chunk_size = max(file_size // (num_threads*4), 1)
+    chunks = [i for i in range(0, file_size, chunk_size)]
+    chunks_end = [i+chunk_size for i in range(0, file_size, chunk_size)]
+
+    tags = []
+    contigs = []
+    l = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_threads) as executor:
+        for chunk_tags, chunk_contigs, lines_without_barcode, number_of_lines_without_barcode in executor.map(read_SAM_chunk, [sam]*len(chunks), chunks, chunks_end, [names]*len(chunks)) :
+            tags += chunk_tags
+            contigs += chunk_contigs
+            for line in lines_without_barcode :
+                if l < 10 :
+                    print("Barcode could not be extracted from line ", line, ", ignoring the line, are you sure the BX:Z: tags are there ?")
+                    l += 1 #just print 10 such lines, the user has understood
+                if l==9 :
+                    print("Other such lines with unextratable barcodes are present, but I will stop displaying them, I think you get the idea")
+                    l += 1
+
+    if len(tags) == 0 :
+        return sparse.csr_matrix((len(names), len(names)))
+
+    #incidence matrix barcode x contig : entry (b,c) counts the alignments of barcode b on contig c
+    barcodes, barcode_of_alignments = np.unique(np.array(tags), return_inverse=True)
+    incidence = sparse.csr_matrix((np.ones(len(contigs)), (barcode_of_alignments, np.array(contigs))), shape=(len(barcodes), len(names)))
+
+    #each pair of alignments sharing a barcode contributes one contact between their contigs
+    interactionMatrix = (incidence.T @ incidence).tocsr()
+
     return interactionMatrix
 
 
+#input : an interaction matrix, the names of the contigs and the output file
+#output : the matrix written in CSR form in an (uncompressed) .npz archive, along with the names of the contigs in the order of the rows
+def export_interactionMatrix(interactionMatrix, names, file) :
+
+    interactionMatrix = sparse.csr_matrix(interactionMatrix)
+    contigs = [None for i in range(len(names))]
+    for contig in names :
+        contigs[names[contig]] = contig
+
+    with open(file, 'wb') as f : #passing a file object prevents numpy from appending .npz to the name
+        np.savez(f, data = interactionMatrix.data, indices = interactionMatrix.indices, indptr = interactionMatrix.indptr, \
+                 shape = np.array(interactionMatrix.shape), names = np.array(contigs))
+
+#input : an uncompressed .npz archive
+#output : a dict of the arrays of the archive, memory-mapped instead of read in memory
+def memmap_npz(file) :
+
+    arrays = {}
+    with zipfile.ZipFile(file) as archive, open(file, 'rb') as f :
+        for info in archive.infolist() :
+            if info.compress_type != zipfile.ZIP_STORED :
+                print("ERROR: ", file, " is a compressed archive and cannot be memory-mapped")
+                sys.exit(1)
+
+            #skip the local header of the zip entry, then the header of the .npy file
+            f.seek(info.header_offset + 26)
+            length_name = int.from_bytes(f.read(2), 'little')
+            length_extra = int.from_bytes(f.read(2), 'little')
+            f.seek(info.header_offset + 30 + length_name + length_extra)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0) :
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else :
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if np.prod(shape) == 0 or dtype.hasobject :
+                f.seek(info.header_offset + 30 + length_name + length_extra)
+                arrays[info.filename[:-4]] = np.lib.format.read_array(f)
+            else :
+                arrays[info.filename[:-4]] = np.memmap(file, dtype = dtype, mode = 'r', offset = f.tell(), shape = shape, order = 'F' if fortran_order else 'C')
+
+    return arrays
+
 def load_interactionMatrix(file, listOfSegments, names, HiC = False) :
-    f = open(file, 'rb')
-    interactionMatrix  = pickle.load(f)
-    
-    if interactionMatrix.shape != (len(listOfSegments), len(listOfSegments)) :
-        print("ERROR: the interaction matrix provided ( ",file," ) does not seem to match with the GFA file (different number of contigs). Exiting")
-        sys.exit(1)
-    
+
+    if zipfile.is_zipfile(file) :
+        arrays = memmap_npz(file)
+
+        #check that the matrix was built on the same contigs as the GFA
+        contigs = [None for i in range(len(names))]
+        for contig in names :
+            contigs[names[contig]] = contig
+        if list(arrays['names']) != contigs :
+            print("ERROR: the interaction matrix provided ( ",file," ) does not seem to match with the GFA file (different contigs). Exiting")
+            sys.exit(1)
+
+        interactionMatrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = tuple(arrays['shape']), copy = False)
+
+    else : #interaction matrices pickled by older versions of GraphUnzip
+        f = open(file, 'rb')
+        interactionMatrix  = pickle.load(f)
+
+        if interactionMatrix.shape != (len(listOfSegments), len(listOfSegments)) :
+            print("ERROR: the interaction matrix provided ( ",file," ) does not seem to match with the GFA file (different number of contigs). Exiting")
+            sys.exit(1)
+        interactionMatrix = sparse.csr_matrix(interactionMatrix)
+
     if HiC :
+        coverage = np.asarray(interactionMatrix.sum(axis = 1)).ravel()
         for segment in listOfSegments :
             for contig in segment.names :
-                segment.HiCcoverage += np.sum(interactionMatrix[names[contig]])
-    
+                segment.HiCcoverage += coverage[names[contig]]
+
     return interactionMatrix
 
+#input : a list of strings
+#output : the strings encoded in one array of bytes and the offsets of the strings in it, much lighter than a numpy array of strings padded to the longest one
+def pack_strings(strings) :
+
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded)+1, dtype = np.int64)
+    np.cumsum([len(e) for e in encoded], out = offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+def unpack_strings(data, offsets) :
+
+    data = data.tobytes()
+    return [data[offsets[i]:offsets[i+1]].decode() for i in range(len(offsets)-1)]
+
+#input : the graph (segments and names), the name of the last phase done, the file and optionally the state of a phase in progress, as a dict of arrays
+#output : a snapshot of the graph written in an uncompressed .npz, encoded as arrays (see ArrayGraph) instead of pickling linked segments,
+#         with the copies, reads and sequences of the subcontigs, so that GraphUnzip can resume from this phase
+def export_snapshot(segments, names, phase, file, state = None) :
+
+    graph = ArrayGraph.from_segments(segments)
+
+    contigs = [None for i in range(len(names))]
+    for contig in names :
+        contigs[names[contig]] = contig
+
+    copies = []
+    reads = []
+    numberOfReads = []
+    sequences = []
+    hasSequence = []
+    for segment in segments :
+        for c in range(len(segment.names)) :
+            copies.append(segment.get_copy(c))
+            readsHere = segment.get_reads_of_contig(c)
+            reads += readsHere
+            numberOfReads.append(len(readsHere))
+            sequence = segment.get_sequence(c)
+            hasSequence.append(sequence is not None)
+            sequences.append(sequence if sequence is not None else '')
+
+    arrays = {}
+    if state is not None :
+        for key in state :
+            arrays['state_' + key] = state[key]
+    for key, strings in (('names', contigs), ('contig_names', graph.contig_names), ('cigars', graph.cigars), ('reads', reads), ('sequences', sequences)) :
+        arrays[key], arrays[key + '_offsets'] = pack_strings(strings)
+
+    with open(file, 'wb') as f : #passing a file object prevents numpy from appending .npz to the name
+        np.savez(f, phase = np.array(phase), \
+                 sub_contig = graph.sub_contig.array, sub_orientation = graph.sub_orientation.array, sub_length = graph.sub_length.array, \
+                 sub_depth = graph.sub_depth.array, sub_insideCIGAR = graph.sub_insideCIGAR.array, \
+                 sub_copies = np.array(copies, dtype = np.int64), sub_numberOfReads = np.array(numberOfReads, dtype = np.int64), sub_hasSequence = np.array(hasSequence, dtype = np.bool_), \
+                 node_start = graph.node_start.array, node_size = graph.node_size.array, node_HiCcoverage = graph.node_HiCcoverage.array, \
+                 node_trim = np.array([segment.get_trim() for segment in segments], dtype = np.int64).reshape(-1, 2), \
+                 node_freezed = np.array([segment.freezed for segment in segments], dtype = np.bool_).reshape(-1, 2), \
+                 node_locked = np.array([segment.locked for segment in segments], dtype = np.bool_), \
+                 edge_node0 = graph.edge_node0.array, edge_end0 = graph.edge_end0.array, edge_node1 = graph.edge_node1.array, \
+                 edge_end1 = graph.edge_end1.array, edge_cigar = graph.edge_cigar.array, **arrays)
+
+#input : a snapshot written by export_snapshot
+#output : the graph (segments and names) and the name of the last phase done
+def load_snapshot(file) :
+
+    if not zipfile.is_zipfile(file) :
+        print("ERROR: ", file, " is not a snapshot of GraphUnzip")
+        sys.exit(1)
+    arrays = np.load(file)
+
+    graph = ArrayGraph()
+    graph.contig_names = unpack_strings(arrays['contig_names'], arrays['contig_names_offsets'])
+    graph.contig_index = {name : i for i, name in enumerate(graph.contig_names)}
+    graph.cigars = unpack_strings(arrays['cigars'], arrays['cigars_offsets'])
+    graph.cigar_index = {cigar : i for i, cigar in enumerate(graph.cigars)}
+    for column in ('sub_contig', 'sub_orientation', 'sub_length', 'sub_depth', 'sub_insideCIGAR', 'node_start', 'node_size', 'node_HiCcoverage', \
+                   'edge_node0', 'edge_end0', 'edge_node1', 'edge_end1', 'edge_cigar') :
+        getattr(graph, column).reset(arrays[column])
+    graph.node_alive.reset(np.ones(graph.node_start.size, dtype = np.bool_))
+    graph.edge_alive.reset(np.ones(graph.edge_node0.size, dtype = np.bool_))
+
+    segments = graph.to_segments()
+
+    contigs = unpack_strings(arrays['names'], arrays['names_offsets'])
+    names = {contig : i for i, contig in enumerate(contigs)}
+
+    reads = unpack_strings(arrays['reads'], arrays['reads_offsets'])
+    sequences = unpack_strings(arrays['sequences'], arrays['sequences_offsets'])
+    copies = arrays['sub_copies'].tolist()
+    numberOfReads = arrays['sub_numberOfReads'].tolist()
+    hasSequence = arrays['sub_hasSequence'].tolist()
+    trims = arrays['node_trim'].tolist()
+    freezed = arrays['node_freezed'].tolist()
+    locked = arrays['node_locked'].tolist()
+
+    sub = 0
+    read = 0
+    for s, segment in enumerate(segments) :
+        subcontigs = range(sub, sub + len(segment.names))
+        if any(copies[c] != -1 for c in subcontigs) :
+            segment.set_copiesOfContigs([copies[c] for c in subcontigs])
+        if any(numberOfReads[c] > 0 for c in subcontigs) :
+            readsOfSegment = []
+            for c in subcontigs :
+                readsOfSegment.append(reads[read:read+numberOfReads[c]])
+                read += numberOfReads[c]
+            segment.set_reads(readsOfSegment)
+        if any(hasSequence[c] for c in subcontigs) :
+            segment.set_sequences([sequences[c] if hasSequence[c] else None for c in subcontigs])
+        segment.set_trim(trims[s])
+        for end in range(2) :
+            if freezed[s][end] :
+                segment.freeze(end)
+        segment.set_locked(locked[s])
+        sub += len(segment.names)
+
+    return segments, names, str(arrays['phase'])
+
+#input : a snapshot written by export_snapshot
+#output : the state of the phase in progress saved with it, as a dict of arrays, or None if the snapshot was written between two phases
+def load_snapshot_state(file) :
+
+    arrays = np.load(file)
+    keys = [key for key in arrays.files if key.startswith('state_')]
+    if len(keys) == 0 :
+        return None
+    return {key[len('state_'):] : arrays[key] for key in keys}
+
 #input : contig ID and fasta file
 #output : sequence
 def get_contig_FASTA(fastaFile, contig, firstline=0):
@@ -630,157 +851,401 @@ def export_to_fasta(listOfSegments, gfaFile, exportFile="results/newAssembly.fas
         f.write(sequence + "\n")
 
 
-# Return a list in which each element contains a list of linked contigs (accroding to GFA). There is one list for each end of the contig
-# Also returns the list of the contig's names
-def load_gfa(file):
+#input : a GFA file (plain or BGZF)
+#output : a dict associating each segment of the GFA with the offset of its S line (virtual offset if BGZF), to fetch the sequences without going through the whole file
+def index_GFA_segments(gfaFile, threads = 1):
 
-    print('Loading contigs')
-    gfa_read = open(file, "r")
+    check_random_access(gfaFile, "Fetching the sequences of the GFA")
 
-    segments = []
-    
-    index = 0
-    names = {} # names is a dictionary that associates the name of each contig in the gfa with an index (which will correspond later to the one in interactionMatrix and copiesnumber)
-    
-    for line in gfa_read:
-        if line[0] == "S":
+    line_offset = {}
+    with open_file(gfaFile, 'rb', threads = threads) as gfa :
+        offset = gfa.tell()
+        line = gfa.readline()
+        while line :
+            if line[:2] == b'S\t' :
+                line_offset[line[2:].split(b'\t', 1)[0].strip().decode()] = offset
+            offset = gfa.tell()
+            line = gfa.readline()
 
-            l = line.strip('\n').split("\t")
-            if line[4] == '\t' :
-                l = l[:4] + [''] + l[4:]
-            cov = 0
-            
-            for element in l :
-                if 'dp' in element[:2] or 'DP' in element[:2] :
-                    try :
-                       cov = float(element.split(":")[-1])
-                    except:
-                        pass
-                        
-                elif 'RC' in element[:2] or 'KC' in element[:2] :
-                    try :
-                       cov = float(element.split(":")[-1])/len(l[2])
-                    except:
-                        pass
-            
-            s = Segment([l[1]], [1], [len(l[2])], readCoverage = [cov])
-            segments.append(s)
-            names[s.names[0]] = index #now this contig (identified by its name) is attached to index
-            index += 1            
+    return line_offset
 
-    gfa_read = open(file, "r")
-        
-    cov = 1
-    for line in gfa_read:
-        if line[0] == "L":
-
-            l = line.strip('\n').split("\t")
-            
-            segments[names[l[1]]].add_link_from_GFA(line, names, segments, 0)
-            segments[names[l[3]]].add_link_from_GFA(line, names, segments, 1)
-
-    gfa_read.close()
-    
-    delete_links_present_twice(segments)
+#input : an open (binary) GFA file, as returned by open_file, and the offset of an S line
+#output : sequence, depth tag and the rest of the optional tags of the segment
+def read_segment_at_offset(gfa, offset):
 
-    return segments, names
+    gfa.seek(offset)
+    sline = gfa.readline().decode().strip('\n').split('\t')
 
-def load_chunk_of_GFA(file, position_begin, position_end, segments, names, lock):
+    depth = ''
+    extra_tags = []
+    for tag in sline[3:] :
+        if 'dp' in tag or 'DP' in tag or 'KC' in tag or 'RC' in tag :
+            depth = tag
+        elif tag != '' :
+            extra_tags.append(tag)
 
-    gfa_read = open(file)
-    gfa_read.seek(position_begin)
-    local_segments = []
-    pos_now = position_begin
+    sequence = sline[2] if len(sline) > 2 else '*'
+    if sequence == '*' :
+        sequence = ''
 
-    for line in gfa_read:
+    return sequence, depth, '\t'.join(extra_tags)
 
-        if position_begin != 0 and pos_now==position_begin : #this line was in the previous chunk
-            pos_now += len(line)
-            continue
-        if pos_now > position_end :
-            break
+complement_table = str.maketrans("ACGTacgt", "TGCAtgca")
 
-        if line[0] == "S":
+#input : the untangled graph, the original GFA and the output files (fastaFile = "None" for no fasta output)
+#output : the graph written in GFA (and fasta, both compressed if their name ends with .gz) in one pass. Each subcontig is a GFA segment named contig-copy, and if merge_adjacent_contigs, all simple paths of subcontigs are merged into one segment.
+#         If rename_contigs, merged segments are named supercontig_i and the correspondance is written in supercontigs.txt next to the GFA
+def export_graph(listOfSegments, gfaFile, exportFile, fastaFile = "None", merge_adjacent_contigs = True, rename_contigs = False, sort_strategy = 'length', line_offset = None):
 
-            l = line.strip('\n').split("\t")
-            if line[4] == '\t' :
-                l = l[:4] + [''] + l[4:]
-            cov = 0
-            
-            for element in l :
-                if 'dp' in element[:2] or 'DP' in element[:2] :
-                    try :
-                       cov = float(element.split(":")[-1])
-                    except:
-                        pass
-                        
-                elif 'RC' in element[:2] or 'KC' in element[:2] :
-                    try :
-                       cov = float(element.split(":")[-1])/len(l[2])
-                    except:
-                        pass
-            
-            s = Segment([l[1]], [1], [len(l[2])], readCoverage = [cov])
-            local_segments.append(s)
-
-        pos_now += len(line)
+    check_random_access(gfaFile, "Exporting the sequences")
+    if line_offset is None :
+        line_offset = index_GFA_segments(gfaFile)
 
-    with lock:
-        index = 0
-        for s in local_segments :
-            names[s.names[0]] = len(segments) + index
-            index += 1
+    # now sort the segments either by length or by coverage, to output at the beginning of the files the longests or most covered fragments
+    if sort_strategy == "coverage" :
+        listOfSegments.sort(key = lambda x : x.depth, reverse = True)
+    else :
+        listOfSegments.sort(key = lambda x : x.length, reverse = True)
 
-        segments += local_segments
-        print("Loaded ", len(segments), " segments", end='\r')
+    #build the graph of the subcontigs: each subcontig is designated by (index of its segment, index in the segment), and has a list of links at each of its ends ([(subcontig, end, CIGAR), ...], [(subcontig, end, CIGAR), ...])
+    #end 0 being the left end of the subcontig in its orientation in the original GFA
+    index_of_segment = {}
+    for s, segment in enumerate(listOfSegments) :
+        index_of_segment[segment.ID] = s
+
+    subcontigs = []
+    links = {}
+    for s, segment in enumerate(listOfSegments) :
+        for c in range(len(segment.names)) :
+            subcontigs.append((s, c))
+            links[(s, c)] = [[], []]
+
+    for s, segment in enumerate(listOfSegments) :
+        #links inside the segment
+        for c in range(1, len(segment.names)) :
+            end_before = segment.orientations[c-1]
+            end_after = 1-segment.orientations[c]
+            links[(s, c-1)][end_before].append(((s, c), end_after, segment.insideCIGARs[c-1]))
+            links[(s, c)][end_after].append(((s, c-1), end_before, segment.insideCIGARs[c-1]))
+
+        #links between segments, added from one side only
+        for endOfSegment in range(2) :
+            subcontig = (s, -endOfSegment % len(segment.names))
+            end = endOfSegment if segment.orientations[-endOfSegment] == 1 else 1-endOfSegment
+            for n, neighbor in enumerate(segment.links[endOfSegment]) :
+                endOfNeighbor = segment.otherEndOfLinks[endOfSegment][n]
+                neighbor_subcontig = (index_of_segment[neighbor.ID], -endOfNeighbor % len(neighbor.names))
+                neighbor_end = endOfNeighbor if neighbor.orientations[-endOfNeighbor] == 1 else 1-endOfNeighbor
+                if (subcontig, end) < (neighbor_subcontig, neighbor_end) :
+                    links[subcontig][end].append((neighbor_subcontig, neighbor_end, segment.CIGARs[endOfSegment][n]))
+                    links[neighbor_subcontig][neighbor_end].append((subcontig, end, segment.CIGARs[endOfSegment][n]))
+                elif (subcontig, end) == (neighbor_subcontig, neighbor_end) and (neighbor_subcontig, neighbor_end, segment.CIGARs[endOfSegment][n]) not in links[subcontig][end] :
+                    links[subcontig][end].append((neighbor_subcontig, neighbor_end, segment.CIGARs[endOfSegment][n]))
+
+    #group the subcontigs in new segments: each new segment is a list [(subcontig, orientation, CIGAR), ...]
+    new_segments = []
+    new_segment_of_subcontig = {} #associates each subcontig with (index of the new segment, end of the new segment), end being -1 if the subcontig is not at an end and 2 if the new segment contains only this subcontig
+    if not merge_adjacent_contigs :
+        for subcontig in subcontigs :
+            new_segment_of_subcontig[subcontig] = (len(new_segments), 2)
+            new_segments.append([(subcontig, 1, "0M")])
+    else :
+        #start new segments at the subcontigs that cannot be merged at one end, then at the subcontigs in loops
+        for loops in range(2) :
+            for subcontig in subcontigs :
+                for end in range(2) :
+                    if subcontig not in new_segment_of_subcontig and (loops == 1 or len(links[subcontig][end]) != 1 or len(links[links[subcontig][end][0][0]][links[subcontig][end][0][1]]) != 1) :
+
+                        new_segment = [(subcontig, 1-end, "0M")]
+                        subcontigNow, endNow = subcontig, 1-end #end from which we are trying to extend
+                        already_merged = set([subcontig])
+                        while len(links[subcontigNow][endNow]) == 1 and len(links[links[subcontigNow][endNow][0][0]][links[subcontigNow][endNow][0][1]]) == 1 and links[subcontigNow][endNow][0][0] not in already_merged :
+                            neighbor, endOfNeighbor, CIGAR = links[subcontigNow][endNow][0]
+                            new_segment.append((neighbor, 1-endOfNeighbor, CIGAR))
+                            subcontigNow, endNow = neighbor, 1-endOfNeighbor
+                            already_merged.add(subcontigNow)
+
+                        for i, (sub, orientation, CIGAR) in enumerate(new_segment) :
+                            if i == 0 and i == len(new_segment)-1 :
+                                new_segment_of_subcontig[sub] = (len(new_segments), 2)
+                            elif i == 0 :
+                                new_segment_of_subcontig[sub] = (len(new_segments), 0)
+                            elif i == len(new_segment)-1 :
+                                new_segment_of_subcontig[sub] = (len(new_segments), 1)
+                            else :
+                                new_segment_of_subcontig[sub] = (len(new_segments), -1)
+                        new_segments.append(new_segment)
+
+    def name_of_subcontig(subcontig) :
+        segment = listOfSegments[subcontig[0]]
+        return segment.names[subcontig[1]] + "-" + str(segment.copiesnumber[subcontig[1]])
+
+    names_of_new_segments = []
+    for n, new_segment in enumerate(new_segments) :
+        if merge_adjacent_contigs and rename_contigs :
+            names_of_new_segments.append("supercontig_" + str(n))
+        else :
+            names_of_new_segments.append("_".join([name_of_subcontig(i[0]) for i in new_segment]))
+
+    #now write everything in one pass over the new segments
+    gfa = open_file(gfaFile, 'rb')
+    out = open_file(exportFile, 'w')
+    fasta = None
+    if fastaFile != "None" :
+        fasta = open_file(fastaFile, 'w')
+    supercontigs = None
+    if merge_adjacent_contigs and rename_contigs :
+        supercontigs = open(os.path.join(os.path.dirname(exportFile), 'supercontigs.txt'), 'w', buffering = 1024*1024)
 
-def load_chunk_of_GFA_links(file, position_begin, position_end, segments, names, lock):
+    t = time.time()
+    L_lines = []
+    for n, new_segment in enumerate(new_segments) :
 
-    gfa_read = open(file)
-    gfa_read.seek(position_begin)
-    local_segments = []
-    pos_now = position_begin
+        if time.time() > t+1 :
+            t = time.time()
+            print(int(n / len(new_segments) * 1000) / 10, "% of sequences written", end = '\r')
+
+        all_sequences = []
+        depth_total = 0
+        length_total = 0
+        for subcontig, orientation, CIGAR in new_segment :
+            segment = listOfSegments[subcontig[0]]
+            c = subcontig[1]
+            seq, depth, extra_tags = read_segment_at_offset(gfa, line_offset[segment.names[c]])
+            if segment.get_sequence(c) != None : #repolished sequence
+                seq = segment.get_sequence(c)
+
+            length_total += len(seq)
+            if depth != '' :
+                depth_total += segment.depths[c]*len(seq)
 
-    for line in gfa_read:
+            if orientation == 0 :
+                seq = seq.translate(complement_table)[::-1]
+            all_sequences.append(seq[sum([int(i) for i in re.findall(r'\d+', CIGAR)]):])
 
-        if position_begin != 0 and pos_now==position_begin : #this line was in the previous chunk
-            pos_now += len(line)
-            continue
-        if pos_now >= position_end :
-            break
+        sequence = "".join(all_sequences)
+        name = names_of_new_segments[n]
 
-        if line[0] == "L":
+        if merge_adjacent_contigs :
+            out.write("S\t" + name + "\t" + sequence + "\tDP:f:" + str(depth_total/(length_total+1)) + "\n")
+        else :
+            if extra_tags != "" :
+                extra_tags = "\t" + extra_tags
+            if depth == '' :
+                out.write("S\t" + name + "\t" + sequence + extra_tags + "\n")
+            else :
+                out.write("S\t" + name + "\t" + sequence + "\t" + ":".join(depth.split(':')[:-1]) + ":" + str(segment.depths[c]) + extra_tags + "\n")
+
+        if fasta is not None :
+            fasta.write(">" + name + "\n" + sequence + "\n")
+        if supercontigs is not None :
+            supercontigs.write(name + "\t" + "_".join([name_of_subcontig(i[0]) for i in new_segment]) + "\n")
+
+        #links at the left end and at the right end of the new segment, written only from one side
+        for endOfNewSegment, (subcontig, orientation, CIGAR) in ((0, new_segment[0]), (1, new_segment[-1])) :
+            endOfSubcontig = 1-orientation if endOfNewSegment == 0 else orientation
+            for neighbor, endOfNeighbor, CIGAR in links[subcontig][endOfSubcontig] :
+                new_neighbor, new_neighbor_end = new_segment_of_subcontig[neighbor]
+                if new_neighbor_end == 2 : #means the neighbor is alone in its new segment, in its original orientation
+                    new_neighbor_end = endOfNeighbor
+                if new_neighbor_end == -1 :
+                    print("ERROR : new segment has a link with a segment that is not at an end")
+                    sys.exit(1)
+
+                if (n, endOfNewSegment) <= (new_neighbor, new_neighbor_end) :
+                    L_lines.append("L\t" + name + "\t" + "-+"[endOfNewSegment] + "\t" + names_of_new_segments[new_neighbor] + "\t" + "+-"[new_neighbor_end] + "\t" + CIGAR + "\n")
+
+    for l in L_lines :
+        out.write(l)
+
+    gfa.close()
+    out.close()
+    if fasta is not None :
+        fasta.close()
+    if supercontigs is not None :
+        supercontigs.close()
 
-            l = line.strip('\n').split("\t")
+# Return a list in which each element contains a list of linked contigs (accroding to GFA). There is one list for each end of the contig
+# Also returns the list of the contig's names
+def load_gfa(file):
 
-            with lock:
-            
-                segments[names[l[1]]].add_link_from_GFA(line, names, segments, 0)
-                segments[names[l[3]]].add_link_from_GFA(line, names, segments, 1)
+    print('Loading contigs')
+    segments, names = load_GFA_parallel(file, 1)
 
-        pos_now += len(line)
+    delete_links_present_twice(segments)
 
-def load_GFA_parallel(file, num_threads):
+    return segments, names
 
-    # Create a lock object
-    lock = threading.Lock()
+#input : a memory-mapped GFA and a chunk of it (between two byte offsets)
+#output : the start and end of all the lines beginning in this chunk, without copying the lines
+def lines_of_chunk(gfa, position_begin, position_end):
+
+    pos = 0
+    if position_begin > 0 : #the line overlapping position_begin belongs to the previous chunk
+        pos = gfa.find(b'\n', position_begin-1) + 1
+        if pos == 0 :
+            return
+
+    while pos < position_end and pos < len(gfa) :
+        end_of_line = gfa.find(b'\n', pos)
+        if end_of_line == -1 :
+            end_of_line = len(gfa)
+        yield pos, end_of_line
+        pos = end_of_line + 1
+
+#input : a buffer (memory-mapped GFA or line) and the start and end of an S line in it
+#output : the name, length and coverage of the contig, read from the S line without copying the sequence
+def contig_of_S_line(gfa, pos, end_of_line):
+
+    if gfa[end_of_line-1:end_of_line] == b'\r' :
+        end_of_line -= 1
+    end_of_name = gfa.find(b'\t', pos+2, end_of_line)
+    if end_of_name == -1 :
+        end_of_name = end_of_line
+    end_of_sequence = gfa.find(b'\t', end_of_name+1, end_of_line)
+    if end_of_sequence == -1 :
+        end_of_sequence = end_of_line
+
+    name = gfa[pos+2:end_of_name].decode()
+    length = max(0, end_of_sequence-end_of_name-1)
+    tags = gfa[end_of_sequence+1:end_of_line].decode().split('\t')
+
+    cov = 0
+    for element in tags :
+        if 'dp' in element[:2] or 'DP' in element[:2] :
+            try :
+               cov = float(element.split(":")[-1])
+            except:
+                pass
+
+        elif 'RC' in element[:2] or 'KC' in element[:2] :
+            try :
+               cov = float(element.split(":")[-1])/length
+            except:
+                pass
+
+    return name, length, cov
+
+#input : the name, length and coverage of a contig, as given by contig_of_S_line
+#output : the segment made of this contig. Segments are always created in the main thread, in the order of the GFA, since their IDs follow the order of creation
+def segment_of_contig(name, length, cov):
+    return Segment([name], [1], [length], readCoverage = [cov])
+
+#input : a chunk of the GFA file
+#output : the contigs of the chunk, as given by contig_of_S_line: the sequences are never read
+def load_chunk_of_GFA(file, position_begin, position_end):
+
+    local_contigs = []
+    local_offsets = []
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as gfa :
+        for pos, end_of_line in lines_of_chunk(gfa, position_begin, position_end) :
+
+            if gfa[pos:pos+2] == b"S\t" :
+
+                local_contigs.append(contig_of_S_line(gfa, pos, end_of_line))
+                local_offsets.append(pos)
+
+    return local_contigs, local_offsets
+
+#input : an L line of the GFA and names, a dict associating each contig with its index in segments
+#output : the link as (index of contig 1, end of contig 1, index of contig 2, end of contig 2, CIGAR), or None if the line is malformed
+def link_of_L_line(line, names):
+
+    l = line.split("\t")
+    if len(l) < 5 or l[2] not in ('+', '-') or l[4] not in ('+', '-') :
+        print('ERROR while creating a link : orientations not properly given.')
+        print('Problematic line : ', line)
+        return None
+
+    CIGAR = '*'
+    if len(l) > 5 :
+        CIGAR = l[5]
+    #a link leaves contig 1 by its right end if it is '+', and arrives on contig 2 by its left end if it is '+'
+    return names[l[1]], int(l[2] == '+'), names[l[3]], int(l[4] == '-'), CIGAR
+
+#input : a chunk of the GFA file
+#output : the links of the L lines of the chunk, as given by link_of_L_line. They are added to the segments afterwards, all at once
+def load_chunk_of_GFA_links(file, position_begin, position_end, names):
+
+    local_links = []
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as gfa :
+        for pos, end_of_line in lines_of_chunk(gfa, position_begin, position_end) :
+
+            if gfa[pos:pos+2] == b"L\t" :
+
+                link = link_of_L_line(gfa[pos:end_of_line].decode().strip('\r'), names)
+                if link is not None :
+                    local_links.append(link)
+
+    return local_links
+
+#input : a GFA file, and optionally a dict to fill with the offset of the S line of each contig
+#output : the list of segments (in the order of the GFA) and names, a dict associating each contig with its index in segments
+#         Only the topology of the graph is loaded: the sequences are fetched later through the offsets (see index_GFA_segments)
+def load_GFA_parallel(file, num_threads, line_offset = None):
 
     segments = []
     names = {}
 
+    if compression_of(file) is not None :
+        return load_compressed_GFA(file, num_threads, line_offset)
+
     file_size = os.path.getsize(file)
+    if file_size == 0 :
+        return segments, names
     # Split the file into chunks
-    chunk_size = file_size // num_threads // 4
+    chunk_size = max(file_size // num_threads // 4, 1)
     chunks = [i for i in range(0, file_size, chunk_size)]
     chunks_end = [i+chunk_size for i in range(0, file_size, chunk_size)]
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
         # Use the executor to map your function over the data
-        # We're using list() to ensure that all the futures are resolved before we move on
-        results = list(executor.map(load_chunk_of_GFA, [file]*len(chunks), chunks, chunks_end, [segments] * len(chunks), [names] * len(chunks), [lock] * len(chunks)))        
-        results = list(executor.map(load_chunk_of_GFA_links, [file]*len(chunks), chunks, chunks_end, [segments] * len(chunks), [names] * len(chunks), [lock] * len(chunks)))
+        # The chunks are gathered in order and the segments created here, so that segments and their IDs follow the order of the GFA whatever the number of threads
+        for local_contigs, local_offsets in executor.map(load_chunk_of_GFA, [file]*len(chunks), chunks, chunks_end) :
+            for s, contig in enumerate(local_contigs) :
+                segment = segment_of_contig(*contig)
+                names[segment.names[0]] = len(segments)
+                segments.append(segment)
+                if line_offset is not None :
+                    line_offset[segment.names[0]] = local_offsets[s]
+        print("Loaded ", len(segments), " segments")
+
+        links = []
+        for local_links in executor.map(load_chunk_of_GFA_links, [file]*len(chunks), chunks, chunks_end, [names] * len(chunks)) :
+            links += local_links
+
+    add_links_in_bulk(segments, links)
 
     return segments, names
 
+#input : a gzip or BGZF GFA file, and optionally a dict to fill with the offset of the S line of each contig
+#output : same as load_GFA_parallel. A compressed file cannot be memory-mapped nor cut in chunks, so it is read in one go while the threads decompress the blocks ahead
+#         On BGZF files the offsets are virtual offsets, that open_file(file, 'rb').seek() understands
+def load_compressed_GFA(file, num_threads, line_offset = None):
 
+    segments = []
+    names = {}
+    L_lines = []
+
+    with open_file(file, 'rb', threads = num_threads) as gfa :
+        offset = gfa.tell()
+        line = gfa.readline()
+        while line :
+            if line[:2] == b"S\t" :
+                segment = segment_of_contig(*contig_of_S_line(line, 0, len(line.rstrip(b'\n'))))
+                names[segment.names[0]] = len(segments)
+                segments.append(segment)
+                if line_offset is not None :
+                    line_offset[segment.names[0]] = offset
+
+            elif line[:2] == b"L\t" :
+                L_lines.append(line.decode().strip('\r\n'))
 
+            offset = gfa.tell()
+            line = gfa.readline()
+    print("Loaded ", len(segments), " segments")
+
+    links = [link_of_L_line(line, names) for line in L_lines]
+    add_links_in_bulk(segments, [link for link in links if link is not None])
+
+    return segments, names
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+File dedicated to profiling a graph and its long reads before unzipping it: complexity statistics
+and estimates of the resources simple_unzip2 and repolish_contigs will need
+"""
+
+import re
+from collections import Counter
+
+import numpy as np
+
+from simple_unzip import MIN_SEGMENTS_PER_PROCESS
+
+#costs used to estimate the resources of simple_unzip2 with one thread, fitted (non-negative least squares on the relative errors) on its timings and
+#memory peaks (tracemalloc) on tangled test graphs from 120 contigs / 1,500 reads to 6,000 contigs / 150,000 reads: the time is driven by the passages
+#of reads through hubs and by the segments, within 30% on these graphs, the memory by the segments and the paths, within a factor 2
+SIMPLE_UNZIP2_SECONDS_PER_HUB_OCCURRENCE = 9.6e-6
+SIMPLE_UNZIP2_SECONDS_PER_SEGMENT = 1.1e-3
+SIMPLE_UNZIP2_BYTES_PER_SEGMENT = 7200
+SIMPLE_UNZIP2_BYTES_PER_PATH = 390
+#with several threads, only the evaluation of the segments by the worker processes is parallel, when the worklists are large enough (MIN_SEGMENTS_PER_PROCESS):
+#it is at most 11% of the time on the largest test graph, the decisions invalidated by previous duplications being evaluated again in the main process.
+#Each worker process adds up to 40% of the memory of the main process (the pages of the graph it touches are copied)
+SIMPLE_UNZIP2_PARALLEL_FRACTION = 0.11
+SIMPLE_UNZIP2_BYTES_PER_WORKER = 0.4
+#the costs of repolish_contigs are NOT calibrated, only rough guesses: one minimap2 + racon job and the reads it polishes, the jobs running side by side on
+#the threads, and the index of the reads (without the memory of minimap2 and racon)
+REPOLISH_SECONDS_PER_JOB = 1.5
+REPOLISH_SECONDS_PER_READ = 0.01
+REPOLISH_BYTES_PER_READ_INDEXED = 200
+
+#input : a list of numbers
+#output : a few quantiles of the distribution, as a dict
+def distribution(values) :
+
+    if len(values) == 0 :
+        return {'number' : 0}
+    values = np.asarray(values)
+    return {'number' : int(len(values)), 'min' : int(values.min()), 'median' : float(np.median(values)), 'mean' : float(values.mean()), \
+            'p90' : float(np.percentile(values, 90)), 'p99' : float(np.percentile(values, 99)), 'max' : int(values.max())}
+
+#input : the graph and the lines of the GAF (as returned by read_GAF_parallel)
+#output : a dict of statistics on the complexity of the graph and of the paths of the reads in it
+def profile_graph(segments, names, lines) :
+
+    index = {segment.ID : s for s, segment in enumerate(segments)}
+    segment_of_contig = {}
+    for s, segment in enumerate(segments) :
+        for contig in segment.names :
+            segment_of_contig[contig] = s
+
+    stats = {'segments' : len(segments), 'links' : 0, 'total_length' : int(sum(segment.length for segment in segments))}
+
+    #degree of the ends, ambiguous ends (more than one link) and hubs (segments with an ambiguous end)
+    degrees = Counter()
+    ambiguousEnds = 0
+    hubs = []
+    for s, segment in enumerate(segments) :
+        hub = False
+        for end in range(2) :
+            degree = len(segment.links[end])
+            degrees[degree] += 1
+            stats['links'] += degree
+            if degree > 1 :
+                ambiguousEnds += 1
+                hub = True
+        if hub :
+            hubs.append(s)
+    stats['links'] //= 2
+    stats['degree_distribution'] = {str(degree) : degrees[degree] for degree in sorted(degrees)}
+    stats['ambiguous_ends'] = ambiguousEnds
+    stats['hubs'] = len(hubs)
+
+    #tangles: sets of segments connected through ambiguous ends
+    parent = list(range(len(segments)))
+    def root(s) :
+        while parent[s] != s :
+            parent[s] = parent[parent[s]]
+            s = parent[s]
+        return s
+    for s in hubs :
+        for end in range(2) :
+            if len(segments[s].links[end]) > 1 :
+                for neighbor in segments[s].links[end] :
+                    r1, r2 = root(s), root(index[neighbor.ID])
+                    if r1 != r2 :
+                        parent[r2] = r1
+    hubsOfTangle = Counter([root(s) for s in hubs])
+    tangles = {r : set() for r in hubsOfTangle}
+    for s in hubs : #the tangle is made of the hubs and of their neighbors
+        tangles[root(s)].add(s)
+        for end in range(2) :
+            for neighbor in segments[s].links[end] :
+                tangles[root(s)].add(index[neighbor.ID])
+    stats['tangles'] = len(tangles)
+    stats['largest_tangle'] = {'segments' : 0, 'hubs' : 0, 'length' : 0}
+    if len(tangles) > 0 :
+        largest = max(tangles, key = lambda r : len(tangles[r]))
+        stats['largest_tangle'] = {'segments' : len(tangles[largest]), 'hubs' : hubsOfTangle[largest], \
+                                   'length' : int(sum(segments[s].length for s in tangles[largest]))}
+
+    #paths of the reads: length, occurrences of the segments and distinct paths through each hub
+    hubSet = set(hubs)
+    pathLengths = []
+    occurrences = 0
+    hubOccurrences = 0
+    readNames = set()
+    distinctPaths = {s : set() for s in hubs}
+    pairs = {s : Counter() for s in hubs} #(neighbor on the left, neighbor on the right) of the reads going through the hub, to estimate the number of copies
+    unknownContigs = 0
+    for line in lines :
+        contigs = re.split('[><]', line[1].rstrip())[1:]
+        orientations = re.findall('[<>]', line[1])
+        try :
+            path = [(segment_of_contig[contigs[i]], int(orientations[i] == '>')) for i in range(len(contigs))]
+        except KeyError :
+            unknownContigs += 1
+            continue
+        readNames.add(line[0])
+        pathLengths.append(len(path))
+        occurrences += len(path)
+        key = None
+        for p, (s, orientation) in enumerate(path) :
+            if s in hubSet :
+                hubOccurrences += 1
+                if key is None :
+                    reverse = tuple((c, 1-o) for c, o in reversed(path))
+                    key = min(tuple(path), reverse)
+                distinctPaths[s].add(key)
+                if 0 < p < len(path)-1 :
+                    left, right = path[p-1], path[p+1]
+                    if orientation == 0 :
+                        left, right = (path[p+1][0], 1-path[p+1][1]), (path[p-1][0], 1-path[p-1][1])
+                    pairs[s][(left, right)] += 1
+
+    stats['paths'] = len(pathLengths)
+    stats['reads'] = len(readNames)
+    stats['paths_on_unknown_contigs'] = unknownContigs
+    stats['path_length_distribution'] = distribution(pathLengths)
+    stats['occurrences'] = occurrences
+    stats['hub_occurrences'] = hubOccurrences
+    stats['distinct_paths_per_hub'] = distribution([len(distinctPaths[s]) for s in hubs])
+
+    #the hubs that will probably be duplicated: at least two pairs of neighbors supported by 2 reads or more, as in simple_unzip2
+    copies = {s : sum(1 for pair in pairs[s] if pairs[s][pair] >= 2) for s in hubs}
+    stats['predicted_copies_of_hubs'] = distribution([copies[s] for s in hubs])
+    stats['repolishing_jobs'] = int(sum(copies[s] for s in hubs if copies[s] > 1 and segments[s].length >= 100))
+    stats['reads_repolished'] = int(sum(sum(pairs[s].values()) for s in hubs if copies[s] > 1 and segments[s].length >= 100))
+
+    return stats
+
+#input : the statistics returned by profile_graph and the number of threads (-t of unzip)
+#output : estimates of the time (in seconds) and memory (in bytes) simple_unzip2 and repolish_contigs will need
+def estimate_resources(stats, threads = 1) :
+
+    estimates = {'threads' : threads}
+    seconds = SIMPLE_UNZIP2_SECONDS_PER_HUB_OCCURRENCE*stats['hub_occurrences'] + SIMPLE_UNZIP2_SECONDS_PER_SEGMENT*stats['segments']
+    memory = SIMPLE_UNZIP2_BYTES_PER_SEGMENT*stats['segments'] + SIMPLE_UNZIP2_BYTES_PER_PATH*stats['paths']
+    if threads > 1 and stats['hubs'] >= 2*MIN_SEGMENTS_PER_PROCESS : #the first worklist, made of the hubs, is evaluated by worker processes
+        seconds *= 1 - SIMPLE_UNZIP2_PARALLEL_FRACTION + SIMPLE_UNZIP2_PARALLEL_FRACTION/threads
+        memory *= 1 + SIMPLE_UNZIP2_BYTES_PER_WORKER*threads
+    estimates['simple_unzip2_seconds'] = seconds
+    estimates['simple_unzip2_bytes'] = memory
+    estimates['repolish_calibrated'] = False
+    estimates['repolish_seconds'] = (REPOLISH_SECONDS_PER_JOB*stats['repolishing_jobs'] + REPOLISH_SECONDS_PER_READ*stats['reads_repolished']) / threads
+    estimates['repolish_bytes'] = REPOLISH_BYTES_PER_READ_INDEXED*stats['reads']
+    return estimates
+
+#input : a number of bytes
+#output : the number in a readable unit
+def human_bytes(number) :
+
+    for unit in ['B', 'kB', 'MB', 'GB'] :
+        if number < 1024 :
+            return str(round(number, 1)) + " " + unit
+        number /= 1024
+    return str(round(number, 1)) + " TB"
+
+#input : the statistics and estimates
+#output : a report printed for the user
+def print_profile(stats, estimates) :
+
+    print("\n*Profile of the graph*\n")
+    print("Segments: ", stats['segments'], ", links: ", stats['links'], ", total length: ", stats['total_length'])
+    print("Degree distribution (degree: number of ends): ", ", ".join([degree + ": " + str(number) for degree, number in stats['degree_distribution'].items()]))
+    print("Ambiguous ends (more than one link): ", stats['ambiguous_ends'], ", on ", stats['hubs'], " hubs")
+    print("Tangles: ", stats['tangles'], ", the largest one has ", stats['largest_tangle']['segments'], " segments (", stats['largest_tangle']['hubs'], " hubs) for a total length of ", stats['largest_tangle']['length'])
+    print("\n*Profile of the reads*\n")
+    print("Paths: ", stats['paths'], " from ", stats['reads'], " reads (", stats['paths_on_unknown_contigs'], " paths ignored because they go through contigs absent from the graph)")
+    for title, key in [("Path length (contigs)", 'path_length_distribution'), ("Distinct paths per hub", 'distinct_paths_per_hub'), ("Predicted copies of the hubs", 'predicted_copies_of_hubs')] :
+        print(title, ": ", ", ".join([quantile + " " + str(round(value, 1)) for quantile, value in stats[key].items()]))
+    print("\n*Estimated resources with ", estimates['threads'], " threads*\n")
+    print("simple_unzip2: ", round(estimates['simple_unzip2_seconds'], 1), " s, ", human_bytes(estimates['simple_unzip2_bytes']))
+    print("repolish_contigs (rough guess, not calibrated): ", stats['repolishing_jobs'], " jobs, ", round(estimates['repolish_seconds'], 1), " s, ", \
+          human_bytes(estimates['repolish_bytes']), " (without minimap2 and racon)")
@@ -4,6 +4,12 @@
 import os
 import sys
 import re
+import shlex #to quote the scratch directories in the commands
+import shutil #to remove the scratch directories
+import tempfile #to create the scratch directories
+import concurrent.futures #to run the repolishing jobs in parallel
+
+from compressed_io import open_file, check_random_access
 
 def reverse_complement(seq) :
     complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N':'N'}
@@ -22,7 +28,7 @@ def assign_reads_to_contigs(segments, gaf_file, copies):
             subcontig_to_segments[subcontig].add((s, su))
     
     #go through the gaf file and associate reads to segments
-    with open(gaf_file, 'r') as gaf :
+    with open_file(gaf_file, 'r') as gaf :
         for line in gaf :
             if line[0] == 'H' :
                 continue
@@ -99,375 +105,616 @@ def assign_reads_to_contigs(segments, gaf_file, copies):
 
 #input: the graph (as the list of segments), the alignment of the reads (gaf_file), and the number of copies of each contig in the final assembly and the fasta/q file and the gfa file
 #output: repolished sequences stored in the subcontigs
-def repolish_contigs(segments, gfa_file, gaf_file, fastq_file, copies, threads=1):
+def repolish_contigs(segments, gfa_file, gaf_file, fastq_file, copies, threads=1, contigs_position=None, threads_per_job=1, scratch_dir=".", batch=False):
 
     #first assign all the reads to the subcontigs
     assign_reads_to_contigs(segments, gaf_file, copies)
 
-    #index all of the reads with their position in the fasta/q file so that we can retrieve them later
+    #index all of the reads with their position in the fasta/q file so that we can retrieve them later (virtual offsets if the file is compressed with bgzip)
+    check_random_access(fastq_file, "Repolishing")
+    check_random_access(gfa_file, "Repolishing")
     reads_position = {}
     line_number = 0
     last_record = -3
     fasta = False
-    if fastq_file[-6:] == ".fasta" or fastq_file[-3:] == ".fa" :
+    fastq_name = fastq_file
+    if fastq_name[-3:] == ".gz" :
+        fastq_name = fastq_name[:-3]
+    if fastq_name[-6:] == ".fasta" or fastq_name[-3:] == ".fa" :
         fasta = True
-    with open(fastq_file, 'r') as fastq :
-        line = fastq.readline()
+    with open_file(fastq_file, 'rb', threads = threads) as fastq :
+        line = fastq.readline().decode()
         while line :
             if line[0] == '@' and line_number%4 == 0 and not fasta : #to avoid indexing quality scores
                 read = line[1:].strip().split()[0]
                 reads_position[read] = fastq.tell()
                 fastq.readline()
                 fastq.readline()
-                line = fastq.readline()
+                line = fastq.readline().decode()
                 last_record = line_number
                 line_number += 3
             elif line[0] == '>' and fasta:
                 read = line.split()[0][1:].strip()
                 reads_position[read] = fastq.tell()
-                line = fastq.readline()
+                line = fastq.readline().decode()
                 line_number += 1
             else :
-                line = fastq.readline()
+                line = fastq.readline().decode()
                 line_number += 1
 
-    #index the contigs with their position in the gfa file so that we can retrieve them later
-    contigs_position = {}
-    previous_position = 0
-    with open(gfa_file, 'r') as gfa :
-        line = gfa.readline()
-        while line :
-            if line[0] == 'S' :
-                line = line.strip().split('\t')
-                contig = line[1]
-                contigs_position[contig] = previous_position
-
+    #index the contigs with their position in the gfa file so that we can retrieve them later (if not already done while loading the GFA)
+    if contigs_position is None :
+        contigs_position = {}
+        with open_file(gfa_file, 'rb', threads = threads) as gfa :
             previous_position = gfa.tell()
-            line = gfa.readline()
-
-    #go through the segments and their subcontigs and repolish them using racon
-    for segment in segments :
-        seqs = segment.get_sequences()
+            line = gfa.readline().decode()
+            while line :
+                if line[0] == 'S' :
+                    line = line.strip().split('\t')
+                    contig = line[1]
+                    contigs_position[contig] = previous_position
+
+                previous_position = gfa.tell()
+                line = gfa.readline().decode()
+
+    #list the subcontigs to repolish: those present in several copies, with reads. Each job gets the orientations of the subcontigs before any repolishing
+    jobs = []
+    for g, segment in enumerate(segments) :
         names = segment.get_namesOfContigs()
         reads = segment.get_reads()
         orientations = segment.get_orientations()
-
         for s, subcontig in enumerate(names) :
-
-            # if subcontig != "edge_21_149088_182933_0_33845_0_33845@0_10000_0":
-            # if "edge_18_310438_361584_0_51146_0_51146@0_10000_1" not in subcontig :
-            #     print("continuuedj ", subcontig)
-            #     continue
-
-            # print("reads here: ",[len(i) for i in reads])
-            # print(names[13], " ", reads[13])
-
             if segment.get_lengths()[s] < 100 :
                 continue
-
-            # print("Looking at subcontig ", subcontig, " ", s , " ", copies[subcontig], " ", len(reads[s]))
             if len(reads[s]) > 0 and copies[subcontig] > 1 : #if the contig is unique it should be already polished
+                jobs.append((g, s, list(names), list(orientations), reads[s]))
+
+    #run the jobs in parallel, each one with threads_per_job threads and its own scratch directory, and gather the results in the order of the jobs
+    #(in batch, racon runs once for all the jobs with all the threads and the copies of a subcontig share their minimap2)
+    threads_per_job = max(1, min(threads_per_job, threads))
+    try :
+        if batch :
+            print("Repolishing ", len(jobs), " subcontigs in one batch with ", threads, " threads")
+            results = repolish_batch(jobs, fastq_file, gfa_file, reads_position, contigs_position, threads, threads_per_job, scratch_dir)
+        else :
+            print("Repolishing ", len(jobs), " subcontigs, ", max(1, threads // threads_per_job), " at a time with ", threads_per_job, " threads each")
+            results = map_jobs(repolish_subcontig, max(1, threads // threads_per_job), jobs, [fastq_file]*len(jobs), [gfa_file]*len(jobs), [reads_position]*len(jobs), \
+                               [contigs_position]*len(jobs), [threads_per_job]*len(jobs), [scratch_dir]*len(jobs))
+    except RuntimeError as error : #minimap2 failed in one of the jobs
+        print(error)
+        sys.exit(1)
+
+    for (g, s, names, orientations, reads), (seq, reoriented) in zip(jobs, results) :
+        if reoriented : #because we made sure the orientation was positive when choosing left and right
+            segments[g].set_orientation(s, 1)
+        if seq is not None :
+            segments[g].get_sequences()[s] = seq
 
-                seq = None
-                # print("Repolishing ", subcontig, " with ", len(reads[s]), " reads")
-
-                #now repolish
-                #begin by extracting the reads from the fastq file and write them to a temporary file
-                f = open("tmp_reads.fa", 'w')
-                with open(fastq_file, 'r') as fastq :
-                    for read in reads[s] :
-                        fastq.seek(reads_position[read])
-                        f.write(">" + read + "\n")
-                        f.write(fastq.readline())
-
-                f.close()
-
-                #find out the chunk of the contig left of the subcontig
-                left = ""
-                name_of_contig_left = names[s-1]
-                with open(gfa_file, 'r') as gfa :
-                    gfa.seek(contigs_position[name_of_contig_left])
-                    ls = gfa.readline().strip().split('\t')
-                    left = ls[2]
-                    if orientations[s-1] == 0 :
-                        left = reverse_complement(left)
-                #write down left in a temporary file
-                # print("left contig: ", name_of_contig_left)
-                f = open("tmp_left.fa", 'w')
-                f.write(">" + name_of_contig_left + "\n" + left + "\n")
-                f.close()
-
-                #find out the chunk of the contig right of the subcontig
-                right = ""
-                name_of_contig_right = names[s+1]
-                with open(gfa_file, 'r') as gfa :
-                    gfa.seek(contigs_position[name_of_contig_right])
-                    ls = gfa.readline().strip().split('\t')
-                    right = ls[2]
-                    if orientations[s+1] == 0 :
-                        right = reverse_complement(right)
-
-                #write down right in a temporary file
-                f = open("tmp_right.fa", 'w')
-                f.write(">" + name_of_contig_right + "\n" + right + "\n")
-                f.close()
-
-                #first check that the reads align well on the contig - if not (e.g. structural variant), reassemble everythin
-                contig_seq = ""
-                contig_extended = ""
-                with open(gfa_file, 'r') as gfa :
-                    gfa.seek(contigs_position[subcontig])
-                    ls = gfa.readline().strip().split('\t')
-                    contig_seq = ls[2]
-                    contig_extended = contig_seq
-                    if orientations[s] == 0 : #if reverse complement
-                        contig_extended = reverse_complement(contig_seq)
-                    gfa.seek(0)
-                    #if neighboring contigs are there let's take them too
-                    if s > 0 and s < len(names)-1 :
-                        gfa.seek(contigs_position[names[s-1]])
-                        ls = gfa.readline().strip().split('\t')
-                        neigh_seq = ls[2]
-                        if orientations[s-1] == 0 : #if reverse complement
-                            neigh_seq = reverse_complement(neigh_seq)
-                        contig_extended = neigh_seq[-1000:] + contig_extended
-                        gfa.seek(0)
-                        gfa.seek(contigs_position[names[s+1]])
-                        ls = gfa.readline().strip().split('\t')
-                        neigh_seq = ls[2]
-                        if orientations[s+1] == 0 : #if reverse complement
-                            neigh_seq = reverse_complement(neigh_seq)
-                        contig_extended = contig_extended + neigh_seq[:1000]
-                f = open("tmp_complete_contig.fa", 'w')
-                f.write(">" + subcontig + "_and_left_and_right" + "\n" + contig_extended + "\n")
-                f.close()
+    return segments
 
-                # align reads on the contig using minimap2
-                command = "minimap2 -x map-pb -t " + str(threads) + " tmp_complete_contig.fa tmp_reads.fa > tmp_complete.paf 2> trash.txt"
-                minimap = os.system(command)
-                if minimap != 0 :
-                    print("Error while running minimap2: " + command + "\n")
-                    sys.exit(1)
-
-                #check if the alignments (or at least one) are good
-                no_struct_variants = False
-                orientations_of_reads = {}
-                with open("tmp_complete.paf", 'r') as paf :
-                    for line in paf :
-                        ls = line.strip().split('\t')
-                        orientations_of_reads[ls[0]] = ls[4]
-                        #make sure the read aligns on more or less the whole read
-                        if int(ls[8])-int(ls[7]) > 0.9*int(ls[6]) \
-                            and int(ls[7]) < 500 and int(ls[8]) > len(contig_seq)-500 \
-                            and int(ls[3])-int(ls[2]) > 0.9*(int(ls[8])-int(ls[7])) and int(ls[3])-int(ls[2]) < 1.1*(int(ls[8])-int(ls[7])) :
-                            no_struct_variants = True
-
-                # print("no struct variants: ", no_struct_variants, " (", names[max(s-1, 0)], " ", names[min(s+1, len(names)-1)], ") ", s , " ", len(names)-1)
-
-                if no_struct_variants or s == 0 or s == len(names)-1 :
-
-                    print("polishing ", subcontig, " with ", len(reads[s]), " reads")
-                    #output the contig to a temporary file
-                    f = open("tmp_contig.fa", 'w')
-                    f.write(">" + subcontig + "\n" + contig_seq + "\n")
-                    f.close()
-
-                    #now polish the contig with the reads using racon
-                    command = "minimap2 -x map-pb -t " + str(threads) + " tmp_contig.fa tmp_reads.fa > tmp.paf 2> trash.txt"
-                    minimap = os.system(command)
-                    if minimap != 0 :
-                        print("Error while running minimap2: " + command + "\n")
-                        sys.exit(1)
-
-                    command = "racon -t " + str(threads) + " tmp_reads.fa tmp.paf tmp_contig.fa > tmp_repolished.fa 2>trash.txt"
-                    racon = os.system(command)
-                    if racon != 0 :
-                        # print("Error while running racon: " + command + "\n")
-                        # sys.exit(1)
-                        no_struct_variants = False #we did not manage to polish the contig, let's try to reassemble it
-
-                    #now retrieve the repolished sequence
-                    with open("tmp_repolished.fa", 'r') as repolished :
-                        repolished.readline()
-                        seq = repolished.readline().strip()
-
-
-                if not no_struct_variants and s!= 0 and s!= len(names)-1: #let's try to reassemble the reads using neighboring contigs to anchor them
-                    
-                    print("reassembling ", subcontig, " with ", len(reads[s]), " reads")
-
-                    #now align the reads on the left and right chunks and take the portion of the reads between the two chunks
-                    command = "minimap2 -cx map-pb --secondary=no tmp_left.fa tmp_reads.fa > tmp_left.paf 2> trash.txt"
-                    minimap = os.system(command)
-                    if minimap != 0 :
-                        print("Error while running minimap2: " + command + "\n")
-                        sys.exit(1)
-                    
-                    command = "minimap2 -cx map-pb --secondary=no tmp_right.fa tmp_reads.fa > tmp_right.paf 2> trash.txt"
-                    minimap = os.system(command)
-                    if minimap != 0 :
-                        print("Error while running minimap2: " + command + "\n")
-                        sys.exit(1)
-
-                    #retrieve the coordinates of the reads mapping on the left chunk
-                    left_coordinates = {}
-                    with open("tmp_left.paf", 'r') as paf :
-                        for line in paf :
-                            ls = line.strip().split('\t')
-                            if int(ls[11]) == 60 and int(ls[8]) >= int(ls[6])-10: #ls[6] == ls[8] means the read maps to the very end of the contig
-                                left_coordinates[ls[0]] = (int(ls[2]), int(ls[3]))
+#input : a function, the number of jobs to run side by side and the lists of the arguments of the jobs
+#output : the results of the jobs, in order. If a job fails, the jobs not started yet are cancelled and its exception is raised in the calling thread
+def map_jobs(function, workers, *arguments) :
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor :
+        futures = [executor.submit(function, *job_arguments) for job_arguments in zip(*arguments)]
+        try :
+            return [future.result() for future in futures]
+        except Exception :
+            for future in futures :
+                future.cancel()
+            raise
+
+#input : a shell command and the directory where to run it
+#output : the exit status of the command
+def run_in(directory, command) :
+    return os.system("cd " + shlex.quote(directory) + " && " + command)
+
+#input : a shell command running minimap2 and the directory where to run it
+#output : raises a RuntimeError if minimap2 failed (it may run in a thread of a pool, which cannot exit)
+def run_minimap(directory, command) :
+    minimap = run_in(directory, command)
+    if minimap != 0 :
+        raise RuntimeError("Error while running minimap2: " + command + "\n")
+
+#input : the index of a job of repolish_batch and the name of a read or target of the job
+#output : the name tagged with the job, so that the sequences of all the jobs can go in the same file
+def tag(j, name) :
+    return str(j) + "@@" + name
+
+#input : a name tagged with tag()
+#output : the index of the job and the original name
+def untag(name) :
+    j, name = name.split("@@", 1)
+    return int(j), name
+
+#input : a file to write and a list of (index of a job, fasta file of the job)
+#output : the sequences of all the fasta files written in the file, their names tagged with their job
+def write_tagged(file, job_files) :
+    with open(file, 'w') as out :
+        for j, job_file in job_files :
+            with open(job_file, 'r') as f :
+                for line in f :
+                    if line[0] == '>' :
+                        line = ">" + tag(j, line[1:])
+                    if line[-1] != '\n' :
+                        line += '\n'
+                    out.write(line)
+
+#input : a fasta file
+#output : a dict associating the name of each sequence (first word of the header) to the sequence
+def read_fasta(file) :
+    sequences = {}
+    name = None
+    with open(file, 'r') as f :
+        for line in f :
+            if line[0] == '>' :
+                name = line[1:].split()[0]
+                sequences[name] = []
+            elif name is not None :
+                sequences[name].append(line.strip())
+    return {name : "".join(sequences[name]) for name in sequences}
+
+#input : the fields of a line of the alignment (paf) of a read on a subcontig extended with its neighbors, and the length of the subcontig
+#output : True if the read aligns on more or less the whole subcontig, i.e. if there is no structural variant between the read and the subcontig
+def spans_subcontig(ls, length) :
+    return int(ls[8])-int(ls[7]) > 0.9*int(ls[6]) \
+        and int(ls[7]) < 500 and int(ls[8]) > length-500 \
+        and int(ls[3])-int(ls[2]) > 0.9*(int(ls[8])-int(ls[7])) and int(ls[3])-int(ls[2]) < 1.1*(int(ls[8])-int(ls[7]))
+
+#input : a job of repolish_contigs, the fasta/q file and the gfa file with the positions of the reads and contigs in them, and the scratch directory of the job
+#output : the files of the job written in the scratch directory (reads, left and right neighbors, subcontig extended with its neighbors), the sequence of the
+#         subcontig (as in the gfa) and the sequence of the extended subcontig
+def write_job_inputs(job, fastq_file, gfa_file, reads_position, contigs_position, scratch_dir) :
+
+    g, s, names, orientations, reads = job
+    subcontig = names[s]
+
+    #begin by extracting the reads from the fastq file and write them to a temporary file
+    f = open(os.path.join(scratch_dir, "tmp_reads.fa"), 'w')
+    with open_file(fastq_file, 'rb') as fastq :
+        for read in reads :
+            fastq.seek(reads_position[read])
+            f.write(">" + read + "\n")
+            f.write(fastq.readline().decode())
+
+    f.close()
+
+    #find out the chunk of the contig left of the subcontig
+    left = ""
+    name_of_contig_left = names[s-1]
+    with open_file(gfa_file, 'rb') as gfa :
+        gfa.seek(contigs_position[name_of_contig_left])
+        ls = gfa.readline().decode().strip().split('\t')
+        left = ls[2]
+        if orientations[s-1] == 0 :
+            left = reverse_complement(left)
+    #write down left in a temporary file
+    # print("left contig: ", name_of_contig_left)
+    f = open(os.path.join(scratch_dir, "tmp_left.fa"), 'w')
+    f.write(">" + name_of_contig_left + "\n" + left + "\n")
+    f.close()
+
+    #find out the chunk of the contig right of the subcontig
+    right = ""
+    name_of_contig_right = names[s+1]
+    with open_file(gfa_file, 'rb') as gfa :
+        gfa.seek(contigs_position[name_of_contig_right])
+        ls = gfa.readline().decode().strip().split('\t')
+        right = ls[2]
+        if orientations[s+1] == 0 :
+            right = reverse_complement(right)
+
+    #write down right in a temporary file
+    f = open(os.path.join(scratch_dir, "tmp_right.fa"), 'w')
+    f.write(">" + name_of_contig_right + "\n" + right + "\n")
+    f.close()
+
+    #the subcontig extended with its neighbors, to check that the reads align well on it
+    contig_seq = ""
+    contig_extended = ""
+    with open_file(gfa_file, 'rb') as gfa :
+        gfa.seek(contigs_position[subcontig])
+        ls = gfa.readline().decode().strip().split('\t')
+        contig_seq = ls[2]
+        contig_extended = contig_seq
+        if orientations[s] == 0 : #if reverse complement
+            contig_extended = reverse_complement(contig_seq)
+        gfa.seek(0)
+        #if neighboring contigs are there let's take them too
+        if s > 0 and s < len(names)-1 :
+            gfa.seek(contigs_position[names[s-1]])
+            ls = gfa.readline().decode().strip().split('\t')
+            neigh_seq = ls[2]
+            if orientations[s-1] == 0 : #if reverse complement
+                neigh_seq = reverse_complement(neigh_seq)
+            contig_extended = neigh_seq[-1000:] + contig_extended
+            gfa.seek(0)
+            gfa.seek(contigs_position[names[s+1]])
+            ls = gfa.readline().decode().strip().split('\t')
+            neigh_seq = ls[2]
+            if orientations[s+1] == 0 : #if reverse complement
+                neigh_seq = reverse_complement(neigh_seq)
+            contig_extended = contig_extended + neigh_seq[:1000]
+    f = open(os.path.join(scratch_dir, "tmp_complete_contig.fa"), 'w')
+    f.write(">" + subcontig + "_and_left_and_right" + "\n" + contig_extended + "\n")
+    f.close()
+
+    return contig_seq, contig_extended
+
+#input : the scratch directory of a job (with the files of write_job_inputs), the number of threads of minimap2 and the length of the subcontig
+#output : True if at least one read aligns well on the whole subcontig, False if there is probably a structural variant and the subcontig must be reassembled
+def check_alignments(scratch_dir, threads, length) :
+
+    # align reads on the contig using minimap2
+    run_minimap(scratch_dir, "minimap2 -x map-pb -t " + str(threads) + " tmp_complete_contig.fa tmp_reads.fa > tmp_complete.paf 2> trash.txt")
+
+    #check if the alignments (or at least one) are good
+    no_struct_variants = False
+    with open(os.path.join(scratch_dir, "tmp_complete.paf"), 'r') as paf :
+        for line in paf :
+            if spans_subcontig(line.strip().split('\t'), length) :
+                no_struct_variants = True
+
+    return no_struct_variants
+
+#input : the name and sequence of a subcontig, the scratch directory of its job (with the reads) and the number of threads of minimap2 and racon
+#output : the sequence polished by racon and True if racon succeeded
+def polish_subcontig(subcontig, contig_seq, scratch_dir, threads) :
+
+    #output the contig to a temporary file
+    f = open(os.path.join(scratch_dir, "tmp_contig.fa"), 'w')
+    f.write(">" + subcontig + "\n" + contig_seq + "\n")
+    f.close()
+
+    #now polish the contig with the reads using racon
+    run_minimap(scratch_dir, "minimap2 -x map-pb -t " + str(threads) + " tmp_contig.fa tmp_reads.fa > tmp.paf 2> trash.txt")
+
+    command = "racon -t " + str(threads) + " tmp_reads.fa tmp.paf tmp_contig.fa > tmp_repolished.fa 2>trash.txt"
+    racon = run_in(scratch_dir, command)
+
+    #now retrieve the repolished sequence
+    with open(os.path.join(scratch_dir, "tmp_repolished.fa"), 'r') as repolished :
+        repolished.readline()
+        seq = repolished.readline().strip()
+
+    return seq, racon == 0
+
+#input : the reads and sequence of a subcontig, the fasta/q file with the positions of the reads, the scratch directory of the job and the number of threads of minimap2
+#output : the reads cut between their alignments on the left and right neighbors (tmp_reads_cut.fa), the best anchored one to polish (tmp_toPolish.fa) and
+#         the alignment of the first on the second (tmp_toPolish.paf). Returns True if the alignment is empty and the sequence to fall back on if the polishing fails
+def anchor_reads(reads, contig_seq, fastq_file, reads_position, scratch_dir, threads) :
+
+    #now align the reads on the left and right chunks and take the portion of the reads between the two chunks
+    run_minimap(scratch_dir, "minimap2 -cx map-pb --secondary=no tmp_left.fa tmp_reads.fa > tmp_left.paf 2> trash.txt")
+    run_minimap(scratch_dir, "minimap2 -cx map-pb --secondary=no tmp_right.fa tmp_reads.fa > tmp_right.paf 2> trash.txt")
+
+    #retrieve the coordinates of the reads mapping on the left chunk
+    left_coordinates = {}
+    with open(os.path.join(scratch_dir, "tmp_left.paf"), 'r') as paf :
+        for line in paf :
+            ls = line.strip().split('\t')
+            if int(ls[11]) == 60 and int(ls[8]) >= int(ls[6])-10: #ls[6] == ls[8] means the read maps to the very end of the contig
+                left_coordinates[ls[0]] = (int(ls[2]), int(ls[3]))
+
+    #retrieve the coordinates of the reads mapping on the right chunk
+    right_coordinates = {}
+    with open(os.path.join(scratch_dir, "tmp_right.paf"), 'r') as paf :
+        for line in paf :
+            ls = line.strip().split('\t')
+            #if quality of the mapping is good
+            if int(ls[11]) == 60 and int(ls[7]) < 10: #ls[7] == 0 means the read maps to the very beginning of the contig to the right: that's what we want
+                right_coordinates[ls[0]] = (int(ls[2]), int(ls[3]))
+
+    #now retrieve the reads that are between the two chunks
+    reads_between = {}
+    best_read = "" #that's to measure the read that is best anchored on the sides
+    length_left_and_right = 0
+    idx = 0
+    for read in reads :
+        if read in left_coordinates and read in right_coordinates :
+            # print("read ", read, " is between ", left_coordinates[read], " and ", right_coordinates[read])
+            if left_coordinates[read][0] < right_coordinates[read][0] :
+                reads_between[read] = (max(int(left_coordinates[read][0]), int(left_coordinates[read][1])),
+                                       min(int(right_coordinates[read][0]), int(right_coordinates[read][1])))
+            else :
+                reads_between[read] = (max(int(right_coordinates[read][0]), int(right_coordinates[read][1])),
+                                       min(int(left_coordinates[read][0]), int(left_coordinates[read][1])))
+
+            if reads_between[read][1] - reads_between[read][0] > length_left_and_right :
+                length_left_and_right = reads_between[read][1] - reads_between[read][0]
+                best_read = read
+            idx += 1
+
+    # print("reads between: ", reads_between)
+    # print("read between: ", [i[1]-i[0] for i in reads_between.values()])
+
+    #create the list of reads to use for polishing by extracting the reads from the fastq file, cutting them using reads_between and write them to a temporary file
+    f = open(os.path.join(scratch_dir, "tmp_reads_cut.fa"), 'w')
+
+    f_toPolish = open(os.path.join(scratch_dir, "tmp_toPolish.fa"), 'w')
+    with open_file(fastq_file, 'rb') as fastq :
+        for read in reads_between :
+            fastq.seek(reads_position[read])
+            line = fastq.readline().decode()
+            if read == best_read :
+                contig_seq = line[max(0,reads_between[read][0]-500):min(reads_between[read][1]+500, len(line))]
+                # if orientations_of_reads[read] == "0":
+                #     contig_seq = reverse_complement(contig_seq)
+                f_toPolish.write(">" + read + "\n")
+                f_toPolish.write(contig_seq + "\n") #take a little margin to anchor the contig on both sides
 
-                    #retrieve the coordinates of the reads mapping on the right chunk
-                    right_coordinates = {}
-                    with open("tmp_right.paf", 'r') as paf :
-                        for line in paf :
-                            ls = line.strip().split('\t')
-                            #if quality of the mapping is good
-                            if int(ls[11]) == 60 and int(ls[7]) < 10: #ls[7] == 0 means the read maps to the very beginning of the contig to the right: that's what we want
-                                right_coordinates[ls[0]] = (int(ls[2]), int(ls[3]))
-
-                    #now retrieve the reads that are between the two chunks
-                    reads_between = {}
-                    best_read = "" #that's to measure the read that is best anchored on the sides
-                    length_left_and_right = 0
-                    idx = 0
-                    for read in reads[s] :
-                        if read in left_coordinates and read in right_coordinates :
-                            # print("read ", read, " is between ", left_coordinates[read], " and ", right_coordinates[read])
-                            if left_coordinates[read][0] < right_coordinates[read][0] :
-                                reads_between[read] = (max(int(left_coordinates[read][0]), int(left_coordinates[read][1])), 
-                                                       min(int(right_coordinates[read][0]), int(right_coordinates[read][1])))
-                            else :
-                                reads_between[read] = (max(int(right_coordinates[read][0]), int(right_coordinates[read][1])), 
-                                                       min(int(left_coordinates[read][0]), int(left_coordinates[read][1])))
-                                
-                            if reads_between[read][1] - reads_between[read][0] > length_left_and_right :
-                                length_left_and_right = reads_between[read][1] - reads_between[read][0]
-                                best_read = read
-                            idx += 1
-                    
-                    # print("reads between: ", reads_between)
-                    # print("read between: ", [i[1]-i[0] for i in reads_between.values()])
-
-                    #create the list of reads to use for polishing by extracting the reads from the fastq file, cutting them using reads_between and write them to a temporary file
-                    f = open("tmp_reads_cut.fa", 'w')
-                    
-                    f_toPolish = open("tmp_toPolish.fa", 'w')
-                    with open(fastq_file, 'r') as fastq :
-                        for read in reads_between :
-                            fastq.seek(reads_position[read])
-                            line = fastq.readline()
-                            if read == best_read :
-                                contig_seq = line[max(0,reads_between[read][0]-500):min(reads_between[read][1]+500, len(line))]
-                                # if orientations_of_reads[read] == "0":
-                                #     contig_seq = reverse_complement(contig_seq)
-                                f_toPolish.write(">" + read + "\n")
-                                f_toPolish.write(contig_seq + "\n") #take a little margin to anchor the contig on both sides
-                                
-                            else :
-                                f.write(">" + read + "\n")
-                                f.write(line[max(0,reads_between[read][0]-500):min(reads_between[read][1]+500, len(line))] + "\n")
-
-                    f.close()
-                    f_toPolish.close()
-                        
-                    #now polish f_toPolish with tmp_reads_cut.fa using racon
-                    command = "minimap2 -x map-pb -t " + str(threads) + " tmp_toPolish.fa tmp_reads_cut.fa > tmp_toPolish.paf 2> trash.txt"
-                    minimap = os.system(command)
-                    if minimap != 0 :
-                        print("Error while running minimap2: " + command + "\n")
-                        sys.exit(1)
-                    
-                    #check if the alignment is empty
-                    empty = True
-                    with open("tmp_toPolish.paf", 'r') as paf :
+            else :
+                f.write(">" + read + "\n")
+                f.write(line[max(0,reads_between[read][0]-500):min(reads_between[read][1]+500, len(line))] + "\n")
+
+    f.close()
+    f_toPolish.close()
+
+    #now align tmp_reads_cut.fa on f_toPolish, to polish it using racon
+    run_minimap(scratch_dir, "minimap2 -x map-pb -t " + str(threads) + " tmp_toPolish.fa tmp_reads_cut.fa > tmp_toPolish.paf 2> trash.txt")
+
+    #check if the alignment is empty
+    empty = True
+    with open(os.path.join(scratch_dir, "tmp_toPolish.paf"), 'r') as paf :
+        for line in paf :
+            ls = line.strip().split('\t')
+            #check if it aligns on more or less the whole read
+            if int(ls[8])-int(ls[7]) > 0.8*int(ls[6]) :
+                empty = False
+                break
+
+    return empty, contig_seq
+
+#input : the scratch directory of a job (with the files of anchor_reads), the number of threads of minimap2 and racon, the sequence to fall back on if racon fails
+#        and the sequence polished by racon if it has already been polished (by repolish_batch)
+#output : the polished sequence, cut between its alignments on the left and right neighbors (None if it could not be anchored on them)
+def polish_reassembly(scratch_dir, threads, contig_seq, repolished_seq = None) :
+
+    if repolished_seq is None :
+        command = "racon -w 50 -t " + str(threads) + " tmp_reads_cut.fa tmp_toPolish.paf tmp_toPolish.fa > tmp_repolished.fa 2>trash.txt"
+        racon = run_in(scratch_dir, command)
+        if racon != 0 :
+            #polishign failed, fall back sequence
+            # print("Error while running racon: " + command + "\n")
+            # sys.exit(1)
+            return contig_seq
+    else :
+        f = open(os.path.join(scratch_dir, "tmp_repolished.fa"), 'w')
+        f.write(">repolished\n" + repolished_seq + "\n")
+        f.close()
+
+    #now retrieve the repolished sequence, realign it one last time against left and right and store it in the segment
+    run_minimap(scratch_dir, "minimap2 -cx map-pb --secondary=no tmp_left.fa tmp_repolished.fa > tmp_left.paf 2> trash.txt")
+    run_minimap(scratch_dir, "minimap2 -cx map-pb --secondary=no tmp_right.fa tmp_repolished.fa > tmp_right.paf 2> trash.txt")
+
+    #retrieve the coordinates of the reads mapping on the left chunk
+    reversed_seq = False
+    left_coordinates = (0,0)
+    with open(os.path.join(scratch_dir, "tmp_left.paf"), 'r') as paf :
+        for line in paf :
+            line = line.strip().split('\t')
+            left_coordinates = (int(line[2]), int(line[3]))
+            if line[5] == "-":
+                reversed_seq = True
+            break
+    right_coordinates = (0,0)
+    with open(os.path.join(scratch_dir, "tmp_right.paf"), 'r') as paf :
+        for line in paf :
+            line = line.strip().split('\t')
+            right_coordinates = (int(line[2]), int(line[3]))
+            break
+
+    if reversed_seq :
+        left_coordinates, right_coordinates = right_coordinates, left_coordinates
+
+    if right_coordinates == (0,0) or left_coordinates == (0,0) :
+        #problem in the polishing
+        print("DEBUG code 3309")
+        return None
+
+    #now retrieve the repolished sequence between left_coordinates and right_coordinates
+    with open(os.path.join(scratch_dir, "tmp_repolished.fa"), 'r') as repolished :
+        repolished.readline()
+        seq = repolished.readline().strip()
+        # if left_coordinates == (0,0):
+        #     left_coordinates = (0, min(500, len(seq)))
+        # if right_coordinates == (0,0): #should not happen, but could if bad polishing
+        #     right_coordinates=(max(min(500, len(seq)), len(seq)-500), len(seq))
+
+        seq = seq[max(left_coordinates[0], left_coordinates[1])-1:min(right_coordinates[0], right_coordinates[1])+1]
+        if reversed_seq :
+            # print("REVERSIIIIIING !", orientations[s])
+            seq = reverse_complement(seq)
+            # sys.exit(1)
+
+    # print("repolished sequence: ", seq)
+    return seq
+
+#input : a job of repolish_contigs (index of the segment, index of the subcontig, names and orientations of the subcontigs of the segment, reads of the subcontig),
+#        the fasta/q file and the gfa file with the positions of the reads and contigs in them, the number of threads of minimap2 and racon and the directory
+#        in which to create the scratch directory of the job
+#output : the repolished sequence of the subcontig (None if it could not be repolished) and True if the sequence is now in the orientation of the segment
+def repolish_subcontig(job, fastq_file, gfa_file, reads_position, contigs_position, threads, scratch_dir) :
+
+    g, s, names, orientations, reads = job
+    subcontig = names[s]
+    scratch_dir = tempfile.mkdtemp(prefix = "tmp_repolish_", dir = scratch_dir) #private to the job, so that jobs can run side by side
+    reoriented = False
+
+    seq = None
+    # print("Repolishing ", subcontig, " with ", len(reads), " reads")
+
+    try :
+        #now repolish
+        contig_seq, contig_extended = write_job_inputs(job, fastq_file, gfa_file, reads_position, contigs_position, scratch_dir)
+
+        #first check that the reads align well on the contig - if not (e.g. structural variant), reassemble everythin
+        no_struct_variants = check_alignments(scratch_dir, threads, len(contig_seq))
+
+        # print("no struct variants: ", no_struct_variants, " (", names[max(s-1, 0)], " ", names[min(s+1, len(names)-1)], ") ", s , " ", len(names)-1)
+
+        if no_struct_variants or s == 0 or s == len(names)-1 :
+
+            print("polishing ", subcontig, " with ", len(reads), " reads")
+            seq, polished = polish_subcontig(subcontig, contig_seq, scratch_dir, threads)
+            if not polished :
+                no_struct_variants = False #we did not manage to polish the contig, let's try to reassemble it
+
+        if not no_struct_variants and s!= 0 and s!= len(names)-1: #let's try to reassemble the reads using neighboring contigs to anchor them
+
+            print("reassembling ", subcontig, " with ", len(reads), " reads")
+            empty, contig_seq = anchor_reads(reads, contig_seq, fastq_file, reads_position, scratch_dir, threads)
+            if not empty :
+                seq = polish_reassembly(scratch_dir, threads, contig_seq)
+            reoriented = True
+
+    finally : #remove the scratch directory even if minimap2 failed
+        shutil.rmtree(scratch_dir, ignore_errors = True)
+
+    return seq, reoriented
+
+#input : the scratch directory of a batch, the targets (list of (name, sequence)), for each target the reads to align on it (list of (index of a job, fasta file
+#        of the reads of the job)), the paf file to write, the number of threads of each minimap2 and the number of minimap2 running side by side
+#output : the alignments of the reads on their target only, gathered in the paf file with the reads tagged with their job. Each target is aligned on in its own
+#         minimap2: with all the targets in one index, minimap2 drops the alignment of a read on its target when it aligns much better on another one
+def align_on_own_targets(batch_dir, targets, reads_of_targets, paf_file, threads, workers) :
+
+    def align(t) :
+        f = open(os.path.join(batch_dir, "tmp_target_" + str(t) + ".fa"), 'w')
+        f.write(">" + targets[t][0] + "\n" + targets[t][1] + "\n")
+        f.close()
+        write_tagged(os.path.join(batch_dir, "tmp_reads_" + str(t) + ".fa"), reads_of_targets[t])
+        run_minimap(batch_dir, "minimap2 -x map-pb -t " + str(threads) + " tmp_target_" + str(t) + ".fa tmp_reads_" + str(t) + ".fa > tmp_" + str(t) + ".paf 2> trash_" + str(t) + ".txt")
+
+    map_jobs(align, workers, range(len(targets)))
+    with open(os.path.join(batch_dir, paf_file), 'w') as out :
+        for t in range(len(targets)) :
+            with open(os.path.join(batch_dir, "tmp_" + str(t) + ".paf"), 'r') as paf :
+                shutil.copyfileobj(paf, out)
+
+#input : the jobs of repolish_contigs, the fasta/q file and the gfa file with the positions of the reads and contigs in them, the total number of threads,
+#        the number of threads of the steps still run job per job, and the directory in which to create the scratch directory of the batch
+#output : the result of repolish_subcontig for each job. The copies of a subcontig share their minimap2 and all the subcontigs are polished by one racon,
+#         the reads being tagged with their job. A job that the batch could not polish is done on its own, as repolish_subcontig would
+def repolish_batch(jobs, fastq_file, gfa_file, reads_position, contigs_position, threads, threads_per_job, scratch_dir) :
+
+    if len(jobs) == 0 :
+        return []
+
+    batch_dir = tempfile.mkdtemp(prefix = "tmp_repolish_", dir = scratch_dir)
+    workers = max(1, threads // threads_per_job)
+    results = [(None, False) for job in jobs]
+
+    try :
+        #the inputs of each job in its own directory, for the steps run job per job
+        job_dirs = [tempfile.mkdtemp(prefix = "job_", dir = batch_dir) for job in jobs]
+        contig_seqs = []
+        extended_seqs = []
+        for j, job in enumerate(jobs) :
+            contig_seq, contig_extended = write_job_inputs(job, fastq_file, gfa_file, reads_position, contigs_position, job_dirs[j])
+            contig_seqs.append(contig_seq)
+            extended_seqs.append(contig_extended)
+
+        #check the alignments of the reads of all the jobs, on the extended subcontig of their job, the jobs with the same extended subcontig sharing their minimap2
+        targets = {}
+        for j, contig_extended in enumerate(extended_seqs) :
+            if contig_extended not in targets :
+                targets[contig_extended] = []
+            targets[contig_extended].append((j, os.path.join(job_dirs[j], "tmp_reads.fa")))
+        align_on_own_targets(batch_dir, [("extended_" + str(t), contig_extended) for t, contig_extended in enumerate(targets)], list(targets.values()), \
+                             "tmp_complete.paf", threads_per_job, workers)
+
+        no_struct_variants = [False for job in jobs]
+        with open(os.path.join(batch_dir, "tmp_complete.paf"), 'r') as paf :
+            for line in paf :
+                ls = line.strip().split('\t')
+                j = untag(ls[0])[0]
+                if spans_subcontig(ls, len(contig_seqs[j])) :
+                    no_struct_variants[j] = True
+
+        to_polish = [j for j, (g, s, names, orientations, reads) in enumerate(jobs) if no_struct_variants[j] or s == 0 or s == len(names)-1]
+        to_reassemble = [j for j, (g, s, names, orientations, reads) in enumerate(jobs) if not no_struct_variants[j] and s != 0 and s != len(names)-1]
+        alone = [] #jobs the batch could not polish
+
+        #polish all the subcontigs with one racon: the reads are aligned on the subcontig of their job and each alignment is moved to the copy of the job
+        if len(to_polish) > 0 :
+
+            for j in to_polish :
+                print("polishing ", jobs[j][2][jobs[j][1]], " with ", len(jobs[j][4]), " reads")
+            write_tagged(os.path.join(batch_dir, "tmp_reads_polish.fa"), [(j, os.path.join(job_dirs[j], "tmp_reads.fa")) for j in to_polish])
+
+            subcontigs = {}
+            f = open(os.path.join(batch_dir, "tmp_contig.fa"), 'w')
+            for j in to_polish :
+                subcontig = jobs[j][2][jobs[j][1]]
+                if subcontig not in subcontigs :
+                    subcontigs[subcontig] = (contig_seqs[j], [])
+                subcontigs[subcontig][1].append((j, os.path.join(job_dirs[j], "tmp_reads.fa")))
+                f.write(">" + tag(j, subcontig) + "\n" + contig_seqs[j] + "\n")
+            f.close()
+            align_on_own_targets(batch_dir, [(subcontig, subcontigs[subcontig][0]) for subcontig in subcontigs], [subcontigs[subcontig][1] for subcontig in subcontigs], \
+                                 "tmp_subcontigs.paf", threads_per_job, workers)
+
+            f = open(os.path.join(batch_dir, "tmp.paf"), 'w')
+            with open(os.path.join(batch_dir, "tmp_subcontigs.paf"), 'r') as paf :
+                for line in paf :
+                    ls = line.rstrip('\n').split('\t')
+                    ls[5] = tag(untag(ls[0])[0], ls[5])
+                    f.write("\t".join(ls) + "\n")
+            f.close()
+
+            repolished = {}
+            racon = run_in(batch_dir, "racon -t " + str(threads) + " tmp_reads_polish.fa tmp.paf tmp_contig.fa > tmp_repolished.fa 2>trash.txt")
+            if racon == 0 :
+                repolished = read_fasta(os.path.join(batch_dir, "tmp_repolished.fa"))
+            for j in to_polish :
+                if tag(j, jobs[j][2][jobs[j][1]]) in repolished :
+                    results[j] = (repolished[tag(j, jobs[j][2][jobs[j][1]])], False)
+                else : #racon failed or left the subcontig out (e.g. no read aligned on it)
+                    alone.append(j)
+
+        #reassemble the subcontigs with one racon. The reads are anchored on the neighbors job per job, because it relies on the mapping qualities, which other targets would lower
+        if len(to_reassemble) > 0 :
+
+            for j in to_reassemble :
+                print("reassembling ", jobs[j][2][jobs[j][1]], " with ", len(jobs[j][4]), " reads")
+                results[j] = (None, True)
+            anchored = map_jobs(anchor_reads, workers, [jobs[j][4] for j in to_reassemble], [contig_seqs[j] for j in to_reassemble], [fastq_file]*len(to_reassemble), \
+                                [reads_position]*len(to_reassemble), [job_dirs[j] for j in to_reassemble], [threads_per_job]*len(to_reassemble))
+            fallback_seqs = {j : anchored[i][1] for i, j in enumerate(to_reassemble)}
+            to_racon = [j for i, j in enumerate(to_reassemble) if not anchored[i][0]]
+
+            repolished = {}
+            if len(to_racon) > 0 :
+                write_tagged(os.path.join(batch_dir, "tmp_reads_cut.fa"), [(j, os.path.join(job_dirs[j], "tmp_reads_cut.fa")) for j in to_racon])
+                write_tagged(os.path.join(batch_dir, "tmp_toPolish.fa"), [(j, os.path.join(job_dirs[j], "tmp_toPolish.fa")) for j in to_racon])
+                f = open(os.path.join(batch_dir, "tmp_toPolish.paf"), 'w')
+                for j in to_racon :
+                    with open(os.path.join(job_dirs[j], "tmp_toPolish.paf"), 'r') as paf :
                         for line in paf :
-                            ls = line.strip().split('\t')
-                            #check if it aligns on more or less the whole read
-                            if int(ls[8])-int(ls[7]) > 0.8*int(ls[6]) :
-                                empty = False
-                                break
-                
-
-                    if not empty :
-                        command = "racon -w 50 -t " + str(threads) + " tmp_reads_cut.fa tmp_toPolish.paf tmp_toPolish.fa > tmp_repolished.fa 2>trash.txt"
-                        racon = os.system(command)
-                        if racon != 0 :
-                            #polishign failed, fall back sequence
-                            seq = contig_seq
-                            # print("Error while running racon: " + command + "\n")
-                            # sys.exit(1)
-
-                        else:
-
-                            #now retrieve the repolished sequence, realign it one last time against left and right and store it in the segment
-                            command = "minimap2 -cx map-pb --secondary=no tmp_left.fa tmp_repolished.fa > tmp_left.paf 2> trash.txt"
-                            minimap = os.system(command)
-                            if minimap != 0 :
-                                print("Error while running minimap2: " + command + "\n")
-                                sys.exit(1)
-                            command = "minimap2 -cx map-pb --secondary=no tmp_right.fa tmp_repolished.fa > tmp_right.paf 2> trash.txt"
-                            minimap = os.system(command)
-                            if minimap != 0 :
-                                print("Error while running minimap2: " + command + "\n")
-                                sys.exit(1)
-
-                            #retrieve the coordinates of the reads mapping on the left chunk
-                            reversed_seq = False
-                            left_coordinates = (0,0)
-                            with open("tmp_left.paf", 'r') as paf :
-                                for line in paf :
-                                    line = line.strip().split('\t')
-                                    left_coordinates = (int(line[2]), int(line[3]))
-                                    if line[5] == "-":
-                                        reversed_seq = True
-                                    break
-                            right_coordinates = (0,0)
-                            with open("tmp_right.paf", 'r') as paf :
-                                for line in paf :
-                                    line = line.strip().split('\t')
-                                    right_coordinates = (int(line[2]), int(line[3]))
-                                    break
-
-                            if reversed_seq :
-                                left_coordinates, right_coordinates = right_coordinates, left_coordinates
-
-                            if right_coordinates == (0,0) or left_coordinates == (0,0) :
-                                #problem in the polishing
-                                print("DEBUG code 3309")
-                                seq = None
-                            else:
-                                #now retrieve the repolished sequence between left_coordinates and right_coordinates
-                                with open("tmp_repolished.fa", 'r') as repolished :
-                                    repolished.readline()
-                                    seq = repolished.readline().strip()
-                                    # if left_coordinates == (0,0):
-                                    #     left_coordinates = (0, min(500, len(seq)))
-                                    # if right_coordinates == (0,0): #should not happen, but could if bad polishing
-                                    #     right_coordinates=(max(min(500, len(seq)), len(seq)-500), len(seq))
-
-                                    seq = seq[max(left_coordinates[0], left_coordinates[1])-1:min(right_coordinates[0], right_coordinates[1])+1]
-                                    if reversed_seq :
-                                        # print("REVERSIIIIIING !", orientations[s])
-                                        seq = reverse_complement(seq)
-                                        # sys.exit(1)
-                                
-                                # print("repolished sequence: ", seq)
-                    #because we made sure the orientation was positive when choosing left and right
-                    segment.set_orientation(s, 1)
-                
-                if seq is not None :
-                    seqs[s] = seq
-
-       
-
-        
-        segment.set_sequences(seqs)
-
-    return segments
-
+                            ls = line.rstrip('\n').split('\t')
+                            ls[0] = tag(j, ls[0])
+                            ls[5] = tag(j, ls[5])
+                            f.write("\t".join(ls) + "\n")
+                f.close()
 
+                racon = run_in(batch_dir, "racon -w 50 -t " + str(threads) + " tmp_reads_cut.fa tmp_toPolish.paf tmp_toPolish.fa > tmp_repolished.fa 2>trash.txt")
+                if racon == 0 :
+                    repolished = {untag(name)[0] : seq for name, seq in read_fasta(os.path.join(batch_dir, "tmp_repolished.fa")).items()}
 
+            #cut the polished sequences between the neighbors, job per job (the jobs left out by racon run their own racon)
+            seqs = map_jobs(polish_reassembly, workers, [job_dirs[j] for j in to_racon], [threads_per_job]*len(to_racon), [fallback_seqs[j] for j in to_racon], \
+                            [repolished.get(j) for j in to_racon])
+            for j, seq in zip(to_racon, seqs) :
+                results[j] = (seq, True)
 
+        #the jobs the batch could not polish, on their own
+        seqs = map_jobs(repolish_subcontig, workers, [jobs[j] for j in alone], [fastq_file]*len(alone), [gfa_file]*len(alone), [reads_position]*len(alone), \
+                        [contigs_position]*len(alone), [threads_per_job]*len(alone), [batch_dir]*len(alone))
+        for j, result in zip(alone, seqs) :
+            results[j] = result
 
+    finally : #remove the scratch directory even if minimap2 failed
+        shutil.rmtree(batch_dir, ignore_errors = True)
 
+    return results
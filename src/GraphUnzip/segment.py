@@ -2,11 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import random
+import itertools
+from bisect import bisect_left, bisect_right
+
+segment_IDs = itertools.count() #segments are numbered in the order in which they are created, so that links are always sorted the same way
 
 #a segment is a supercontig
 class Segment:
 
+    #no __dict__ per segment: graphs can have millions of segments
+    __slots__ = ('_id', '_HiCcoverage', '_namesOfContigs', '_orientationOfContigs', '_lengths', '_reads', '_sequences', '_insideCIGARs', '_depths',
+                 '_copiesOfContigs', '_adjacency', '_views', '_trim', '_freezed', '_locked', '_length', '_depth', '_fullName')
+
     def __init__(self, segNamesOfContig, segOrientationOfContigs, segLengths, segInsideCIGARs =None, segLinks = [[],[]], segOtherEndOfLinks = [[],[]], segCIGARs = [[],[]], lock = False, HiCcoverage = 0, readCoverage = []):
          
         if len(segLinks[0]) != len(segOtherEndOfLinks[0]) or len(segLinks[1]) != len(segOtherEndOfLinks[1]) :
@@ -27,15 +34,15 @@ class Segment:
         if segCIGARs == [[],[]] :
             segCIGARs = [['*' for i in segLinks[0]],['*' for i in segLinks[1]]]
         
-        self._id = random.random() #a random number identifying the segment
+        self._id = next(segment_IDs) #an integer identifying the segment
         self._HiCcoverage = HiCcoverage #to keep in mind how many HiC contacts this segment has in total
         
         #this group of attributes are linked arrays : element n in one corresponds with element n in the other. Therefore they shouldn't be modified independantly
         self._namesOfContigs = segNamesOfContig.copy() #names are strings with which sequences are described in the GFA
         self._orientationOfContigs = segOrientationOfContigs.copy() #1 being '+' orientation, 0 the '-' orientation
         self._lengths = segLengths.copy()
-        self._reads = [[] for i in range(len(segNamesOfContig))] #to keep in mind the reads that are associated with each subcontig
-        self._sequences = [None for i in range(len(segNamesOfContig))] #to keep in mind the sequences of each subcontig, and possibly repolish them
+        self._reads = None #to keep in mind the reads that are associated with each subcontig. Like _sequences and _copiesOfContigs, only allocated when used
+        self._sequences = None #to keep in mind the sequences of each subcontig, and possibly repolish them
         self._insideCIGARs = segInsideCIGARs.copy()
 
         if readCoverage != [] :
@@ -43,19 +50,24 @@ class Segment:
         else :
             self._depths = [1 for i in range(len(self._lengths))]
             
-        self._copiesOfContigs = [-1]*len(segNamesOfContig) #this is used exclusively while exporting, to indicate which copy of which contig is in the segment (copy 0 / copy 1 / copy 2 ...)
+        self._copiesOfContigs = None #this is used exclusively while exporting, to indicate which copy of which contig is in the segment (copy 0 / copy 1 / copy 2 ...)
         
-        #this group of attribute are linked arrays : one should never be modified without the others 
-        #They are sorted by ID of the neighbor : important for handling quickly big nodes
-        lists_keyed = [[(segLinks[0][i], segOtherEndOfLinks[0][i], segCIGARs[0][i]) for i in range(len(segLinks[0]))], [(segLinks[1][i], segOtherEndOfLinks[1][i], segCIGARs[1][i]) for i in range(len(segLinks[1]))]]
-        lists_keyed[0].sort(key = lambda x: x[0].ID)
-        lists_keyed[1].sort(key = lambda x: x[0].ID)
-        self._links = [[i[0] for i in lists_keyed[0]], [i[0] for i in lists_keyed[1]]] #two lists of segments with which the segment is linked, at the left end and at the right end
-        self._otherEndOfLinks = [[i[1] for i in lists_keyed[0]], [i[1] for i in lists_keyed[1]]] #for each link, indicates the side of the other segment on which the link arrives
-        self._CIGARs = [[i[2] for i in lists_keyed[0]], [i[2] for i in lists_keyed[1]]] #for each link, indicates the CIGAR string found in the GFA
+        #the links of each end (left end and right end) are counted in a dict keyed by (ID of the neighbor, end of the neighbor on which the link arrives) : finding a link does not depend on the number of links, important for handling quickly big nodes
+        #the values are the number of times the link is present, since the same link can be present several times (e.g. a link from one end to itself)
+        self._adjacency = [{}, {}]
+        #keys, links, otherEndOfLinks and CIGARs of each end as lists sorted by key, kept sorted at each change: the new links are most often appended at the end
+        self._views = [([], [], [], []), ([], [], [], [])]
+        for end in range(2) :
+            for i in range(len(segLinks[end])) :
+                self._insert_link(end, segLinks[end][i], segOtherEndOfLinks[end][i], segCIGARs[end][i])
         
         self._trim = [0,0]
 
+        #length, depth and full name are read very often: they are computed once and reset to None by the few functions modifying lengths, depths or copies
+        self._length = None
+        self._depth = None
+        self._fullName = None
+
         self._freezed = [False, False] #do not duplicate from one end if frozen at this end
         self._locked = lock #That is to duplicate a contig only once in each merge_contigs
           
@@ -72,29 +84,48 @@ class Segment:
     def get_insideCIGARs(self):
         return self._insideCIGARs
     
+    #the three getters below return lists sorted by ID of the neighbor: the segments linked at each end, the ends of these segments on which the links arrive and the CIGARs of the links
+    #They are the lists of the segment, to modify the links use add_end_of_link, remove_end_of_link and set_CIGAR
     def get_links(self):
-        return self._links
+        return [self._views[0][1], self._views[1][1]]
     
     def get_otherEndOfLinks(self):
-        return self._otherEndOfLinks
+        return [self._views[0][2], self._views[1][2]]
     
     def get_CIGARs(self):
-        return self._CIGARs
+        return [self._views[0][3], self._views[1][3]]
+
+    #output : True if endOfSegment is linked to endOfNeighbor of neighbor (any end of neighbor if endOfNeighbor is None)
+    def has_link(self, endOfSegment, neighbor, endOfNeighbor = None):
+        if endOfNeighbor == None :
+            return (neighbor.ID, 0) in self._adjacency[endOfSegment] or (neighbor.ID, 1) in self._adjacency[endOfSegment]
+        return (neighbor.ID, endOfNeighbor) in self._adjacency[endOfSegment]
     
     def get_lengths(self):
         return self._lengths
     
     def get_length(self):
-        return np.sum(self._lengths)
+        if self._length is None :
+            self._length = sum(self._lengths)
+        return self._length
     
     def get_namesOfContigs(self):
         return self._namesOfContigs
     
     def get_copiesOfContigs(self):
+        if self._copiesOfContigs is None :
+            self._copiesOfContigs = [-1]*len(self._namesOfContigs)
         return self._copiesOfContigs
     
     def get_sequences(self):
+        if self._sequences is None :
+            self._sequences = [None]*len(self._namesOfContigs)
         return self._sequences
+
+    def get_sequence(self, index): #None if the sequence of the subcontig has not been set (e.g. by repolishing), without allocating the list of sequences
+        if self._sequences is None or index >= len(self._sequences) :
+            return None
+        return self._sequences[index]
     
     def get_freezed(self):
         return self._freezed
@@ -108,30 +139,51 @@ class Segment:
     def get_depths(self):
         return self._depths
     
+    def get_reads_of_contig(self, index): #the reads of one subcontig, without allocating the lists of reads
+        if self._reads is None :
+            return []
+        return self._reads[index]
+
+    def get_copy(self, index): #the copy number of one subcontig, -1 if not set, without allocating the list of copies
+        if self._copiesOfContigs is None :
+            return -1
+        return self._copiesOfContigs[index]
+
     def get_reads(self):
+        if self._reads is None :
+            self._reads = [[] for i in range(len(self._namesOfContigs))]
         return self._reads
     
     def get_depth(self):
-        sumdepth = 0
-        sumlength = 1 #1 and not 0 to be sure not to divide by 0
-        for i in range(len(self._depths)) :
-            sumdepth += self._depths[i]*self._lengths[i]
-            sumlength += self._lengths[i]
+        if self._depth is None :
+            sumdepth = 0
+            sumlength = 1 #1 and not 0 to be sure not to divide by 0
+            for i in range(len(self._depths)) :
+                sumdepth += self._depths[i]*self._lengths[i]
+                sumlength += self._lengths[i]
+            self._depth = sumdepth / sumlength
             
-        return sumdepth / sumlength
+        return self._depth
     
     def get_trim(self):
         return self._trim
     
     def full_name(self) :
-        return '_'.join([self._namesOfContigs[i]+'-'+str(self._copiesOfContigs[i]) for i in range(len(self._namesOfContigs))])
+        if self._fullName is None :
+            if self._copiesOfContigs is None : #copies not set yet, they are all -1
+                self._fullName = '_'.join([name+'--1' for name in self._namesOfContigs])
+            else :
+                self._fullName = '_'.join([self._namesOfContigs[i]+'-'+str(self._copiesOfContigs[i]) for i in range(len(self._namesOfContigs))])
+        return self._fullName
     
     def print_complete(self):
-        print(self._namesOfContigs, [s.names for s in self._links[0]], \
-              [s.names for s in self._links[1]])
+        print(self._namesOfContigs, [s.names for s in self.links[0]], \
+              [s.names for s in self.links[1]])
     
     # setters 
     def set_copiesNumber(self, copiesNumberForNow):
+        self.get_copiesOfContigs()
+        self._fullName = None
         for c, contig in enumerate(self._namesOfContigs) :
             if contig in copiesNumberForNow :
                 self._copiesOfContigs[c] = copiesNumberForNow[contig]
@@ -146,18 +198,26 @@ class Segment:
     def set_sequences(self, newSequences) :
         self._sequences = newSequences
 
+    def set_reads(self, newReads) :
+        self._reads = newReads
+
+    def set_copiesOfContigs(self, newCopies) :
+        self._copiesOfContigs = newCopies
+        self._fullName = None
+
     def set_orientation(self, index, newOrientation) :
         self._orientationOfContigs[index] = newOrientation
     
     def add_read(self, nameOfContig, nameOfRead):
         # print("adding ", nameOfRead, " to ", nameOfContig, " of ", self._namesOfContigs)
-        self._reads[self._namesOfContigs.index(nameOfContig)].append(nameOfRead)
+        self.get_reads()[self._namesOfContigs.index(nameOfContig)].append(nameOfRead)
 
     def set_CIGAR(self, end, otherContig, otherEnd, newCIGAR) :
-        for l in range(len(self.links[end])) :
-            if self.links[end][l].ID == otherContig.ID and self.otherEndOfLinks[end][l] == otherEnd :
-                self.CIGARs[end][l] = newCIGAR
-                return 0
+        key = (otherContig.ID, otherEnd)
+        if key in self._adjacency[end] :
+            keys, links, otherEndOfLinks, CIGARs = self._views[end]
+            CIGARs[bisect_left(keys, key)] = newCIGAR #the first copy of the link
+            return 0
         return -1
     
     def freeze(self, endOfSegment): 
@@ -165,8 +225,8 @@ class Segment:
   
     def freezeNode(self, endOfSegment):
         self._freezed[endOfSegment] = True
-        for n, neighbor in enumerate(self._links[endOfSegment]) :
-            neighbor.freeze(self._otherEndOfLinks[endOfSegment][n])
+        for n, neighbor in enumerate(self.links[endOfSegment]) :
+            neighbor.freeze(self.otherEndOfLinks[endOfSegment][n])
         
     def unfreeze(self):
         self._freezed = [False, False]
@@ -176,7 +236,7 @@ class Segment:
         
     def lockNode(self, endOfSegment):
         self._locked = True
-        for i in self._links[endOfSegment]:
+        for i in self.links[endOfSegment]:
             i.locked = True
 
     def set_trim(self, trim) :
@@ -188,6 +248,7 @@ class Segment:
     def divide_depths(self, n) : #when duplicating a segment, you need to lower the coverage of all replicas
         for i in range (len(self._depths)) :
             self._depths[i] /= n
+        self._depth = None
             
     def multiply_end_depths(self, n, end, numberOfContigs) : #this fucntion is useful when merging a wrongly duplicated dead end
         for co in range(numberOfContigs) :
@@ -195,6 +256,8 @@ class Segment:
             
     def length1(self): #use this function to set length of a segment to 1 (instead of 0, mostly)
         self._lengths = [max(1, i) for i in self._lengths]
+        self._length = None
+        self._depth = None
                     
     # properties
     
@@ -299,157 +362,111 @@ class Segment:
                 print('Problematic line : ', GFAline)   
 
             
-            if leftOrRight == 0 and o1 == 0:
-
-                #then comes a little test to see if the link has already been added (for example if their are several lines in the GFA describing the same link). An 'or' condition to allow it when an end of link is linked with itself
-                if find_this_link(segments[names[l[3]]], 1-o2, self._links[0], self._otherEndOfLinks[0]) == -1 or (segments[names[l[3]]].ID == self._id and 1-o2 == 0):
+            CIGAR = '*'
+            if len(l) > 5 :
+                CIGAR = l[5]
 
-                    index = index_at_which_new_link_should_be_inserted(segments[names[l[3]]], self._links[0], 1-o2 ,self._otherEndOfLinks[0])
-                    self._links[0].insert(index, segments[names[l[3]]])
-                    self._otherEndOfLinks[0].insert(index, 1-o2)
-                    if len(l) > 5 :
-                        self._CIGARs[0].insert(index, l[5])
-                    else :
-                        self._CIGARs[0].insert(index, '*')
+            #the link is added only if it is not already there (for example if there are several lines in the GFA describing the same link), except if an end of link is linked with itself
+            if leftOrRight == 0 and o1 == 0:
+                neighbor = segments[names[l[3]]]
+                if not self.has_link(0, neighbor, 1-o2) or (neighbor.ID == self._id and 1-o2 == 0):
+                    self._insert_link(0, neighbor, 1-o2, CIGAR)
                     
             elif leftOrRight == 0 and o1 == 1 :
-                if find_this_link(segments[names[l[3]]], 1-o2, self._links[1], self._otherEndOfLinks[1]) == -1 or (segments[names[l[3]]].ID == self._id and 1-o2 == 1):
-                    
-                    index = index_at_which_new_link_should_be_inserted(segments[names[l[3]]], self._links[1],  1-o2 ,self._otherEndOfLinks[1])
-                    
-                    self._links[1].insert(index, segments[names[l[3]]])
-                    self._otherEndOfLinks[1].insert(index, 1-o2)
-                    if len(l) > 5 :
-                        self._CIGARs[1].insert(index, l[5])
-                    else :
-                        self._CIGARs[1].insert(index, '*')
+                neighbor = segments[names[l[3]]]
+                if not self.has_link(1, neighbor, 1-o2) or (neighbor.ID == self._id and 1-o2 == 1):
+                    self._insert_link(1, neighbor, 1-o2, CIGAR)
                 
             elif leftOrRight == 1 and o2 == 1 :
-                if find_this_link(segments[names[l[1]]], o1, self._links[0], self._otherEndOfLinks[0]) == -1 or (segments[names[l[1]]].ID == self._id and o1 == 0) :
-                    
-                    index = index_at_which_new_link_should_be_inserted(segments[names[l[1]]], self._links[0],  o1 ,self._otherEndOfLinks[0])
-                    self._links[0].insert(index, segments[names[l[1]]])
-                    self._otherEndOfLinks[0].insert(index, o1)
-                    if len(l) > 5 :
-                        self._CIGARs[0].insert(index, l[5])
-                    else :
-                        self._CIGARs[0].insert(index, '*')
+                neighbor = segments[names[l[1]]]
+                if not self.has_link(0, neighbor, o1) or (neighbor.ID == self._id and o1 == 0) :
+                    self._insert_link(0, neighbor, o1, CIGAR)
                     
             elif leftOrRight == 1 and o2 == 0 :
-                if find_this_link(segments[names[l[1]]], o1, self._links[1], self._otherEndOfLinks[1]) == -1 or (segments[names[l[1]]].ID == self._id and o1 == 1):
-                    index = index_at_which_new_link_should_be_inserted(segments[names[l[1]]], self._links[1],  o1 ,self._otherEndOfLinks[1])
-                    self._links[1].insert(index, segments[names[l[1]]])
-                    self._otherEndOfLinks[1].insert(index, o1)
-                    if len(l) > 5 :
-                        self._CIGARs[1].insert(index, l[5])
-                    else :
-                        self._CIGARs[1].insert(index, '*')
+                neighbor = segments[names[l[1]]]
+                if not self.has_link(1, neighbor, o1) or (neighbor.ID == self._id and o1 == 1):
+                    self._insert_link(1, neighbor, o1, CIGAR)
             
             else :
                 print('ERROR while trying to add a new link from the gfa : could not locate a correct name')
         
+    def _insert_link(self, endOfSegment, segment2, endOfSegment2, CIGAR) :
+        key = (segment2.ID, endOfSegment2)
+        self._adjacency[endOfSegment][key] = self._adjacency[endOfSegment].get(key, 0) + 1
+        keys, links, otherEndOfLinks, CIGARs = self._views[endOfSegment]
+        if len(keys) == 0 or keys[-1] <= key : #the usual case, neighbors being mostly created after the segment
+            keys.append(key)
+            links.append(segment2)
+            otherEndOfLinks.append(endOfSegment2)
+            CIGARs.append(CIGAR)
+        else : #after the copies of the link already present, if any
+            index = bisect_right(keys, key)
+            keys.insert(index, key)
+            links.insert(index, segment2)
+            otherEndOfLinks.insert(index, endOfSegment2)
+            CIGARs.insert(index, CIGAR)
+
+    #removes the copies of the link from index start (included) to index stop (excluded) in the views of the end
+    def _delete_from_views(self, endOfSegment, start, stop) :
+        for view in self._views[endOfSegment] :
+            del view[start:stop]
+
+    def _remove_link(self, endOfSegment, ID2, endOfSegment2) :
+        key = (ID2, endOfSegment2)
+        if self._adjacency[endOfSegment].pop(key, None) is not None :
+            keys = self._views[endOfSegment][0]
+            self._delete_from_views(endOfSegment, bisect_left(keys, key), bisect_right(keys, key))
+
     #this adds the end of a links, but only on this segment, not on the other end
     def add_end_of_link(self, endOfSegment, segment2, endOfSegment2, CIGAR = '*'):
         
-        #print('A', len(segment2.otherEndOfLinks[1]), len(segment2.links[1]), len(segment2.CIGARs[1]))
-        #print(self._namesOfContigs, segment2.names)
-        index = index_at_which_new_link_should_be_inserted(segment2, self._links[endOfSegment], endOfSegment2, self._otherEndOfLinks[endOfSegment])
-
-        self._links[endOfSegment].insert(index, segment2)
-        #print('B', len(segment2.otherEndOfLinks[1]), len(segment2.links[1]), len(segment2.CIGARs[1]))
-
-        self._otherEndOfLinks[endOfSegment].insert(index, endOfSegment2)
-        self._CIGARs[endOfSegment].insert(index, CIGAR)        
+        self._insert_link(endOfSegment, segment2, endOfSegment2, CIGAR)
 
     #this function is useful for rerouting around big nodes. It adds end of links more efficiently than if done individually, and checks for doubles
     def add_a_bunch_of_end_of_links(self, endOfSegment, listOfSegmentsToAdd, listOfEndOfSegmentsToAdd, CIGARsToAdd) :
  
-        #All the list of segments being sorted by ID, this is done on the basis of the merging of merge sort.
-        newLinks = []
-        newEndOfLinks = []
-        newCIGARs = []
-
-        indexOfSegmentToAdd = 0
-        indexOfLinks = 0
-        
-        while indexOfSegmentToAdd < len(listOfSegmentsToAdd) and indexOfLinks < len(self._links[endOfSegment]) :
-            
-            if listOfSegmentsToAdd[indexOfSegmentToAdd].ID < self._links[endOfSegment][indexOfLinks].ID :
-                newLinks.append(listOfSegmentsToAdd[indexOfSegmentToAdd])
-                newEndOfLinks.append(listOfEndOfSegmentsToAdd[indexOfSegmentToAdd])
-                newCIGARs.append( CIGARsToAdd[indexOfSegmentToAdd] )
-                indexOfSegmentToAdd += 1
-                
-            elif listOfSegmentsToAdd[indexOfSegmentToAdd].ID > self._links[endOfSegment][indexOfLinks].ID :
-                newLinks.append( self._links[endOfSegment][indexOfLinks] )
-                newEndOfLinks.append( self._otherEndOfLinks[endOfSegment][indexOfLinks] )
-                newCIGARs.append( self._CIGARs[endOfSegment][indexOfLinks] )
-                indexOfLinks += 1
-                
-            #elsewhise the link goes toward the same segment, but maybe not the same end of this segment
-            elif listOfEndOfSegmentsToAdd[indexOfSegmentToAdd] < self._otherEndOfLinks[endOfSegment][indexOfLinks] :
-                newLinks.append( listOfSegmentsToAdd[indexOfSegmentToAdd] )
-                newEndOfLinks.append( listOfEndOfSegmentsToAdd[indexOfSegmentToAdd] )
-                newCIGARs.append( CIGARsToAdd[indexOfSegmentToAdd] )
-                indexOfSegmentToAdd += 1
-                
-            elif listOfEndOfSegmentsToAdd[indexOfSegmentToAdd] > self._otherEndOfLinks[endOfSegment][indexOfLinks] :
-                newLinks.append( self._links[endOfSegment][indexOfLinks] )
-                newEndOfLinks.append( self._otherEndOfLinks[endOfSegment][indexOfLinks] )
-                newCIGARs.append( self._CIGARs[endOfSegment][indexOfLinks] )
-                indexOfLinks += 1
-                
-            else : #it means that there is twice the same link, so add it only once
-                newLinks.append( self._links[endOfSegment][indexOfLinks] )
-                newEndOfLinks.append( self._otherEndOfLinks[endOfSegment][indexOfLinks])
-                newCIGARs.append( self._CIGARs[endOfSegment][indexOfLinks])
-                indexOfLinks += 1
-                indexOfSegmentToAdd += 1
-                
-        if indexOfSegmentToAdd >= len(listOfEndOfSegmentsToAdd) :
-            newLinks += self._links[endOfSegment][indexOfLinks:]
-            newEndOfLinks += self._otherEndOfLinks[endOfSegment][indexOfLinks:]
-            newCIGARs += self._CIGARs[endOfSegment][indexOfLinks:]
-            
-        elif indexOfLinks >= len(self._links[endOfSegment]) :
-            newLinks += listOfSegmentsToAdd[indexOfSegmentToAdd:]
-            newEndOfLinks += listOfEndOfSegmentsToAdd[indexOfSegmentToAdd:]
-            newCIGARs += CIGARsToAdd[indexOfSegmentToAdd:]
-        
-        self._links[endOfSegment] = newLinks
-        self._otherEndOfLinks[endOfSegment] = newEndOfLinks
-        self._CIGARs[endOfSegment] = newCIGARs
+        for n, segmentToAdd in enumerate(listOfSegmentsToAdd) :
+            if (segmentToAdd.ID, listOfEndOfSegmentsToAdd[n]) not in self._adjacency[endOfSegment] : #if there is twice the same link, add it only once
+                self._insert_link(endOfSegment, segmentToAdd, listOfEndOfSegmentsToAdd[n], CIGARsToAdd[n])
 
     def remove_end_of_link(self, endOfSegment, segmentToRemove, endOfSegmentToRemove = None, warning = True): #endOfSegmentToRemove is there in case there exists two links between self[endOfSegment] and segment to remove. Needed for extra security
         
-        #first determine the index of the segment to remove
-        #print('Removing ', segmentToRemove.names, endOfSegmentToRemove, ' from ', self._namesOfContigs)
-        #print('Among these links :', [i.names for i in self._links[endOfSegment]], self._otherEndOfLinks[endOfSegment])
-        index = find_this_link(segmentToRemove, endOfSegmentToRemove, self._links[endOfSegment], self._otherEndOfLinks[endOfSegment], warning = warning)
-        #index = self._links[endOfSegment].index(segmentToRemove)
-   
-        #then remove the end of unwanted link in all attributes
-        if index != -1 :
-            del self._links[endOfSegment][index]
-            del self._otherEndOfLinks[endOfSegment][index]
-            del self._CIGARs[endOfSegment][index]
+        if endOfSegmentToRemove == None : #then remove the first link towards segmentToRemove, as in the sorted list of links
+            if (segmentToRemove.ID, 0) in self._adjacency[endOfSegment] :
+                endOfSegmentToRemove = 0
+            else :
+                endOfSegmentToRemove = 1
+        key = (segmentToRemove.ID, endOfSegmentToRemove)
+
+        #then remove the end of unwanted link
+        if key in self._adjacency[endOfSegment] :
+            self._adjacency[endOfSegment][key] -= 1
+            if self._adjacency[endOfSegment][key] == 0 :
+                del self._adjacency[endOfSegment][key]
+            index = bisect_right(self._views[endOfSegment][0], key) - 1 #if the link is present several times, keep the first one
+            self._delete_from_views(endOfSegment, index, index+1)
             return True
-        elif index == -1 and warning:
+        elif warning:
              print('Trying unsuccesfully to remove ', segmentToRemove.names, ' from ', self._namesOfContigs)
              return False
         
+    #output : the links of this end present several times, as a list of (neighbor, end of the neighbor, number of times the link is present)
+    def get_links_present_several_times(self, endOfSegment):
+        keys, links, otherEndOfLinks, CIGARs = self._views[endOfSegment]
+        return [(links[bisect_left(keys, key)], key[1], count) for key, count in self._adjacency[endOfSegment].items() if count > 1]
+
     #returns two contigs, equal to this contig but split at axis, corresponding to the number of contigs left of the junction
     def break_contig(self, axis) :
         
-        newSegment1 = Segment(self._namesOfContigs[:axis], self._orientationOfContigs[:axis], self._lengths[:axis], self._insideCIGARs[:axis-1], [self._links[0], []], [self._otherEndOfLinks[0], []], [self._CIGARs[0], []], readCoverage = self._depths[:axis])
+        newSegment1 = Segment(self._namesOfContigs[:axis], self._orientationOfContigs[:axis], self._lengths[:axis], self._insideCIGARs[:axis-1], [self.links[0], []], [self.otherEndOfLinks[0], []], [self.CIGARs[0], []], readCoverage = self._depths[:axis])
         
-        newSegment2 = Segment(self._namesOfContigs[axis:], self._orientationOfContigs[axis:], self._lengths[axis:], self._insideCIGARs[axis:], [[], self._links[1]], [[], self._otherEndOfLinks[1]], [[], self._CIGARs[1]], readCoverage = self._depths[axis:])
+        newSegment2 = Segment(self._namesOfContigs[axis:], self._orientationOfContigs[axis:], self._lengths[axis:], self._insideCIGARs[axis:], [[], self.links[1]], [[], self.otherEndOfLinks[1]], [[], self.CIGARs[1]], readCoverage = self._depths[axis:])
         
         return newSegment1, newSegment2
      
     #function to be used on small loops only
     def flatten(self, replicas) :
-        if self not in self._links[0] :
+        if not self.has_link(0, self) :
             
             print('ERROR : in segment.flatten, trying to flatten something that is not a loop')
             
@@ -462,14 +479,14 @@ class Segment:
             newOrientations = self._orientationOfContigs.copy()
             newLengths = self._lengths.copy()
             newinsideCIGARs = self._insideCIGARs.copy()
-            newCopies = self._copiesOfContigs.copy()
+            newCopies = self.get_copiesOfContigs().copy()
             newDepths = self._depths.copy()
             for i in range(replicas) :
                 newName += self._namesOfContigs
                 newOrientations += self._orientationOfContigs
                 newLengths += self._lengths
                 newCopies += self._copiesOfContigs
-                newinsideCIGARs += [self._CIGARs[0][self._links[0].index(self)]] + self._insideCIGARs
+                newinsideCIGARs += [self.CIGARs[0][self.links[0].index(self)]] + self._insideCIGARs
                 newDepths += self._depths
             
             self._namesOfContigs = newName
@@ -478,9 +495,12 @@ class Segment:
             self._copiesOfContigs = newCopies
             self._insideCIGARs = newinsideCIGARs
             self._depths = newDepths
+            self._length = None
+            self._depth = None
+            self._fullName = None
             
-           # print('In segment.flatten : ', self._namesOfContigs, self._insideCIGARs, [self._CIGARs[0][self._links[0].index(self)]])
-            #print('Links before any removal, ', [i.names for i in self._links[0]], '\n')
+           # print('In segment.flatten : ', self._namesOfContigs, self._insideCIGARs, [self.CIGARs[0][self.links[0].index(self)]])
+            #print('Links before any removal, ', [i.names for i in self.links[0]], '\n')
             self.remove_end_of_link(0, self)
             self.remove_end_of_link(1, self)
   
@@ -489,14 +509,15 @@ class Segment:
         
         for end in range(2) :
             
-            for n, neighbor in enumerate(self._links[end]) :
+            keys, links, otherEndOfLinks, CIGARs = self._views[end]
+            for n, neighbor in enumerate(links) :
                 
-                otherEnd = self._otherEndOfLinks[end][n]
-                neighbor.remove_end_of_link(otherEnd, self, end)
+                otherEnd = otherEndOfLinks[n]
+                if neighbor is not self :
+                    neighbor.remove_end_of_link(otherEnd, self, end)
         
-        self._links = [[],[]]
-        self._otherEndOfLinks = [[],[]]
-        self._CIGARs = [[],[]]
+        self._adjacency = [{}, {}]
+        self._views = [([], [], [], []), ([], [], [], [])]
         
 #This function is OUTSIDE the class. It takes two segments and the end of the first segment which is linked to the second. It appends a merged contig to the listOfSegments, without modifying the two inputed segments
 def merge_two_segments(segment1, endOfSegment1, segment2, listOfSegments):
@@ -612,22 +633,6 @@ def find_this_link(segment, endOfSegment, listOfLinks, listOfEndsOfLinks, warnin
     
     return -1
 
-#returns the index at which a segment should be inserted in a list sorted by ID : useful because links[0] and links[1] are kept sorted at all times
-def index_at_which_new_link_should_be_inserted(segment, listOfSegments, endOfLink, listOfEndOfLinks) :
-    lo = 0
-    hi = len(listOfSegments)
-
-    while lo < hi:
-        mid = (lo+hi)//2
-        if segment.ID < listOfSegments[mid].ID or (segment.ID == listOfSegments[mid].ID and endOfLink < listOfEndOfLinks[mid]):
-            hi = mid
-        else:
-            lo = mid+1
-            
-    while lo < len(listOfSegments) and listOfSegments[lo].ID == segment.ID and endOfLink == listOfEndOfLinks[lo] :
-        lo += 1
-    return lo
-
 def check_if_all_links_are_sorted(listOfSegments) :
     
     for segment in listOfSegments :
@@ -642,25 +647,104 @@ def check_if_all_links_are_sorted(listOfSegments) :
                 if segment not in neighbor.links[segment.otherEndOfLinks[endOfSegment][n]] :
                     print('Non-reciprocal links : ', segment.names, segment.ID, neighbor.names, neighbor.ID)
                 
+#input : a list of segments and the IDs of the segments deleted from the graph (tombstones)
+#output : the same list without the deleted segments, compacted in place in one pass (O(n+k) instead of O(n) per deletion), the other segments keeping their order
+def compact_segments(listOfSegments, deleted) :
+
+    if len(deleted) > 0 :
+        listOfSegments[:] = [segment for segment in listOfSegments if segment.ID not in deleted]
+    return listOfSegments
+
 #funtion to delete links that are present twice in the graph (often because they are present twice in the gfa)
 def delete_links_present_twice(segments):
     
-
     for segment in segments :
-        toBeRemoved = []
         for endOfSegment in range(2) :
             
-            for n1 in range(len(segment.links[endOfSegment])-1) :
+            #links present several times are counted by the segment, so they are found without comparing all pairs of links
+            for neighbor, otherEnd, count in segment.get_links_present_several_times(endOfSegment) :
                 
-                for n2 in range(n1+1, len(segment.links[endOfSegment])) :
+                if neighbor is not segment :
                     
-                    if segment.links[endOfSegment][n1].ID == segment.links[endOfSegment][n2].ID and segment.otherEndOfLinks[endOfSegment][n1] == segment.otherEndOfLinks[endOfSegment][n2] and segment.links[endOfSegment][n1].ID != segment.ID:
-                        
-                        segment.links[endOfSegment][n2].remove_end_of_link(segment.otherEndOfLinks[endOfSegment][n2], segment, endOfSegment)
-                        toBeRemoved += [[endOfSegment, segment.links[endOfSegment][n2], segment.otherEndOfLinks[endOfSegment][n2]]]
-
-        for r in toBeRemoved :
-            segment.remove_end_of_link(r[0], r[1], r[2])
+                    for copy in range(count-1) :
+                        neighbor.remove_end_of_link(otherEnd, segment, endOfSegment)
+                        segment.remove_end_of_link(endOfSegment, neighbor, otherEnd)
+
+#input : the list of segments and links given as (index of segment 1, end of segment 1, index of segment 2, end of segment 2, CIGAR)
+#output : the links added to the segments, each link only once even if it is given several times (in either direction), with the CIGAR of its first occurrence
+def add_links_in_bulk(segments, links):
+
+    if len(links) == 0 :
+        return
+
+    #pack each link into one integer, the smallest end first, to sort and deduplicate all links at once
+    links_array = np.array([(l[0], l[1], l[2], l[3]) for l in links], dtype = np.uint64)
+    end1 = 2*links_array[:,0] + links_array[:,1]
+    end2 = 2*links_array[:,2] + links_array[:,3]
+    keys = (np.minimum(end1, end2) << np.uint64(32)) | np.maximum(end1, end2)
+    unique_keys, first_occurrence = np.unique(keys, return_index = True)
+
+    #links sorted by key are inserted nearly in the order of the IDs of the neighbors
+    for key, index in zip(unique_keys.tolist(), first_occurrence.tolist()) :
+        endA = key >> 32
+        endB = key & 0xFFFFFFFF
+        segmentA = segments[endA // 2]
+        segmentB = segments[endB // 2]
+        segmentA._insert_link(endA % 2, segmentB, endB % 2, links[index][4])
+        segmentB._insert_link(endB % 2, segmentA, endA % 2, links[index][4])
+
+#input : a list of links, as (segment1, end1, segment2, end2)
+#output : the links are removed on both their ends, however many times they are present
+def remove_links_in_bulk(links):
+
+    for segment1, end1, segment2, end2 in links :
+        segment1._remove_link(end1, segment2.ID, end2)
+        segment2._remove_link(end2, segment1.ID, end1)
+
+#input : a segment, the end by which it is entered, a budget of length and of contigs, a cache of the results (a dict, valid as long as the links of the graph
+#        do not change), the maximum number of neighbors to explore behind each contig (the longest first) and whether to stop as soon as the budget of length is exceeded
+#output : the length of the longest path starting with this segment and going out by its other end, explored until the budget is spent, and True if all
+#         the paths stop at dead ends before the budget is spent. The paths are explored iteratively, each (contig, end, budget) being explored only once
+def extended_length(segment, end, thresholdLength, thresholdContigs, cache = None, maxBranches = None, stopBeyondThreshold = False) :
+
+    if cache is None :
+        cache = {}
+
+    #each frame of the stack is [contig, end, budget of length, budget of contigs, neighbors left to explore, longest extension so far, dead end so far]
+    stack = [[segment, end, thresholdLength, thresholdContigs, None, 0, True]]
+    result = None
+    while len(stack) > 0 :
+        frame = stack[-1]
+        contig, contigEnd, length, contigs, neighbors, longest, deadEnd = frame
+        key = (contig.ID, contigEnd, length, contigs)
+
+        if neighbors is None : #first time the frame is on top of the stack
+            if key in cache :
+                result = cache[key]
+            elif contigs == 0 or length <= 0 :
+                result = (contig.length, False)
+            else :
+                #start by looking down the longest contig, it will be fastest
+                neighbors = sorted(range(len(contig.links[1-contigEnd])), key = lambda x : contig.links[1-contigEnd][x].length, reverse = True)
+                if maxBranches is not None :
+                    neighbors = neighbors[:maxBranches]
+                frame[4] = neighbors[::-1] #reversed to pop them in order
+
+        if result is None :
+            if len(frame[4]) > 0 and not (stopBeyondThreshold and longest > length - contig.length) :
+                n = frame[4].pop()
+                stack.append([contig.links[1-contigEnd][n], contig.otherEndOfLinks[1-contigEnd][n], length - contig.length, contigs - 1, None, 0, True])
+                continue
+            result = (longest + contig.length, deadEnd)
+
+        cache[key] = result
+        stack.pop()
+        if len(stack) > 0 : #hand the result to the parent frame
+            stack[-1][5] = max(stack[-1][5], result[0])
+            stack[-1][6] = stack[-1][6] and result[1]
+            result = None
+
+    return result
 
 
 ## A few lines to test the functions of the file
@@ -3,17 +3,29 @@ import sys
 import segment as sg
 from input_output import read_GAF
 from input_output import read_GAF_parallel
+from input_output import export_snapshot
 from copy import deepcopy
 import time
 from timeit import default_timer as timer
 import pickle
+import array
+import os
 
 import concurrent.futures #for multithreading
-import threading #for multithreading
 import multiprocessing
 
 import numpy as np
 
+CANCELLED = -1 #contig of a path that has been removed from it
+
+class CancelledContig : #stands for all the contigs removed from a Path: one shared object, linked to nothing, recognized by identity
+    ID = CANCELLED
+    names = ["dummy"]
+    links = ([], [])
+    otherEndOfLinks = ([], [])
+
+CANCELLED_CONTIG = CancelledContig()
+
 class Path :
 
     def __init__(self, contigs, orientations, read_name) :
@@ -39,7 +51,7 @@ class Path :
 
     def name(self):
         return self.__read_name
-    
+
     def get_contigs(self):
         return self.__contigs
     
@@ -48,20 +60,19 @@ class Path :
     
     def replace(self, contig_before, contig_after, pos_of_contig) :
         if self.__contigs[pos_of_contig] != contig_before :
-            print("ERROR in simple_unzip.py: 9u8u")
-            sys.exit()
+            raise ValueError("ERROR in simple_unzip.py: 9u8u, the path does not go through the contig to replace at position " + str(pos_of_contig))
         else:     
             self.__contigs[pos_of_contig] = contig_after
     
     def cancel(self, contig): #empty the path if it contains this contig
         co = 0
         for c in self.__contigs :
-            if c.ID == contig.ID :
+            if c is contig :
                 # print("Cancelling ffry ", self.__read_name, " ", contig.names)
                 # if co > 0 and co < len(self.__contigs)-1 :
                 #     print("ERROR: cancelddling a path in the middle of it: ", self)
                 #     sys.exit()
-                self.__contigs[co] = sg.Segment(["dummy"], [0], [0]) #dummy segment not to be used anymore
+                self.__contigs[co] = CANCELLED_CONTIG #not to be used anymore
                 return
             co += 1
 
@@ -104,6 +115,227 @@ class Path :
         # if trim_beginning > 0 :
         #     print("Now trimming coiJ DS ", self)
 
+#the paths of the reads, as used by simple_unzip2. Instead of one Path object per read, all the paths are stored one after the other in flat arrays:
+#the IDs of their contigs (int32, CANCELLED once a contig is removed from a path), their orientations (8 per byte) and the offset of each path in
+#these arrays. Reads following exactly the same path are stored once, weighted by their number. The positions of each contig on the paths are
+#indexed in CSR form: the positions sorted by contig ID and, for each ID, the offset of its positions
+class PathSet :
+
+    def __init__(self, segments, keep_read_names = False) :
+
+        self.segment_of_ID = {segment.ID : segment for segment in segments}
+        self.keep_read_names = keep_read_names
+
+        #while the paths are being added, they are deduplicated and stored in growing buffers, turned into numpy arrays by freeze()
+        self._index_of_key = {}
+        self._nodes = array.array('i')
+        self._orientations = bytearray()
+        self._offsets = array.array('q', [0])
+        self._weights = array.array('q')
+        self.read_names = [] if keep_read_names else None #names of the reads following each path, if they are kept
+
+        self.nodes = None
+        self.orientations = None
+        self.offsets = None
+        self.weights = None
+        self.starts = None #informative window of each path: the positions from starts[p] (included) to ends[p] (excluded) are indexed, the others are hidden
+        self.ends = None
+        self.hidden_weights = None #number of reads going through each contig on the hidden parts of the paths
+        self.deleted = set() #IDs of the contigs duplicated, which are not in the graph anymore
+        self.index_offsets = None
+        self.index_positions = None
+        self.moved_occurrences = {} #positions of the contigs created or emptied since the index was built, which take precedence over the index
+
+    def __len__(self):
+        if self.weights is None :
+            return len(self._weights)
+        return len(self.weights)
+
+    def number_of_reads(self):
+        if self.weights is None :
+            return sum(self._weights)
+        return int(self.weights.sum())
+
+    #input : the IDs of the contigs of a path, their orientations (1 for '>', 0 for '<') and the name of the read
+    def add_path(self, contigs, orientations, read_name) :
+
+        key = array.array('i', [2*contigs[c]+orientations[c] for c in range(len(contigs))]).tobytes()
+        if key in self._index_of_key :
+            p = self._index_of_key[key]
+            self._weights[p] += 1
+            if self.keep_read_names :
+                self.read_names[p].append(read_name)
+            return
+
+        self._index_of_key[key] = len(self._weights)
+        self._nodes.extend(contigs)
+        self._orientations.extend(orientations)
+        self._offsets.append(len(self._nodes))
+        self._weights.append(1)
+        if self.keep_read_names :
+            self.read_names.append([read_name])
+
+    #turn the buffers into arrays, the informative windows covering the whole paths
+    def freeze(self) :
+
+        self.nodes = np.array(self._nodes, dtype = np.int32)
+        self.orientations = np.packbits(np.frombuffer(bytes(self._orientations), dtype = np.uint8))
+        self.offsets = np.array(self._offsets, dtype = np.int64)
+        self.weights = np.array(self._weights, dtype = np.int64)
+        self._index_of_key = None
+        self._nodes = None
+        self._orientations = None
+        self._offsets = None
+        self._weights = None
+        self.starts = self.offsets[:-1].copy()
+        self.ends = self.offsets[1:].copy()
+
+    #the link between the contigs at this position and the next one is the only link of both ends
+    def straight(self, position) :
+        contig, next_contig = self.segment_of_ID[int(self.nodes[position])], self.segment_of_ID[int(self.nodes[position+1])]
+        return len(contig.links[self.orientation_at(position)]) == 1 and len(next_contig.links[1-self.orientation_at(position+1)]) == 1
+
+    #reduce each path to its informative window, as Path.trim: the contigs before the first link that is not straight and after the last one are hidden.
+    #No dilemma can read a hidden contig: its neighbors on the path have no other link, so it only goes back into the window (expand_window) when a duplication
+    #at the border of the window creates a new branch point next to it. Until then, a hidden contig is never duplicated along the path, at most cancelled.
+    #The paths going twice through the same contig are not trimmed, since the neighbors of a contig are read on its last occurrence
+    def trim(self) :
+
+        numberOfIDs = max(self.segment_of_ID.keys(), default = -1) + 1
+        degrees = np.zeros((numberOfIDs, 2), dtype = np.int64)
+        for segment in self.segment_of_ID.values() :
+            degrees[segment.ID] = (len(segment.links[0]), len(segment.links[1]))
+
+        #the links that are not straight, each designated by the position of the contig before it
+        positions = np.arange(len(self.nodes)-1, dtype = np.int64)
+        pathOfPositions = self.path_of(positions)
+        junctions = positions[pathOfPositions == self.path_of(positions+1)]
+        orientations = self.orientation_at(np.arange(len(self.nodes), dtype = np.int64)).astype(np.int64)
+        branching = (degrees[self.nodes[junctions], orientations[junctions]] != 1) | (degrees[self.nodes[junctions+1], 1-orientations[junctions+1]] != 1)
+        junctions = junctions[branching]
+        pathOfJunctions = self.path_of(junctions)
+
+        #a path with only straight links keeps its last contig, as Path.trim
+        self.starts = np.maximum(self.offsets[:-1], self.offsets[1:]-1)
+        self.ends = self.offsets[1:].copy()
+        paths, first = np.unique(pathOfJunctions, return_index = True)
+        self.starts[paths] = junctions[first]
+        paths, last_in_reverse = np.unique(pathOfJunctions[::-1], return_index = True)
+        self.ends[paths] = junctions[len(junctions) - 1 - last_in_reverse] + 2
+
+        keys = np.sort(np.repeat(np.arange(len(self), dtype = np.int64), np.diff(self.offsets)) * numberOfIDs + self.nodes)
+        repeated = np.unique(keys[1:][keys[1:] == keys[:-1]] // max(1, numberOfIDs))
+        self.starts[repeated] = self.offsets[repeated]
+        self.ends[repeated] = self.offsets[repeated+1]
+
+        hidden = np.flatnonzero(~self.in_windows())
+        self.hidden_weights = np.bincount(self.nodes[hidden], weights = self.weights[self.path_of(hidden)], minlength = numberOfIDs).astype(np.int64)
+
+    #output : for each position, True if it is in the informative window of its path
+    def in_windows(self) :
+        inside = np.zeros(len(self.nodes)+1, dtype = np.int64)
+        np.add.at(inside, self.starts, 1)
+        np.add.at(inside, self.ends, -1)
+        return np.cumsum(inside[:-1]) > 0
+
+    #index the positions of the contigs in the informative windows, except the cancelled ones
+    def build_index(self) :
+
+        positions = np.flatnonzero(self.in_windows() & (self.nodes != CANCELLED))
+        positionType = np.int32 if len(self.nodes) < 2**31 else np.int64
+        numberOfIDs = max(self.segment_of_ID.keys(), default = -1) + 1
+        self.index_positions = positions[np.argsort(self.nodes[positions], kind = 'stable')].astype(positionType) #stable: the positions of each contig stay in the order of the paths
+        self.index_offsets = np.zeros(numberOfIDs+1, dtype = np.int64)
+        np.cumsum(np.bincount(self.nodes[positions], minlength = numberOfIDs), out = self.index_offsets[1:])
+
+    def segment(self, ID):
+        return self.segment_of_ID[ID]
+
+    def add_segment(self, segment):
+        self.segment_of_ID[segment.ID] = segment
+
+    #output : the positions in self.nodes where the contig appears, in the order of the paths
+    def occurrences(self, ID):
+        if ID in self.moved_occurrences :
+            return self.moved_occurrences[ID]
+        if ID+1 >= len(self.index_offsets) :
+            return np.zeros(0, dtype = self.index_positions.dtype)
+        return self.index_positions[self.index_offsets[ID]:self.index_offsets[ID+1]]
+
+    def set_occurrences(self, ID, positions):
+        self.moved_occurrences[ID] = np.asarray(positions, dtype = self.index_positions.dtype)
+
+    #the contig has been duplicated: its positions are emptied and the hidden ones will be cancelled when they come back into a window
+    def delete_segment(self, ID):
+        self.deleted.add(ID)
+        self.set_occurrences(ID, [])
+
+    #input : a position of a contig that has just been duplicated, now holding a copy or cancelled
+    #output : if the position is at the border of the informative window of its path, the window grows over the hidden contigs that are now next to a branch point
+    def expand_window(self, position) :
+
+        path = int(self.path_of(position))
+        while self.starts[path] > self.offsets[path] and self.borders_branch_point(int(self.starts[path])-1, int(self.starts[path])) :
+            self.starts[path] -= 1
+            self.unhide(int(self.starts[path]), path)
+        while self.ends[path] < self.offsets[path+1] and self.borders_branch_point(int(self.ends[path]), int(self.ends[path])-1) :
+            self.unhide(int(self.ends[path]), path)
+            self.ends[path] += 1
+
+    #input : a hidden position and the position at the border of the window next to it
+    #output : True if the link between them is not straight anymore. A hidden contig that has been duplicated is cancelled
+    def borders_branch_point(self, hidden, border) :
+
+        if self.nodes[border] == CANCELLED or self.nodes[hidden] == CANCELLED :
+            return False
+        if int(self.nodes[hidden]) in self.deleted :
+            self.nodes[hidden] = CANCELLED
+            return False
+        return not self.straight(min(hidden, border))
+
+    def unhide(self, position, path) :
+        ID = int(self.nodes[position])
+        occurrences = self.occurrences(ID)
+        self.set_occurrences(ID, np.insert(occurrences, np.searchsorted(occurrences, position), position))
+        self.hidden_weights[ID] -= self.weights[path]
+
+    #output : the index of the path of each of these positions
+    def path_of(self, positions):
+        return np.searchsorted(self.offsets, positions, side = 'right') - 1
+
+    def orientation_at(self, positions):
+        return (self.orientations[positions >> 3] >> (7 - (positions & 7))) & 1
+
+    #input : a contig and one of its ends
+    #output : for each occurrence of the contig, its position, the path and the neighbor of the contig on the side of this end, as seen going out of the contig
+    #         (ID and end of the neighbor by which the path enters it). The ID is CANCELLED if the path stops there
+    def neighbors(self, ID, end) :
+
+        positions = self.occurrences(ID)
+        paths = self.path_of(positions)
+        backward = self.orientation_at(positions) != end #the end is on the left of the contig in the path
+        inside = np.where(backward, positions > self.starts[paths], positions < self.ends[paths]-1)
+        neighborPositions = np.where(inside, np.where(backward, positions-1, positions+1), positions)
+        neighbors = np.where(inside, self.nodes[neighborPositions], CANCELLED)
+        neighborEnds = np.where(backward, self.orientation_at(neighborPositions), 1-self.orientation_at(neighborPositions))
+        return positions, paths, neighbors, neighborEnds
+
+    def replace(self, position, contig_before, contig_after) :
+        if self.nodes[position] != contig_before :
+            raise ValueError("ERROR in simple_unzip.py: 9u8u, the path does not go through the contig to replace at position " + str(position))
+        self.nodes[position] = contig_after
+
+    def cancel(self, position, contig) : #remove the contig from the path, if it has not been replaced there. Returns True if it was removed
+        if self.nodes[position] == contig :
+            self.nodes[position] = CANCELLED
+            return True
+        return False
+
+    #output : the number of reads going through the contig
+    def support(self, ID):
+        hidden = self.hidden_weights[ID] if self.hidden_weights is not None and ID < len(self.hidden_weights) else 0
+        return int(self.weights[self.path_of(self.occurrences(ID))].sum() + hidden)
+
 #function to unzip the graph without making any assumptions
 #input: the graph and the gaf file
 #output: an unzipped graph
@@ -123,7 +355,7 @@ def simple_unzip(segments, names, gafFile) :
     old_segments = segments.copy()
 
     #get rid of the links that are not in the gaf file
-    segments = remove_unsupported_links(segments, names, lines)
+    segments = remove_unsupported_links(segments, index_paths(segments, names, lines))
 
     #count the number of dead ends in the graph now
     nbOfDeadEndsNow = 0
@@ -236,9 +468,11 @@ def simple_unzip(segments, names, gafFile) :
                         index_left = -2
                         if p[1] > 0 :
                             contig_left = contigs[p[1]-1]
+                            if contig_left is CANCELLED_CONTIG :
+                                continue
                             end_left = orientations[p[1]-1]
                             index_left = sg.find_this_link(contig_left, end_left, segment.links[1-orientations[p[1]]], segment.otherEndOfLinks[1-orientations[p[1]]])
-                            if index_left == -1 : #could happen if the contig has been deleted from the path (and replaced with dummy contig) because of ambiguities
+                            if index_left == -1 : #should not happen now that the cancelled contigs are skipped, kept as a safeguard
                                 continue
                                 # print("ERROR: From semgent ", segment.names, " ", 1-orientations[p[1]] , ", did not find ", contig_left.names, " ", end_left, " among ", \
                                 #       [(segment.links[1-orientations[p[1]]][i].names, segment.otherEndOfLinks[1-orientations[p[1]]][i]) for i in range(len(segment.links[1-orientations[p[1]]]))], \
@@ -247,12 +481,14 @@ def simple_unzip(segments, names, gafFile) :
                         index_right = -2
                         if p[1] < len(path)-1 :
                             contig_right = contigs[p[1]+1]
+                            if contig_right is CANCELLED_CONTIG :
+                                continue
                             end_right = 1-orientations[p[1]+1]
                             index_right = sg.find_this_link(contig_right, end_right, segment.links[orientations[p[1]]], segment.otherEndOfLinks[orientations[p[1]]])
                             # print("looking for ", contig_right.names, " ", end_right, " ", contig_right.ID, " among ", \
                             #       [(segment.links[orientations[p[1]]][i].names, segment.otherEndOfLinks[orientations[p[1]]][i], segment.ID) for i in range(len(segment.links[orientations[p[1]]]))], \
                             #         " ", path, " ", index_right)
-                            if index_right == -1 : #could happen if the contig has been deleted from the path (and replaced with dummy contig) because of ambiguities
+                            if index_right == -1 : #should not happen now that the cancelled contigs are skipped, kept as a safeguard
                                 continue
 
                         pair = (index_left, index_right)
@@ -403,13 +639,9 @@ def simple_unzip(segments, names, gafFile) :
             
         potentially_interesting_segments = next_potentially_interesting_segments
 
-    delIdx = 0
-    while delIdx < len(segments) :
-        if segments[delIdx] in toDelete :
-            del segments[delIdx]
-            del on_which_paths_is_this_contig[segments[delIdx]]
-        else :
-            delIdx += 1
+    for segment in toDelete :
+        on_which_paths_is_this_contig.pop(segment, None)
+    sg.compact_segments(segments, set([segment.ID for segment in toDelete]))
             
     # print("NOT DETACHING TIPS")
     detach_and_destroy_tips(segments)
@@ -417,38 +649,44 @@ def simple_unzip(segments, names, gafFile) :
     return segments
 
 #function that removes the links that are not supported by any path
-#input : a list of segments and of paths, careful flag (if careful, do not remove links creating dead ends)
-#output : the same list of segments, but with the links that are not supported by any path removed
-def remove_unsupported_links(segments, names, lines, careful=False):
-
-    #inventory of the links in the lines
-    links = set()
-    for line in lines :
-        cont = re.split('[><]' , line[1].rstrip())
-        orientations = "".join(re.findall("[<>]", line[1]))
-        del cont[0] #because the first element is always ''
-        try : #TO BE REMOVE IN FUTURE VERSIONS
-            contigs = [segments[names[i]] for i in cont] 
-        except KeyError :
-            # print([names[i] for i in cont])
-            continue
-
-        for i in range(len(contigs)-1) :
-            links.add((contigs[i], "<>".index(orientations[i]), contigs[i+1], "><".index(orientations[i+1])))
-            links.add((contigs[i+1], "><".index(orientations[i+1]), contigs[i], "<>".index(orientations[i])))
-
-    #remove the links that are not supported by any path
-    toRemove = set()
+#input : the graph and the paths of the reads (PathSet), careful flag (if True, only remove the links between two ends that have other links)
+#output : the graph without the links that no read goes through
+def remove_unsupported_links(segments, paths, careful=False):
+
+    #inventory of the links in the paths: each link is packed in one integer, the smallest end (2*ID + end) in the upper 32 bits
+    nodes = paths.nodes.astype(np.uint64)
+    positions = np.arange(len(paths.nodes), dtype = np.int64)
+    orientations = paths.orientation_at(positions).astype(np.uint64)
+    consecutive = np.ones(max(0, len(positions)-1), dtype = bool)
+    beginnings = paths.offsets[1:-1]
+    consecutive[beginnings[(beginnings > 0) & (beginnings < len(positions))] - 1] = False #do not link the last contig of a path with the first one of the next path
+    consecutive &= (paths.nodes[:-1] != CANCELLED) & (paths.nodes[1:] != CANCELLED)
+    end_leaving = 2*nodes[:-1][consecutive] + orientations[:-1][consecutive]
+    end_entering = 2*nodes[1:][consecutive] + 1 - orientations[1:][consecutive]
+    supported_links = np.unique((np.minimum(end_leaving, end_entering) << np.uint64(32)) | np.maximum(end_leaving, end_entering))
+
+    #inventory of the links in the graph, each link once
+    links = []
+    ends = []
+    degrees = []
     for segment in segments :
         for end in range(2) :
             for n, neighbor in enumerate(segment.links[end]) :
-                if (segment, end, neighbor, segment.otherEndOfLinks[end][n]) not in links :
-                    if not careful or (len(segment.links[end])> 1 and len(neighbor.links[segment.otherEndOfLinks[end][n]]) > 1) :
-                        # print("Removing link ", segment.names, " ", neighbor.names, " ", end, " ", segment.otherEndOfLinks[end][n])
-                        toRemove.add((segment, end, neighbor, segment.otherEndOfLinks[end][n]))
+                otherEnd = segment.otherEndOfLinks[end][n]
+                if 2*segment.ID + end <= 2*neighbor.ID + otherEnd :
+                    links.append((segment, end, neighbor, otherEnd))
+                    ends.append((2*segment.ID + end, 2*neighbor.ID + otherEnd))
+                    degrees.append((len(segment.links[end]), len(neighbor.links[otherEnd])))
+    if len(links) == 0 :
+        return segments
+    ends = np.array(ends, dtype = np.uint64)
+    degrees = np.array(degrees, dtype = np.int64)
 
-    for segment, end, neighbor, otherEnd in toRemove :
-        sg.delete_link(segment, end, neighbor, otherEnd, warning=False)
+    #remove the links that are not supported by any path
+    toRemove = ~np.isin((ends[:,0] << np.uint64(32)) | ends[:,1], supported_links)
+    if careful :
+        toRemove &= (degrees[:,0] > 1) & (degrees[:,1] > 1)
+    sg.remove_links_in_bulk([links[i] for i in np.flatnonzero(toRemove).tolist()])
 
     return segments
 
@@ -462,450 +700,465 @@ def detach_and_destroy_tips(segments):
     max_tip_length = 1000
     contig_to_delete = set()
 
+    extensions = {} #cache of sg.extended_length, emptied when a link is deleted
     for s, seg in enumerate(segments):
         
         for end in range(2) :
 
             if len(seg.links[end]) > 1 : #one of the branch may be a short dead end 
-                dead_end = [True]
-                extended_lengths = [extended_length(seg.links[end][i], seg.otherEndOfLinks[end][i], max_tip_length*10, 5, dead_end) for i in range(len(seg.links[end]))]
-                max_length = max(extended_lengths)
+                extended_lengths = [sg.extended_length(seg.links[end][i], seg.otherEndOfLinks[end][i], max_tip_length*10, 5, extensions) for i in range(len(seg.links[end]))]
+                max_length = max([length for length, dead_end in extended_lengths])
                 toDelete = set()
                 for n in range(len(seg.links[end])) :
-                    if 5*extended_lengths[n] < max_length and max_length > 1000 and seg.links[end][n].length < max_tip_length and dead_end[0] == True : #the branch is a short dead end
+                    length, dead_end = extended_lengths[n]
+                    if 5*length < max_length and max_length > 1000 and seg.links[end][n].length < max_tip_length and dead_end : #the branch is a short dead end
                         toDelete.add((seg, end, seg.links[end][n], seg.otherEndOfLinks[end][n]))
                         contig_to_delete.add(seg.links[end][n].ID)
                 for seg, end, neighbor, otherEnd in toDelete :
                     sg.delete_link(seg, end, neighbor, otherEnd, warning=False)
+                if len(toDelete) > 0 :
+                    extensions = {}
 
     #destroy the contigs that are in contig_to_delete
-    delIdx = 0
-    while delIdx < len(segments) :
-        if segments[delIdx].ID in contig_to_delete :
-            segments[delIdx].cut_all_links()
-            del segments[delIdx]
-        else :
-            delIdx += 1
+    for seg in segments :
+        if seg.ID in contig_to_delete :
+            seg.cut_all_links()
+    sg.compact_segments(segments, contig_to_delete)
 
     return segments
                  
 
-#a function returning the longest path you can get with neighbors of neighbors of neighbors of... (up to threshold) 
-def extended_length(segment, end, thresholdLength, thresholdContigs, dead_end) :
-        
-    if thresholdContigs == 0 or thresholdLength <= 0 :
-        dead_end = [False]
-        return segment.length
-        
-    #start by looking down the longest contig, it will be fastest
-    longestContig = [i for i in range(len(segment.links[1-end]))]
-    longestContig.sort(key= lambda x : segment.links[1-end][x].length, reverse = True)
-    
-    #print("Longest contigs : ", longestContig, [segment.links[1-end][i].length for i in longestContig])
-    
-    maxLength = 0
-    for n in longestContig :
-        neighbor = segment.links[1-end][n]
-        l = extended_length(neighbor, segment.otherEndOfLinks[1-end][n], thresholdLength-segment.length, thresholdContigs-1, dead_end)
-        if l > maxLength :
-            maxLength = l
-        
-    return maxLength + segment.length
-
-def create_paths_parallel(paths, lines, line_begin, line_end, segments, names, lock):
+#output : the paths of the reads of these lines, as (name of the read, IDs of the contigs, orientations), split where two consecutive contigs are not linked
+def create_paths_parallel(lines, line_begin, line_end, segments, names):
 
     paths_to_append = []
     for l in range(line_begin, min(line_end, len(lines))) :
         line = lines[l]
         cont = re.split('[><]' , line[1].rstrip())
-        orientations = "".join(re.findall("[<>]", line[1]))
+        orientations = [int(i == '>') for i in re.findall("[<>]", line[1])]
         del cont[0] #because the first element is always ''
         contigs = [segments[names[i]] for i in cont] 
 
-        p = Path(contigs, orientations, line[0])
-
-        paths_to_append += [i for i in p.split_if_invalid()]
-
-    with lock:
-        paths.extend(paths_to_append)
-
-def process_chunk_of_segments(segments, beginning, end, on_which_paths_is_this_contig, paths, potentially_interesting_segments, unexplored_segments, next_potentially_interesting_segments, toDelete, lock):
-    
-    if beginning % 100000 == 0 :
-        print("processing ", beginning, " ", end)
+        last_index = 0
+        for c in range(len(contigs)-1) :
+            if not contigs[c].has_link(orientations[c], contigs[c+1], 1-orientations[c+1]) :
+                paths_to_append.append((line[0], [contig.ID for contig in contigs[last_index:c+1]], orientations[last_index:c+1]))
+                last_index = c+1
+        paths_to_append.append((line[0], [contig.ID for contig in contigs[last_index:]], orientations[last_index:]))
 
-    go_on = False
-    for s in range(beginning, min(len(segments), end)):
-        segment = segments[s]
+    return paths_to_append
 
-        if segment not in potentially_interesting_segments :
-            continue
-        # print("Looking icizzcce at segment : ", segment.names, " ", len(segment.links[0]), " ", len(segment.links[1]), " ", round, " ", len(potentially_interesting_segments))
-        #see if it should be duplicated
+#input : the graph and the lines of the GAF
+#output : the paths of the reads in the graph (PathSet)
+def index_paths(segments, names, lines, num_threads = 1) :
 
-        #measure the time now
-        time_start = timer()
+    paths = PathSet(segments)
+    size_of_chunks = 1000
+    beginnings = range(0, len(lines), size_of_chunks)
+    ends = range(size_of_chunks, len(lines)+size_of_chunks, size_of_chunks)
 
-        if (len(segment.links[0]) > 1 or len(segment.links[1]) > 1) : # and "953518" in segment.names : 
-
-            # print("Looking at segment ", segment.names, " ", len(segment.links[0]), " ", len(segment.links[1]))
-            left_dilemma = (segment, 0)
-            right_dilemma = (segment, 1)
-            locked_nodes = set()
-            already_locked = False
-
-            with lock:
-
-                if segment.locked == False:
-                    locked_nodes.add(segment)
-                else:
-                    already_locked = True
-
-                if len(segment.links[0]) == 1:
-                    neighbor_contig = segment.links[0][0]
-                    neighbor_end = 1-segment.otherEndOfLinks[0][0]
-                    if neighbor_contig.locked == False :
-                        locked_nodes.add(neighbor_contig)
-                    else :
-                        already_locked = True
-                    while len(neighbor_contig.links[neighbor_end]) == 1 and len(neighbor_contig.links[neighbor_end][0].links[neighbor_contig.otherEndOfLinks[neighbor_end][0]]) == 1 and neighbor_contig != segment :
-                        neighbor_contig, neighbor_end = neighbor_contig.links[neighbor_end][0], 1-neighbor_contig.otherEndOfLinks[neighbor_end][0]
-                        if neighbor_contig.locked == False :
-                            locked_nodes.add(neighbor_contig)
-                        else :
-                            already_locked = True
-
-                    if len(neighbor_contig.links[neighbor_end]) <= 1 : #we end up in a circle or a dead end
-                        for s in locked_nodes :
-                            s.locked = False
-                        continue
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # Use the executor to map your function over the data, and gather the paths in the order of the GAF
+        number_of_paths = 0
+        for paths_of_chunk in executor.map(create_paths_parallel, [lines]*len(ends), beginnings, ends, [segments] * len(ends), [names] * len(ends)) :
+            for read_name, contigs, orientations in paths_of_chunk :
+                paths.add_path(contigs, orientations, read_name)
+            number_of_paths += len(paths_of_chunk)
+
+    #reads following exactly the same path are stored as one path weighted by the number of reads
+    paths.freeze()
+    print("All the paths are indexed: ", number_of_paths, " paths, of which ", len(paths), " are distinct")
+
+    return paths
+
+
+#input : the paths of some occurrences, in the order of the occurrences, and which of them to consider
+#output : the paths on which an occurrence is considered (sorted), the index of the last occurrence considered on each of them and of the first one
+def last_occurrence_on_each_path(paths_of_occurrences, considered) :
+
+    indices = np.flatnonzero(considered)
+    unique_paths, first = np.unique(paths_of_occurrences[indices], return_index = True)
+    last_in_reverse = np.unique(paths_of_occurrences[indices][::-1], return_index = True)[1]
+    return unique_paths, indices[len(indices) - 1 - last_in_reverse], indices[first]
+
+#input : a segment and the paths (PathSet)
+#output : what simple_unzip2 should do with the segment, decided without modifying anything (so that it can be decided in a worker process):
+#         None if nothing, 'locked' if a contig around its dilemmas is locked, else a dict with the pairs of links along which to duplicate it.
+#         Also outputs the IDs of all the contigs looked at: the decision stays valid as long as none of them is modified
+def evaluate_segment(segment, paths):
+
+    read = set([segment.ID])
+    if not (len(segment.links[0]) > 1 or len(segment.links[1]) > 1) :
+        return None, read
+
+    #a dilemma is the first end with several links found going left and right of the segment, through contigs with one link on each side
+    dilemmas = [(segment, 0), (segment, 1)]
+    around = [segment] #the contigs around the dilemmas, that must not be locked
+    for end in range(2) :
+        if len(segment.links[end]) == 1:
+            neighbor_contig = segment.links[end][0]
+            neighbor_end = 1-segment.otherEndOfLinks[end][0]
+            around.append(neighbor_contig)
+            read.add(neighbor_contig.ID)
+            while len(neighbor_contig.links[neighbor_end]) == 1 and neighbor_contig != segment :
+                next_contig = neighbor_contig.links[neighbor_end][0]
+                next_end = neighbor_contig.otherEndOfLinks[neighbor_end][0]
+                read.add(next_contig.ID)
+                if len(next_contig.links[next_end]) != 1 :
+                    break
+                neighbor_contig, neighbor_end = next_contig, 1-next_end
+                around.append(neighbor_contig)
+
+            if len(neighbor_contig.links[neighbor_end]) <= 1 : #we end up in a circle or a dead end
+                return None, read
+
+            dilemmas[end] = (neighbor_contig, neighbor_end)
+            for neighbor in neighbor_contig.links[neighbor_end]:
+                around.append(neighbor)
+                read.add(neighbor.ID)
+    left_dilemma, right_dilemma = dilemmas
+
+    #if a contig is locked, leave this segment for later
+    if any([contig.locked for contig in around]) :
+        return 'locked', read
+
+    #list the paths going through the contigs, with the neighbors of the dilemmas on them
+    positions_left, paths_left, neighbors_left, ends_left = paths.neighbors(left_dilemma[0].ID, left_dilemma[1])
+    positions_right, paths_right, neighbors_right, ends_right = paths.neighbors(right_dilemma[0].ID, right_dilemma[1])
+    valid_left = neighbors_left != CANCELLED
+    valid_right = neighbors_right != CANCELLED
+    read.update(neighbors_left[valid_left].tolist())
+    read.update(neighbors_right[valid_right].tolist())
+
+    #on each path, the neighbors are read on the last occurrence of the dilemma where they are known
+    left_paths, last_left, first_left = last_occurrence_on_each_path(paths_left, valid_left)
+    right_paths, last_right = last_occurrence_on_each_path(paths_right, valid_right)[:2]
+
+    #join the two sides on the paths, in the order in which the paths are first met on the left
+    common_paths, in_left, in_right = np.intersect1d(left_paths, right_paths, assume_unique = True, return_indices = True)
+    order = np.argsort(first_left[in_left], kind = 'stable')
+    common_paths, last_left, last_right = common_paths[order], last_left[in_left[order]], last_right[in_right[order]]
+    if right_dilemma[0] == segment :
+        positions_of_the_segment = positions_right[last_right]
+    else :
+        all_left_paths, last_any_left = last_occurrence_on_each_path(paths_left, np.ones(len(paths_left), dtype = bool))[:2]
+        positions_of_the_segment = positions_left[last_any_left[np.searchsorted(all_left_paths, common_paths)]]
+
+    #now count all the different combinations of neighbors, each packed in one integer, in the order in which they are first met
+    keys = ((2*neighbors_left[last_left] + ends_left[last_left]).astype(np.uint64) << np.uint64(32)) | (2*neighbors_right[last_right] + ends_right[last_right]).astype(np.uint64)
+    unique_keys, first_pair, pair_of_path = np.unique(keys, return_index = True, return_inverse = True)
+    pair_of_path = pair_of_path.reshape(-1)
+    supports = np.bincount(pair_of_path, weights = paths.weights[common_paths], minlength = len(unique_keys)) #the paths are deduplicated: count all the reads following them
+    paths_by_pair = np.argsort(pair_of_path, kind = 'stable')
+    start_of_pair = np.concatenate(([0], np.cumsum(np.bincount(pair_of_path, minlength = len(unique_keys)))))
+    pairs = {}
+    pair_to_paths = {}
+    for u in np.argsort(first_pair).tolist() :
+        key = int(unique_keys[u])
+        pair = ((key >> 33, (key >> 32) & 1), ((key & 0xFFFFFFFF) >> 1, key & 1))
+        pairs[pair] = int(supports[u])
+        pair_to_paths[pair] = positions_of_the_segment[paths_by_pair[start_of_pair[u]:start_of_pair[u+1]]].tolist()
+
+    #now mark as duplicable only if a) all the links are supported by the reads and b) on one side at least this does not involve duplicating a neighbor
+    links_to_confirm_left = [False for i in range(len(left_dilemma[0].links[left_dilemma[1]]))]
+    links_to_confirm_right = [False for i in range(len(right_dilemma[0].links[right_dilemma[1]]))]
+    pairs_final = {}
+    pair_to_pair_indices = {}
+    pairs_keys_sorted = sorted(pairs.keys(), key = lambda x : pairs[x], reverse = True)
+    #compute the smallest pair, to then judge if a pair is strong enough to confirm a link
+    smallest_pair = 0
+    if len(pairs) == len(links_to_confirm_left)*len(links_to_confirm_right) and len(pairs) > 0 :
+        smallest_pair = min(pairs.values())
+    for pair in pairs_keys_sorted :
+
+        if pairs[pair] >= 2 :
+
+            #a pair going through a link absent from the graph cannot be confirmed: skip it rather than confirming another link (should not happen: the cancelled contigs are not counted in the pairs)
+            index_left = sg.find_this_link(paths.segment(pair[0][0]), pair[0][1], left_dilemma[0].links[left_dilemma[1]], left_dilemma[0].otherEndOfLinks[left_dilemma[1]])
+            index_right = sg.find_this_link(paths.segment(pair[1][0]), pair[1][1], right_dilemma[0].links[right_dilemma[1]], right_dilemma[0].otherEndOfLinks[right_dilemma[1]])
+            if index_left == -1 or index_right == -1 :
+                continue
 
-                    left_dilemma = (neighbor_contig, neighbor_end)
-                    for neighbor in neighbor_contig.links[neighbor_end]:
-                        if neighbor.locked == False :
-                            locked_nodes.add(neighbor)
-                        else :
-                            already_locked = True
-
-                if len(segment.links[1]) == 1:
-                    neighbor_contig = segment.links[1][0]
-                    neighbor_end = 1-segment.otherEndOfLinks[1][0]
-                    if neighbor_contig.locked == False :
-                        locked_nodes.add(neighbor_contig)
-                    else :
-                        already_locked = True
-
-                    while len(neighbor_contig.links[neighbor_end]) == 1 and len(neighbor_contig.links[neighbor_end][0].links[neighbor_contig.otherEndOfLinks[neighbor_end][0]]) == 1 and neighbor_contig != segment :
-                        neighbor_contig, neighbor_end = neighbor_contig.links[neighbor_end][0], 1-neighbor_contig.otherEndOfLinks[neighbor_end][0]
-                        if neighbor_contig.locked == False :
-                            locked_nodes.add(neighbor_contig)
-                        else :
-                            already_locked = True
-                    if len(neighbor_contig.links[neighbor_end]) <= 1 : #we end up in a circle or a dead end
-                        for s in locked_nodes :
-                            s.locked = False
-                        continue
-                    right_dilemma = (neighbor_contig, neighbor_end)
-                    for neighbor in neighbor_contig.links[neighbor_end]:
-                        if neighbor.locked == False :
-                            locked_nodes.add(neighbor)
-                        else :
-                            already_locked = True
-
-                #if already_locked, ignore this segment this time and move on to the next one
-                if already_locked:                
-                    with lock :
-                        unexplored_segments.add(segment) #unexplored segments will be processed at the end of the loop in a non-parallelized part
-                    go_on = True
-                    continue
+            #confirm the link if it confirms something yet unseen or if it is a strong link
+            if not links_to_confirm_left[index_left] or not links_to_confirm_right[index_right] or pairs[pair] >= smallest_pair*3 + 5 :
 
-                else:
-                    for s in locked_nodes :
-                        s.locked = True
-            
-        
-            #list the paths going through the contigs
-            reads_through_left = {}
-            pair_to_paths = {}
-            index_of_the_segment_on_the_paths = {}
-            for p in on_which_paths_is_this_contig[left_dilemma[0]] :
-                path_contigs = paths[p[0]].get_contigs()
-                path_orientations = paths[p[0]].get_orientations()
-                
-                if (path_orientations[p[1]] == 1 and left_dilemma[1] == 0) or (path_orientations[p[1]] == 0 and left_dilemma[1] == 1) : 
-                    if p[1] != 0 and path_contigs[p[1]-1].full_name() != "dummy" :
-                        neighbor = path_contigs[p[1]-1]
-                        neighbor_orientation = path_orientations[p[1]-1]
-                        reads_through_left[p[0]] = (neighbor, neighbor_orientation)
-                else :
-                    if p[1] != len(path_contigs)-1 and path_contigs[p[1]+1].full_name() != "dummy" :
-                        neighbor = path_contigs[p[1]+1]
-                        neighbor_orientation = path_orientations[p[1]+1]
-                        reads_through_left[p[0]] = (neighbor, 1-neighbor_orientation)
-
-                if left_dilemma[0] == segment :
-                    index_of_the_segment_on_the_paths[p[0]] = p[1]
-
-            reads_through_right = {}
-            for p in on_which_paths_is_this_contig[right_dilemma[0]] :
-                path_contigs = paths[p[0]].get_contigs()
-                path_orientations = paths[p[0]].get_orientations()
-                
-                if (path_orientations[p[1]] == 1 and right_dilemma[1] == 0) or (path_orientations[p[1]] == 0 and right_dilemma[1] == 1) :
-                    if p[1] == 0 or path_contigs[p[1]-1].full_name() == "dummy":
-                        for s in locked_nodes:
-                            s.locked = False
-                        continue
-                    neighbor = path_contigs[p[1]-1]
-                    neighbor_orientation = path_orientations[p[1]-1]
-                    reads_through_right[p[0]] = (neighbor, neighbor_orientation)
+                links_to_confirm_left[index_left] = True
+                links_to_confirm_right[index_right] = True
 
+                pairs_final[pair] = pairs[pair]
+                if left_dilemma[0] != segment:
+                    pair_to_pair_indices[pair] = (0, index_right)
+                elif right_dilemma[0] != segment:
+                    pair_to_pair_indices[pair] = (index_left, 0)
                 else :
-                    if p[1] == len(path_contigs)-1 or path_contigs[p[1]+1].full_name() == "dummy":
-                        for s in locked_nodes:
-                            s.locked = False
-                        continue
-                    neighbor = path_contigs[p[1]+1]
-                    neighbor_orientation = path_orientations[p[1]+1]
-                    reads_through_right[p[0]] = (neighbor, 1-neighbor_orientation)
-
-                if right_dilemma[0] == segment :
-                    index_of_the_segment_on_the_paths[p[0]] = p[1]
-
-            # if "edge_17_59599_162874_0_103275_0_103275@0_72000_0" in segment.names :
-            #     print("here are all the reads going right ", [i for i in reads_through_right.keys()])
-
-            #now see the reads in common in the two dict and and count all the different combinations of segment
-            pairs = {}
-            for path_here in reads_through_left.keys() :
-                if path_here in reads_through_right :
-                    pair = (reads_through_left[path_here], reads_through_right[path_here])
-                    if pair not in pairs :
-                        pairs[pair] = 0
-                        pair_to_paths[pair] = []
-                    pairs[pair] += 1
-                    pair_to_paths[pair].append((path_here, index_of_the_segment_on_the_paths[path_here]))
-
-            # if "edge_17_59599_162874_0_103275_0_103275@0_72000_0" in segment.names :
-            #     print("here are all the pairs qs ", pairs)
-
-            #now mark as duplicable only if a) all the links are supported by the reads and b) on one side at least this does not involve duplicating a neighbor
-            links_to_confirm_left = [False for i in range(len(left_dilemma[0].links[left_dilemma[1]]))]
-            links_to_confirm_right = [False for i in range(len(right_dilemma[0].links[right_dilemma[1]]))]
-            pairs_final = {}
-            pair_to_pair_indices = {}
-            pairs_keys_sorted = sorted(pairs.keys(), key = lambda x : pairs[x], reverse = True)
-            #compute the smallest pair, to then judge if a pair is strong enough to confirm a link
-            smallest_pair = 0
-            if len(pairs) == len(links_to_confirm_left)*len(links_to_confirm_right) and len(pairs) > 0 :
-                smallest_pair = min(pairs.values())
-            for pair in pairs_keys_sorted :
-                # if "edge_65_0_148158_0_148158@0_148000_0" in segment.names :
-                #     print("pair ", pair, " ", pairs[pair])
-
-                if pairs[pair] >= 2 :
-
-                    index_left = sg.find_this_link(pair[0][0], pair[0][1], left_dilemma[0].links[left_dilemma[1]], left_dilemma[0].otherEndOfLinks[left_dilemma[1]])
-                    if index_left == -1 : #could happen if the contig has been deleted from the path (and replaced with dummy contig) because of ambiguities
-                        print("weiiidred, debug code 910")
-                        # sys.exit()
-
-                    index_right = sg.find_this_link(pair[1][0], pair[1][1], right_dilemma[0].links[right_dilemma[1]], right_dilemma[0].otherEndOfLinks[right_dilemma[1]])
-                    if index_right == -1 : #could happen if the contig has been deleted from the path (and replaced with dummy contig) because of ambiguities
-                        print ("weiiidred, debug code 915")
-                        # sys.exit()
-
-                    #confirm the link if it confirms something yet unseen or if it is a strong link
-                    # if "edge_17_59599_162874_0_103275_0_103275@0_76000_0" in segment.names :
-                    #     print("thinking about confirming ", pair, " ", pairs[pair], " ", smallest_pair*3 + 5)
-                    if not links_to_confirm_left[index_left] or not links_to_confirm_right[index_right] or pairs[pair] >= smallest_pair*3 + 5 :
-
-                        links_to_confirm_left[index_left] = True
-                        links_to_confirm_right[index_right] = True
-
-                        pairs_final[pair] = pairs[pair]
-                        if left_dilemma[0] != segment:
-                            pair_to_pair_indices[pair] = (0, index_right)
-                        elif right_dilemma[0] != segment:
-                            pair_to_pair_indices[pair] = (index_left, 0)
-                        else :
-                            pair_to_pair_indices[pair] = (index_left, index_right)
-
-            segment_to_duplicate = False
-            if (all([i for i in links_to_confirm_left]) or (left_dilemma[0] != segment and np.sum(links_to_confirm_left) >= np.sum(links_to_confirm_right)) )\
-                and (all([i for i in links_to_confirm_right]) or (right_dilemma[0] != segment and np.sum(links_to_confirm_right) >= np.sum(links_to_confirm_left))) \
-                and (len(pairs_final) <= len(left_dilemma[0].links[left_dilemma[1]]) and left_dilemma[0]==segment or  len(pairs_final) <= len(right_dilemma[0].links[right_dilemma[1]]) and right_dilemma[0]==segment) :
-                segment_to_duplicate = True
-
-            # if "edge_18_365892_437244_0_71352_0_71352@0_30000_1" in segment.names :
-            #     print(links_to_confirm_left, " ", links_to_confirm_right, " ", pairs_final)
-            #     print("duplicated or not because of : ", segment_to_duplicate, " ", [i for i in links_to_confirm_left], " ", [i for i in links_to_confirm_right], " ", (len(pairs_final) <= len(left_dilemma[0].links[left_dilemma[1]]) and left_dilemma[0]==segment or  len(pairs_final) <= len(right_dilemma[0].links[right_dilemma[1]]) and right_dilemma[0]==segment) )
-            #     print("dilemmas: ", left_dilemma[0].names, " ", left_dilemma[1], " ", right_dilemma[0].names, " ", right_dilemma[1])
-            #     print("Looking at segment ", segment.names, " ", len(segment.links[0]), " ", len(segment.links[1]), " ", [str(i[0][0].ID)+" "+str(i[1][0].ID) for i in pairs.keys()])
-            #     print(" ", segment_to_duplicate, " ; ", pair_to_pair_indices)
-
-            time_after_pairs = timer()
-
-            if segment_to_duplicate :#and segment.names == ['NC_038882.1_9000_0'] :
-
-                # if "edge_18_48541_149954_0_101413_0_101413@0_98000_1" in segment.names :
-                #     print("duplicaaaating ", segment.names)
+                    pair_to_pair_indices[pair] = (index_left, index_right)
+
+    segment_to_duplicate = False
+    if (all([i for i in links_to_confirm_left]) or (left_dilemma[0] != segment and np.sum(links_to_confirm_left) >= np.sum(links_to_confirm_right)) )\
+        and (all([i for i in links_to_confirm_right]) or (right_dilemma[0] != segment and np.sum(links_to_confirm_right) >= np.sum(links_to_confirm_left))) \
+        and (len(pairs_final) <= len(left_dilemma[0].links[left_dilemma[1]]) and left_dilemma[0]==segment or  len(pairs_final) <= len(right_dilemma[0].links[right_dilemma[1]]) and right_dilemma[0]==segment) :
+        segment_to_duplicate = True
+
+    #the decision only refers to the links of the segment and to the paths by their indices, so that it can be sent back from a worker process
+    duplications = [(pairs[pair], pair_to_pair_indices[pair], pair_to_paths[pair]) for pair in pairs_final]
+    return {'duplicate' : segment_to_duplicate, 'total_coverage' : sum(pairs.values()), 'duplications' : duplications}, read
+
+#input : a segment and the decision of evaluate_segment to duplicate it
+#output : the segment replaced by one copy per pair of links supported by the reads, the paths following the copies. Returns the number of positions of paths cancelled
+def duplicate_segment(segment, decision, segments, paths, next_potentially_interesting_segments, toDelete):
+
+    if len(decision['duplications']) == 0 :
+        raise ValueError("ERROR in simple_unzip.py: trying to duplicate " + str(segment.names) + " without any pair of links supported by the reads")
+
+    #mark all the neighbors of the segment as potentially interesting
+    for neighbor in segment.links[0] :
+        next_potentially_interesting_segments.add(neighbor)
+    for neighbor in segment.links[1] :
+        next_potentially_interesting_segments.add(neighbor)
+
+    totalCoverage = decision['total_coverage']
+    for support, pair_indices, pair_paths in decision['duplications'] :
+
+        #create a new segment
+        new_coverages = [support/totalCoverage*segment.depth for i in range(len(segment.names)) ]
+        new_segment = sg.Segment(segment.names, segment.orientations, segment.lengths, segInsideCIGARs=segment.insideCIGARs, readCoverage=new_coverages)
+        if pair_indices[0] >= 0 :
+            sg.add_link(segment.links[0][pair_indices[0]], segment.otherEndOfLinks[0][pair_indices[0]], new_segment, 0, CIGAR = segment.CIGARs[0][pair_indices[0]])
+        if pair_indices[1] >= 0 :
+            sg.add_link(segment.links[1][pair_indices[1]], segment.otherEndOfLinks[1][pair_indices[1]], new_segment, 1, CIGAR = segment.CIGARs[1][pair_indices[1]])
+
+        for position in pair_paths :
+            paths.replace(position, segment.ID, new_segment.ID)
+
+        paths.add_segment(new_segment)
+        paths.set_occurrences(new_segment.ID, pair_paths)
+
+        segments.append(new_segment)
+        next_potentially_interesting_segments.add(new_segment)
+
+    cancelled = 0
+    positions = paths.occurrences(segment.ID).tolist()
+    for position in positions :
+        cancelled += paths.cancel(position, segment.ID)
+    segment.cut_all_links()
+    next_potentially_interesting_segments.discard(segment)
+    paths.delete_segment(segment.ID)
+    for position in positions : #the new links may create branch points next to the hidden parts of the paths
+        paths.expand_window(position)
+    toDelete.add(segment)
+
+    return cancelled
+
+MIN_SEGMENTS_PER_PROCESS = 500 #below this number of segments to evaluate per process, forking the processes costs more than it saves
+_graph_of_the_workers = None #(segments, paths), inherited by the worker processes when they are forked
+
+def evaluate_segments_in_worker(indices):
+
+    segments, paths = _graph_of_the_workers
+    return [(segments[i].ID, evaluate_segment(segments[i], paths)) for i in indices]
+
+#input : the segments to evaluate (indices in segments), the graph and the paths, a number of processes
+#output : the decisions of evaluate_segment for these segments, indexed by segment ID, computed by worker processes forked with a read-only copy of the graph
+def evaluate_segments_in_parallel(segments, indices, paths, num_processes):
+
+    global _graph_of_the_workers
+    if num_processes <= 1 or len(indices) < 2*MIN_SEGMENTS_PER_PROCESS or 'fork' not in multiprocessing.get_all_start_methods() :
+        return {}
+
+    _graph_of_the_workers = (segments, paths)
+    size_of_chunks = max(MIN_SEGMENTS_PER_PROCESS, len(indices) // (4*num_processes) + 1)
+    chunks = [indices[i:i+size_of_chunks] for i in range(0, len(indices), size_of_chunks)]
+    decisions = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers = num_processes, mp_context = multiprocessing.get_context('fork')) as executor :
+        for result in executor.map(evaluate_segments_in_worker, chunks) :
+            for ID, decision in result :
+                decisions[ID] = decision
+    _graph_of_the_workers = None
+
+    return decisions
+
+UNZIP_ORDERS = ["graph", "support"]
+
+#input : the graph, the segments to look at, the position of each segment in the list of segments, the paths and an order among UNZIP_ORDERS
+#output : the positions of the segments to look at, in the order of the list of segments ('graph') or from the most supported by the reads to the least ('support')
+def order_worklist(segments, worklist, position_of, paths, order) :
+
+    positions = sorted([position_of[segment.ID] for segment in worklist])
+    if order == "support" :
+        support = {p : paths.support(segments[p].ID) for p in positions}
+        positions.sort(key = lambda p : -support[p]) #stable: the ties stay in the order of the graph
+    return positions
+
+#input : the graph, the paths, the positions of the segments to look at (the worklist, ordered), the position of each segment in the list of segments
+#output : the segments that can be duplicated following the paths of the reads duplicated, in the order of the worklist, True if something changed.
+#         The telemetry of the round is updated with the number of segments visited, duplicated, locked, of copies created and of positions of paths cancelled.
+#         With several processes, all the segments are first evaluated in parallel on the graph as it is at the beginning of the round. The segments are then
+#         handled one by one in order, as with one process: a decision is used only if none of the contigs it looked at was modified by a previous duplication,
+#         otherwise the segment is evaluated again. The result is thus exactly the same whatever the number of processes
+def process_worklist(segments, paths, worklist, position_of, unexplored_segments, next_potentially_interesting_segments, toDelete, telemetry, num_processes = 1):
+
+    decisions = evaluate_segments_in_parallel(segments, worklist, paths, num_processes)
 
-                if len(pairs_final) == 0 :
-                    print("BUT WHY ", segment.names, " ", pairs, " ", [(segment.links[0][i[0]].names, segment.links[1][i[1]].names) for i in pairs])
-                    sys.exit()
-
-                #mark all the neighbors of the segment as potentially interesting
-                with lock:
-                    for neighbor in segment.links[0] :
-                        next_potentially_interesting_segments.add(neighbor)
-                    for neighbor in segment.links[1] :
-                        next_potentially_interesting_segments.add(neighbor)
-
-                totalCoverage = np.sum(p for p in pairs.values())
-                for pair in pairs_final.keys() :
-
-                    # if heeere :
-                    #     print("On contig ", segment.names, " a pair is ", segment.links[0][pair[0]].names, " ", segment.links[1][pair[1]].names, " ", pairs[pair], " ", pair )
-                    pair_indices = pair_to_pair_indices[pair]
-                    # print("pair indices: ", pair_indices)
-
-                    #create a new segment
-                    new_coverages = [pairs[pair]/totalCoverage*segment.depth for i in range(len(segment.names)) ]
-                    with lock : 
-                        new_segment = sg.Segment(segment.names, segment.orientations, segment.lengths, segInsideCIGARs=segment.insideCIGARs, readCoverage=new_coverages)
-                        if pair_indices[0] >= 0 :
-                            sg.add_link(segment.links[0][pair_indices[0]], segment.otherEndOfLinks[0][pair_indices[0]], new_segment, 0, CIGAR = segment.CIGARs[0][pair_indices[0]])
-                        if pair_indices[1] >= 0 :
-                            sg.add_link(segment.links[1][pair_indices[1]], segment.otherEndOfLinks[1][pair_indices[1]], new_segment, 1, CIGAR = segment.CIGARs[1][pair_indices[1]])
-
-                        # print("Pair to duplicate : ", pair, " ", pair_to_paths[pair])
-                        for pa in pair_to_paths[pair] :
-                            # if pa[0] == 6 :
-                            #     print("1055 is heer e ", paths[pa[0]], " ", segment.ID, " ", new_segment.ID, " ", [i.ID for i in paths[pa[0]].get_contigs()])
-                            paths[pa[0]].replace(segment, new_segment, pa[1])
+    go_on = False
+    modified = set() #IDs of the contigs modified since the parallel evaluation
+    for s in worklist :
+        segment = segments[s]
+        if segment in toDelete :
+            continue
+        telemetry['visited'] += 1
 
-                        on_which_paths_is_this_contig[new_segment] = pair_to_paths[pair]
+        if segment.ID in decisions and modified.isdisjoint(decisions[segment.ID][1]) :
+            decision = decisions[segment.ID][0]
+        else :
+            decision = evaluate_segment(segment, paths)[0]
 
-                        segments.append(new_segment)
-                        next_potentially_interesting_segments.add(new_segment)
-                        potentially_interesting_segments.add(new_segment)
+        if decision is None :
+            continue
 
-                pa = 0
-                for p in on_which_paths_is_this_contig[segment] :
-                    # if all([p not in pair_to_paths[pair] for pair in pairs_final.keys()]) : #if the path has not updated just above, it means it does not fit any pair, cancel it
-                    path = paths[p[0]]
-                    with lock:
-                        path.cancel(segment)
-                    pa += 1
-                with lock:
-                    segment.cut_all_links()
-                    next_potentially_interesting_segments.discard(segment)
-                    on_which_paths_is_this_contig[segment] = []
-                    toDelete.add(segment)
-                        # sys.exit(1)
-                    go_on = True
+        if decision == 'locked' : #ignore this segment this time and move on to the next one
+            unexplored_segments.add(segment) #unexplored segments will be processed at the end of the round
+            telemetry['locked'] += 1
+            go_on = True
+            continue
 
-            for s in locked_nodes:
-                s.locked = False
+        if decision['duplicate'] :
+            modified.add(segment.ID)
+            modified.update([neighbor.ID for neighbor in segment.links[0]])
+            modified.update([neighbor.ID for neighbor in segment.links[1]])
+            number_of_segments = len(segments)
+            telemetry['cancelled'] += duplicate_segment(segment, decision, segments, paths, next_potentially_interesting_segments, toDelete)
+            for p in range(number_of_segments, len(segments)) :
+                position_of[segments[p].ID] = p
+            telemetry['duplicated'] += 1
+            telemetry['copies'] += len(segments) - number_of_segments
+            go_on = True
                 
     return go_on
     
 
+CHECKPOINT_INTERVAL = 1800 #default number of seconds between two checkpoints of simple_unzip2
+
+#input : the file, the graph, the paths, the segments to look at in the next round, the contigs deleted and the number of the last round done
+#output : a snapshot of the graph (see export_snapshot) holding the state of simple_unzip2, from which it can resume. The segments are written in the order
+#         of their IDs, so that their links are sorted the same way once loaded, and the positions of the paths refer to them by their rank in the snapshot.
+#         The file is replaced only once completely written, so that a crash while writing keeps the previous checkpoint
+def export_unzip_checkpoint(file, segments, names, paths, potentially_interesting_segments, toDelete, round_number) :
+
+    alive = [segment for segment in segments if segment not in toDelete]
+    snapshot_order = sorted(range(len(alive)), key = lambda s : alive[s].ID)
+    rank = np.zeros(len(alive), dtype = np.int64)
+    rank[snapshot_order] = np.arange(len(alive))
+    IDs = np.array([alive[s].ID for s in snapshot_order], dtype = np.int64)
+    rank_of_ID = np.full(max(paths.segment_of_ID.keys(), default = -1) + 1, CANCELLED, dtype = np.int64) #the contigs deleted are cancelled on the paths
+    rank_of_ID[IDs] = np.arange(len(alive))
+    hidden_weights = np.zeros(len(alive), dtype = np.int64)
+    if paths.hidden_weights is not None :
+        known = IDs < len(paths.hidden_weights)
+        hidden_weights[known] = paths.hidden_weights[IDs[known]]
+
+    position_of = {segment.ID : s for s, segment in enumerate(alive)}
+    state = {'round' : np.array(round_number), 'list_order' : np.array(snapshot_order, dtype = np.int64), \
+             'interesting' : np.array(sorted([rank[position_of[segment.ID]] for segment in potentially_interesting_segments if segment.ID in position_of]), dtype = np.int64), \
+             'nodes' : np.where(paths.nodes != CANCELLED, rank_of_ID[np.maximum(paths.nodes, 0)], CANCELLED), 'orientations' : paths.orientations, \
+             'offsets' : paths.offsets, 'weights' : paths.weights, 'starts' : paths.starts, 'ends' : paths.ends, 'hidden_weights' : hidden_weights}
+    export_snapshot([alive[s] for s in snapshot_order], names, "loaded", file + ".tmp", state)
+    os.replace(file + ".tmp", file)
+
+#input : the graph loaded from a checkpoint written by export_unzip_checkpoint, in the order of the snapshot, and the state saved with it
+#output : the graph in the order of the list of segments of simple_unzip2, the paths, the segments to look at in the next round and the number of the last round done
+def load_unzip_checkpoint(segments, state) :
+
+    IDs = np.array([segment.ID for segment in segments], dtype = np.int64)
+    paths = PathSet(segments)
+    paths.nodes = np.where(state['nodes'] != CANCELLED, IDs[np.maximum(state['nodes'], 0)], CANCELLED).astype(np.int32)
+    paths.orientations = state['orientations']
+    paths.offsets = state['offsets']
+    paths.weights = state['weights']
+    paths.starts = state['starts']
+    paths.ends = state['ends']
+    paths.hidden_weights = np.zeros(IDs.max(initial = -1) + 1, dtype = np.int64)
+    paths.hidden_weights[IDs] = state['hidden_weights']
+    paths.build_index()
+
+    potentially_interesting_segments = set([segments[s] for s in state['interesting'].tolist()])
+    return [segments[s] for s in state['list_order'].tolist()], paths, potentially_interesting_segments, int(state['round'])
+
 #function to unzip the graph without making any assumptions
-#input: the graph and the gaf file, exhaustive flag (if True, remove all the links that are not supported by the gaf file)
+#input: the graph and the gaf file, exhaustive flag (if True, remove all the links that are not supported by the gaf file), order in which to look at the segments
+#       in each round (among UNZIP_ORDERS), optionally a list in which to append the telemetry of each round, trim flag (if False, the paths are indexed
+#       entirely instead of their informative windows, with the same result), file where to write a checkpoint at the end of a round every checkpoint_interval
+#       seconds ("" for no checkpoint) and the state saved with a checkpoint to resume from (the graph being the one of the checkpoint), if any
 #output: an unzipped graph
-def simple_unzip2(segments, names, gafFile, num_threads, exhaustive = False) :
-
-    if num_threads > 1:
-        print("Problem in multithreading, so setting num threads to 1")
-        num_threads = 1
-
-    lines = []
-    print("Reading the gaf file...")
-    lines = read_GAF_parallel(gafFile, 0, 0, lines, num_threads)
-
-    #get rid of the links that are not in the gaf file
-    if exhaustive :
-        print("Removing unsupported links")
-        segments = remove_unsupported_links(segments, names, lines, careful=True)
-
-    print("Indexing all the paths")
-    on_which_paths_is_this_contig = {}
-    for s in segments :
-        on_which_paths_is_this_contig[s] = []
-
-    paths = []
-    size_of_chunks = 1000
-    beginnings = range(0, len(lines), size_of_chunks)
-    ends = range(size_of_chunks, len(lines)+size_of_chunks, size_of_chunks)
-
-    lock = threading.Lock()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        # Use the executor to map your function over the data
-        results = list(executor.map(create_paths_parallel, [paths]*len(ends), [lines]*len(ends), beginnings, ends, [segments] * len(ends), [names] * len(ends), [lock] * len(ends)))
-        
-    # #trim all the paths :
-    # for p in paths : 
-    #     p.trim()
-
-    print("All the paths are indexed: hccue")
-
-    pa = 0
-    for p in paths :
-        co = 0
-        for c in p.get_contigs() :
-            on_which_paths_is_this_contig[c].append((pa, co))
-            # if c.names == ['1630--1'] :
-            #     print("my litt segment is here! ", p)
-            co += 1
-        pa += 1
+def simple_unzip2(segments, names, gafFile, num_threads, exhaustive = False, order = "graph", telemetry_of_rounds = None, trim = True, \
+                  checkpoint = "", checkpoint_interval = CHECKPOINT_INTERVAL, resume_state = None) :
+
+    if resume_state is not None :
+        segments, paths, potentially_interesting_segments, round_number = load_unzip_checkpoint(segments, resume_state)
+        print("Resuming the untangling after round ", round_number, ", with ", len(paths), " distinct paths")
+
+    else :
+        lines = []
+        print("Reading the gaf file...")
+        lines = read_GAF_parallel(gafFile, 0, 0, lines, num_threads)
+
+        print("Indexing all the paths")
+        paths = index_paths(segments, names, lines, num_threads)
+
+        #get rid of the links that are not in the gaf file. The paths stay valid: they only go through supported links
+        if exhaustive :
+            print("Removing unsupported links")
+            segments = remove_unsupported_links(segments, paths, careful=True)
+
+        #only the informative windows of the paths are indexed and scanned
+        if trim :
+            paths.trim()
+        paths.build_index()
+        print("Positions of the paths indexed: ", np.count_nonzero(paths.in_windows()), " out of ", len(paths.nodes))
+
+        round_number = 0
+        potentially_interesting_segments = set()
+        for segment in segments :
+            if len(segment.links[0]) > 1 or len(segment.links[1]) > 1 :
+                potentially_interesting_segments.add(segment)
 
     toDelete = set()
     go_on = True
-    round = 0
-    potentially_interesting_segments = set()
-    for segment in segments :
-        if len(segment.links[0]) > 1 or len(segment.links[1]) > 1 :
-            potentially_interesting_segments.add(segment)
+    position_of = {segment.ID : s for s, segment in enumerate(segments)} #position of each segment in the list, kept up to date as the copies are appended
+    last_checkpoint = timer()
 
+    #only the segments whose neighborhood changed in the previous round are looked at again
     while go_on :
-        # print("entering round ", round, " with a list of interesting segments of size ", len(potentially_interesting_segments))
-        round += 1
+        round_number += 1
+        time_start = timer()
+        telemetry = {'round' : round_number, 'visited' : 0, 'duplicated' : 0, 'copies' : 0, 'cancelled' : 0, 'locked' : 0}
         go_on = False
         next_potentially_interesting_segments = set()
 
-        size_of_chunks = 1000
-        beginnings = range(0, len(segments), size_of_chunks)
-        ends = range(size_of_chunks, len(segments)+size_of_chunks, size_of_chunks)
-
-        lock = threading.Lock()
         unexplored_segments = set()
 
-        # if round == 50:
-        #     tuple_to_store = (segments, beginnings, ends, on_which_paths_is_this_contig, paths, potentially_interesting_segments, next_potentially_interesting_segments, unexplored_segments, toDelete)
-        #     pickle.dump(tuple_to_store, "/home/rfaure/Documents/these/Alice/human/tmp.pickle")
-        #     sys.exit()
-
-        #for now we will not parallelize the process_chunk_of_segments function, to be improved in the future
-        results = [process_chunk_of_segments(segments, 0, len(segments), on_which_paths_is_this_contig, paths, potentially_interesting_segments, unexplored_segments, next_potentially_interesting_segments, toDelete, lock)]
+        #the segments are evaluated in parallel, the duplications are then made one by one in the order of the worklist
+        worklist = order_worklist(segments, potentially_interesting_segments, position_of, paths, order)
+        results = [process_worklist(segments, paths, worklist, position_of, unexplored_segments, next_potentially_interesting_segments, toDelete, telemetry, num_threads)]
 
-        # with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        #     results = list(executor.map(process_chunk_of_segments, [segments]*len(beginnings), beginnings, ends, [on_which_paths_is_this_contig]*len(beginnings), [paths]*len(beginnings), [potentially_interesting_segments]*len(beginnings), [next_potentially_interesting_segments]*len(beginnings), [unexplored_segments]*len(beginnings), [toDelete]*len(beginnings), [lock]*len(beginnings)))                
-
-        #explore the unexplored segments (they could not be explored because of a lock) in a non parallelized manner
-        results.append(process_chunk_of_segments(segments, 0, len(segments), on_which_paths_is_this_contig, paths, unexplored_segments, set(), next_potentially_interesting_segments, toDelete, lock))
+        #explore the unexplored segments (they could not be explored because of a lock)
+        worklist = order_worklist(segments, unexplored_segments, position_of, paths, order)
+        results.append(process_worklist(segments, paths, worklist, position_of, set(), next_potentially_interesting_segments, toDelete, telemetry))
 
         go_on = any(results)
         potentially_interesting_segments = next_potentially_interesting_segments
 
-    delIdx = 0
-    while delIdx < len(segments) :
-        if segments[delIdx] in toDelete :
-            del segments[delIdx]
-            del on_which_paths_is_this_contig[segments[delIdx]]
-        else :
-            delIdx += 1
+        telemetry['seconds'] = timer() - time_start
+        print("Round ", round_number, ": ", telemetry['visited'], " segments visited, ", telemetry['duplicated'], " duplicated into ", telemetry['copies'], " copies, ", \
+              telemetry['locked'], " locked, ", telemetry['cancelled'], " positions of reads cancelled, ", round(telemetry['seconds'], 2), " s")
+        if telemetry_of_rounds is not None :
+            telemetry_of_rounds.append(telemetry)
+
+        if checkpoint != "" and go_on and timer() - last_checkpoint >= checkpoint_interval :
+            print("Writing a checkpoint of the untangling in ", checkpoint)
+            export_unzip_checkpoint(checkpoint, segments, names, paths, potentially_interesting_segments, toDelete, round_number)
+            last_checkpoint = timer()
+
+    sg.compact_segments(segments, set([segment.ID for segment in toDelete]))
             
     # print("NOT DETACHING TIPS")
     print("Detach and destroy tips")
@@ -540,8 +540,8 @@ def get_rid_of_bad_links(listOfSegments, interactionMatrix, tagInteractionMatrix
                 toRemove.reverse()
                 
                 for n in toRemove :
-                    segment._links[endOfSegment][n].remove_end_of_link(segment._otherEndOfLinks[endOfSegment][n], segment, endOfSegment)
-                    segment.remove_end_of_link(endOfSegment, segment._links[endOfSegment][n], segment._otherEndOfLinks[endOfSegment][n])
+                    segment.links[endOfSegment][n].remove_end_of_link(segment.otherEndOfLinks[endOfSegment][n], segment, endOfSegment)
+                    segment.remove_end_of_link(endOfSegment, segment.links[endOfSegment][n], segment.otherEndOfLinks[endOfSegment][n])
                     
         
     return listOfSegments                        
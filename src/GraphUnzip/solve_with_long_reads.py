@@ -878,23 +878,11 @@ def extended_length(segment, end, thresholdLength, thresholdContigs) :
     
     if thresholdContigs == 0 :
         return False
-    
-    if segment.length > thresholdLength :
-        return True
-    
-    #start by looking down the longest contig, it will be fastest
-    longestContig = [i for i in range(len(segment.links[1-end]))]
-    longestContig.sort(key= lambda x : segment.links[1-end][x].length, reverse = True)
-    
-    #print("Longest contigs : ", longestContig, [segment.links[1-end][i].length for i in longestContig])
-    
-    for n in longestContig[:min(len(longestContig), 2)] : #only explore the 2 most promising neighbors, beyond it's not worth it
-        
-        neighbor = segment.links[1-end][n]
-        if extended_length(neighbor, segment.otherEndOfLinks[1-end][n], thresholdLength-segment.length, thresholdContigs-1) :
-            return True
-        
-    return False
+
+    #only explore the 2 most promising neighbors, beyond it's not worth it. The lengths being integers, a path of at most thresholdContigs contigs is longer
+    #than thresholdLength exactly when the longest extension explored with a budget of thresholdLength + 0.5 is
+    length, dead_end = sg.extended_length(segment, end, thresholdLength + 0.5, thresholdContigs - 1, maxBranches = 2, stopBeyondThreshold = True)
+    return length > thresholdLength
         
         
         
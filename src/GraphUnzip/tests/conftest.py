@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+#the modules of GraphUnzip import each other by their name, as when running graphunzip.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Small random graphs with the alignments of reads on them (GFA + GAF), to test the untangling on graphs looking like the real ones:
+bubble chains (haplotypes sharing runs of contigs, with variant sites and a few repeats) and tangles (haplotypes going through contigs in random orders,
+with hubs linked to random contigs)
+"""
+
+import random
+
+#input : a seed, the kind of graph ('bubbles' or 'tangle'), its number of contigs and of reads, and the maximum number of contigs in the path of a read
+#output : the contigs (list of (name, sequence, depth)), the links (list of (contig 1, end of contig 1, contig 2, end of contig 2)) and the paths
+#         of the reads (list of (read, path) with the path as in a GAF, e.g. >a<b)
+def random_graph(seed, kind = 'bubbles', number_of_contigs = 40, number_of_reads = 300, read_length = 6) :
+
+    rng = random.Random(seed)
+    names = ["contig" + str(i) for i in range(number_of_contigs)]
+    neighbors = {(name, end) : [] for name in names for end in range(2)}
+    links = []
+    def link(a, endA, b, endB) :
+        if (a, endA, b, endB) in links or (b, endB, a, endA) in links :
+            return
+        links.append((a, endA, b, endB))
+        neighbors[(a, endA)].append((b, endB))
+        if (a, endA) != (b, endB) :
+            neighbors[(b, endB)].append((a, endA))
+
+    haplotypes = []
+    if kind == 'tangle' :
+        for h in range(3) :
+            haplotype = rng.sample(names, max(2, number_of_contigs//2))
+            if rng.random() < 0.5 :
+                haplotype += haplotype[:3]
+            haplotypes.append(haplotype)
+    else :
+        haplotypes = [[] for h in range(rng.randint(2, 4))]
+        contigs = iter(names)
+        shared = []
+        try :
+            while True :
+                run = [next(contigs) for i in range(rng.randint(1, 5))]
+                for haplotype in haplotypes :
+                    haplotype.extend(run)
+                shared += run
+                alleles = [next(contigs) for i in range(rng.randint(1, len(haplotypes)))]
+                for h, haplotype in enumerate(haplotypes) :
+                    haplotype.append(alleles[h%len(alleles)])
+                if rng.random() < 0.15 :
+                    repeat = rng.choice(shared)
+                    for haplotype in haplotypes :
+                        haplotype.append(repeat)
+        except StopIteration :
+            pass
+
+    for haplotype in haplotypes :
+        for i in range(len(haplotype)-1) :
+            link(haplotype[i], 1, haplotype[i+1], 0)
+    if kind == 'tangle' :
+        for hub in rng.sample(names, rng.randint(1, max(1, number_of_contigs//8))) :
+            for i in range(rng.randint(1, 6)) :
+                link(hub, rng.randint(0, 1), rng.choice(names), rng.randint(0, 1))
+
+    contigs = [(name, "".join(rng.choice("ACGT") for i in range(rng.randint(50, 300))), round(rng.uniform(5, 60), 1)) for name in names]
+
+    paths = []
+    for r in range(number_of_reads) :
+        if rng.random() < 0.7 : #read following a haplotype
+            haplotype = rng.choice(haplotypes)
+            i = rng.randrange(len(haplotype))
+            path = [(name, 1) for name in haplotype[i:i+rng.randint(2, read_length)]]
+        else : #read wandering in the graph
+            name = rng.choice(names)
+            path = [(name, 1)]
+            for i in range(rng.randint(1, read_length)) :
+                if len(neighbors[(path[-1][0], path[-1][1])]) == 0 :
+                    break
+                neighbor, endOfNeighbor = rng.choice(neighbors[(path[-1][0], path[-1][1])])
+                path.append((neighbor, 1-endOfNeighbor))
+        if len(path) < 2 :
+            continue
+        if rng.random() < 0.5 :
+            path = [(name, 1-orientation) for name, orientation in reversed(path)]
+        paths.append(("read" + str(r), "".join("<>"[orientation] + name for name, orientation in path)))
+
+    return contigs, links, paths
+
+#input : a graph as output by random_graph and the GFA and GAF files to write
+#output : the graph written in the files
+def write_graph(contigs, links, paths, gfa_file, gaf_file) :
+
+    with open(gfa_file, 'w') as gfa :
+        for name, sequence, depth in contigs :
+            gfa.write("S\t" + name + "\t" + sequence + "\tDP:f:" + str(depth) + "\n")
+        for a, endA, b, endB in links :
+            gfa.write("L\t" + a + "\t" + "-+"[endA] + "\t" + b + "\t" + "+-"[endB] + "\t0M\n")
+
+    with open(gaf_file, 'w') as gaf :
+        for read, path in paths :
+            gaf.write(read + "\t1000\t0\t1000\t+\t" + path + "\t1000\t0\t1000\t1000\t1000\t60\tid:f:0.99\n")
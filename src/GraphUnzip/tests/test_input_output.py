@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import input_output as io
+from random_graphs import random_graph, write_graph
+
+GRAPHUNZIP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "graphunzip.py")
+
+def test_segments_are_numbered_in_the_order_of_the_GFA(tmp_path) :
+
+    contigs, links, paths = random_graph(0, number_of_contigs = 200)
+    write_graph(contigs, links, paths, str(tmp_path / "g.gfa"), str(tmp_path / "g.gaf"))
+
+    for threads in (1, 4) :
+        segments, names = io.load_GFA_parallel(str(tmp_path / "g.gfa"), threads)
+        assert [segment.names[0] for segment in segments] == [name for name, sequence, depth in contigs]
+        assert [segment.ID for segment in segments] == sorted(segment.ID for segment in segments)
+
+@pytest.mark.parametrize("seed, kind", [(1, 'bubbles'), (1, 'tangle'), (2, 'tangle'), (6, 'tangle')])
+def test_output_does_not_depend_on_the_number_of_threads(tmp_path, seed, kind) :
+
+    contigs, links, paths = random_graph(seed, kind, number_of_contigs = 150, number_of_reads = 1500)
+    write_graph(contigs, links, paths, str(tmp_path / "g.gfa"), str(tmp_path / "g.gaf"))
+
+    outputs = []
+    for threads in (1, 4, 4, 4, 4) :
+        output = str(tmp_path / ("out_" + str(len(outputs)) + ".gfa"))
+        subprocess.run([sys.executable, GRAPHUNZIP, "unzip", "-g", str(tmp_path / "g.gfa"), "-l", str(tmp_path / "g.gaf"), "-o", output, "-t", str(threads)], \
+                       cwd = str(tmp_path), check = True, stdout = subprocess.DEVNULL)
+        with open(output, 'rb') as f :
+            outputs.append(f.read())
+
+    assert all(output == outputs[0] for output in outputs)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from segment import Segment, add_link, delete_link, delete_links_present_twice, remove_links_in_bulk
+
+#input : the links added to each end of a segment, in their order of insertion
+#output : the links as the segment should list them: sorted by (ID of the neighbor, end of the neighbor), the copies of a link in their order of insertion
+def expected_links(reference) :
+    return [sorted(reference[end], key = lambda link : (link[0].ID, link[1])) for end in range(2)]
+
+def links_of(segment) :
+    return [list(zip(segment.links[end], segment.otherEndOfLinks[end], segment.CIGARs[end])) for end in range(2)]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_links_stay_sorted_when_added_and_removed_in_any_order(seed) :
+
+    rng = random.Random(seed)
+    segments = [Segment([str(i)], [1], [100]) for i in range(8)]
+    reference = {segment.ID : [[], []] for segment in segments}
+    hub = segments[0]
+
+    for step in range(300) :
+        neighbor = rng.choice(segments[1:])
+        end, otherEnd = rng.randint(0, 1), rng.randint(0, 1)
+        links = reference[hub.ID][end]
+        present = [i for i, link in enumerate(links) if link[0] is neighbor and link[1] == otherEnd]
+        action = rng.random()
+        if action < 0.5 :
+            CIGAR = str(step) + "M"
+            hub.add_end_of_link(end, neighbor, otherEnd, CIGAR)
+            links.append((neighbor, otherEnd, CIGAR))
+        elif action < 0.8 :
+            assert hub.remove_end_of_link(end, neighbor, otherEnd, warning = False) == (True if present else None)
+            if present :
+                del links[present[-1]]
+        elif action < 0.9 :
+            hub._remove_link(end, neighbor.ID, otherEnd)
+            reference[hub.ID][end] = [link for link in links if not (link[0] is neighbor and link[1] == otherEnd)]
+        else :
+            CIGAR = "x" + str(step)
+            assert hub.set_CIGAR(end, neighbor, otherEnd, CIGAR) == (0 if present else -1)
+            if present :
+                links[present[0]] = (neighbor, otherEnd, CIGAR)
+
+        assert links_of(hub) == expected_links(reference[hub.ID])
+        for e in range(2) :
+            for neighbor in segments[1:] :
+                assert hub.has_link(e, neighbor) == any(link[0] is neighbor for link in reference[hub.ID][e])
+
+def test_links_present_several_times_are_deleted_once() :
+
+    a, b, c = [Segment([name], [1], [100]) for name in "abc"]
+    add_link(a, 1, b, 0, "1M")
+    add_link(a, 1, b, 0, "2M")
+    add_link(a, 1, b, 0, "3M")
+    add_link(a, 1, c, 1, "0M")
+    add_link(a, 0, a, 0, "0M") #a link from one end to itself is present twice at this end, and kept
+
+    assert sorted((n.names[0], e, count) for n, e, count in a.get_links_present_several_times(1)) == [('b', 0, 3)]
+    delete_links_present_twice([a, b, c])
+
+    assert links_of(a) == [[(a, 0, "0M"), (a, 0, "0M")], [(b, 0, "1M"), (c, 1, "0M")]]
+    assert links_of(b) == [[(a, 1, "1M")], []]
+    assert a.get_links_present_several_times(1) == []
+
+    remove_links_in_bulk([(a, 1, c, 1)])
+    delete_link(a, 1, b, 0)
+    assert links_of(a)[1] == [] and links_of(b) == [[], []] and links_of(c) == [[], []]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io as _io
+
+import pytest
+
+import input_output as io
+import simple_unzip
+from simple_unzip import CANCELLED, simple_unzip2
+from random_graphs import random_graph, write_graph
+
+#input : a list of segments and the ID of the first segment of the graph loaded
+#output : the graph as a list of segments, in their order, with the IDs counted from the first segment loaded: two runs making the same duplications in the
+#         same order give the same list
+def canonical(segments, first_ID) :
+
+    return [(segment.ID - first_ID, segment.names, segment.orientations, [round(d, 6) for d in segment.depths], \
+             [[(neighbor.ID - first_ID, otherEnd, CIGAR) for neighbor, otherEnd, CIGAR in zip(segment.links[end], segment.otherEndOfLinks[end], segment.CIGARs[end])] for end in range(2)]) \
+            for segment in segments]
+
+#input : the folder where to write the graph, the arguments of random_graph and of simple_unzip2
+#output : the graph untangled by simple_unzip2, as given by canonical
+def unzip(tmp_path, seed, kind, number_of_contigs = 30, number_of_reads = 300, read_length = 6, num_threads = 1, **options) :
+
+    contigs, links, paths = random_graph(seed, kind, number_of_contigs = number_of_contigs, number_of_reads = number_of_reads, read_length = read_length)
+    write_graph(contigs, links, paths, str(tmp_path / "g.gfa"), str(tmp_path / "g.gaf"))
+    with contextlib.redirect_stdout(_io.StringIO()) :
+        segments, names = io.load_GFA_parallel(str(tmp_path / "g.gfa"), 1)
+        first_ID = segments[0].ID
+        segments = simple_unzip2(segments, names, str(tmp_path / "g.gaf"), num_threads, **options)
+    return canonical(segments, first_ID)
+
+@pytest.mark.parametrize("exhaustive", [False, True])
+@pytest.mark.parametrize("order", simple_unzip.UNZIP_ORDERS)
+@pytest.mark.parametrize("seed, kind", [(seed, kind) for seed in range(6) for kind in ('bubbles', 'tangle')])
+def test_trimming_the_paths_does_not_change_the_result(tmp_path, seed, kind, order, exhaustive) :
+
+    trimmed = unzip(tmp_path, seed, kind, order = order, exhaustive = exhaustive, trim = True)
+    assert trimmed == unzip(tmp_path, seed, kind, order = order, exhaustive = exhaustive, trim = False)
+
+#graphs where duplications bring hidden contigs back into the windows of the paths (unhide), or cancel hidden contigs that have been duplicated
+@pytest.mark.parametrize("exhaustive", [False, True])
+@pytest.mark.parametrize("seed, number_of_contigs, number_of_reads, read_length, event", \
+                         [(1, 20, 150, 4, 'unhide'), (23, 30, 300, 8, 'unhide'), (0, 30, 300, 8, 'cancel')])
+def test_windows_re_expand_after_duplications(tmp_path, monkeypatch, seed, number_of_contigs, number_of_reads, read_length, event, exhaustive) :
+
+    events = {'unhide' : 0, 'cancel' : 0}
+    unhide = simple_unzip.PathSet.unhide
+    borders_branch_point = simple_unzip.PathSet.borders_branch_point
+
+    def counting_unhide(self, position, path) :
+        events['unhide'] += 1
+        return unhide(self, position, path)
+
+    def counting_borders_branch_point(self, hidden, border) :
+        was_cancelled = self.nodes[hidden] == CANCELLED
+        result = borders_branch_point(self, hidden, border)
+        events['cancel'] += not was_cancelled and self.nodes[hidden] == CANCELLED
+        return result
+
+    monkeypatch.setattr(simple_unzip.PathSet, "unhide", counting_unhide)
+    monkeypatch.setattr(simple_unzip.PathSet, "borders_branch_point", counting_borders_branch_point)
+
+    graph = dict(number_of_contigs = number_of_contigs, number_of_reads = number_of_reads, read_length = read_length, exhaustive = exhaustive)
+    trimmed = unzip(tmp_path, seed, 'bubbles', trim = True, **graph)
+    assert events[event] > 0
+    assert trimmed == unzip(tmp_path, seed, 'bubbles', trim = False, **graph)
+
+@pytest.mark.parametrize("order", simple_unzip.UNZIP_ORDERS)
+@pytest.mark.parametrize("seed, kind", [(seed, kind) for seed in range(4) for kind in ('bubbles', 'tangle')])
+def test_evaluating_in_parallel_does_not_change_the_result(tmp_path, monkeypatch, seed, kind, order) :
+
+    #even the small worklists of these graphs are evaluated by the worker processes
+    monkeypatch.setattr(simple_unzip, "MIN_SEGMENTS_PER_PROCESS", 1)
+    evaluated_in_parallel = []
+    evaluate_segments_in_parallel = simple_unzip.evaluate_segments_in_parallel
+
+    def counting_evaluate_segments_in_parallel(segments, indices, paths, num_processes) :
+        decisions = evaluate_segments_in_parallel(segments, indices, paths, num_processes)
+        evaluated_in_parallel.append(len(decisions))
+        return decisions
+
+    monkeypatch.setattr(simple_unzip, "evaluate_segments_in_parallel", counting_evaluate_segments_in_parallel)
+
+    serial = unzip(tmp_path, seed, kind, number_of_contigs = 60, number_of_reads = 600, order = order, num_threads = 1)
+    assert sum(evaluated_in_parallel) == 0
+    assert unzip(tmp_path, seed, kind, number_of_contigs = 60, number_of_reads = 600, order = order, num_threads = 4) == serial
+    assert sum(evaluated_in_parallel) > 0